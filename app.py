@@ -1,101 +1,33 @@
 # app.py
+import hmac
 import os
-import sys
+import time
 from flask import Flask, request, jsonify
 from config.settings import (
-    CHAT_API, SYNOLOGY, CONVERSATION, HTTP,
+    CHAT_API, USAGE, ADMISSION, CAPTURE, READINESS, DEADLINE, PROFILER, ADMIN,
     get_server_config, is_development, ENVIRONMENT, APP_VERSION
 )
-from src.bot.chat_manager import ChatManager
+from src.bot.admission import AdmissionController
+from src.bot.bot_registry import BotRegistry
+from src.bot.readiness import ReadinessProbe
+from src.bot.startup import run_startup_checks
 from src.utils.api_tester import APITester
-
-def validate_startup_requirements():
-    """验证启动所需的配置 / Validate startup requirements"""
-    print("🔍 Validating startup configuration...")
-
-    api_type = CHAT_API['type'].lower()
-    print(f"   API Type: {api_type}")
-
-    # 基础必须配置 / Base required configurations
-    required_configs = {
-        'CHAT_API_URL': CHAT_API['url'],
-        'CHAT_API_KEY': CHAT_API['api_key'],
-        'SYNOLOGY_INCOMING_WEBHOOK_URL': SYNOLOGY['incoming_webhook_url'],
-        'SYNOLOGY_OUTGOING_WEBHOOK_TOKEN': SYNOLOGY['outgoing_webhook_token'],
-    }
-
-    # CHAT_API_MODEL 仅在 OpenAI 类型时必需，Dify 在平台侧配置模型
-    # CHAT_API_MODEL is only required for OpenAI type, Dify configures model on platform side
-    if api_type == 'openai':
-        required_configs['CHAT_API_MODEL'] = CHAT_API['model']
-
-    missing_configs = []
-    for key, value in required_configs.items():
-        if not value or value == '' or 'your_' in value.lower():
-            missing_configs.append(key)
-
-    if missing_configs:
-        print("❌ Missing required configurations:")
-        for config in missing_configs:
-            print(f"   - {config}")
-        return False
-
-    print("✅ Configuration validation passed")
-    return True
-
-def test_api_connectivity():
-    """测试API连接性 / Test API connectivity"""
-    print("🧪 Testing LLM API connectivity...")
-
-    config = {
-        'CHAT_API': CHAT_API,
-        'HTTP': HTTP
-    }
-
-    tester = APITester(config)
-    result = tester.test_chat_api()
-
-    if not result['success']:
-        print("❌ API test failed:")
-        print(f"   Error: {result['error']}")
-        if 'details' in result:
-            print(f"   Details: {result['details']}")
-        return False
-
-    print("✅ API test passed")
-    return True
+from src.utils.deadline import Deadline, deadline_scope
+from src.utils.metrics import metrics
+from src.utils.profiler import request_profiler
+from src.utils.traffic_recorder import traffic_recorder
+from src.utils.usage_ledger import usage_ledger
 
 def create_app():
     """应用工厂函数 / Application factory function"""
     print("🚀 Starting Synology Chat Bot")
     print("=" * 50)
 
-    # 验证启动要求 / Validate startup requirements
-    if not validate_startup_requirements():
-        print("❌ Startup configuration validation failed")
-        sys.exit(1)
-
-    # 测试API连接 / Test API connection
-    if not test_api_connectivity():
-        print("❌ API connectivity test failed")
-        print("💡 Please check:")
-        print("   1. CHAT_API_URL is correct")
-        print("   2. CHAT_API_KEY is valid")
-        if CHAT_API['type'].lower() == 'openai':
-            print("   3. CHAT_API_MODEL is correct")
-        print("   4. Network connection is working")
-        sys.exit(1)
+    # 加载机器人配置并执行启动检查 / Load bot configurations and run startup checks
+    bot_configs = run_startup_checks()
 
     print("✅ All startup checks passed, initializing application...")
 
-    # 创建配置字典 / Create configuration dictionary
-    config = {
-        'CHAT_API': CHAT_API,
-        'SYNOLOGY': SYNOLOGY,
-        'CONVERSATION': CONVERSATION,
-        'HTTP': HTTP
-    }
-
     # 初始化Flask应用 / Initialize Flask application
     app = Flask(__name__)
 
@@ -103,17 +35,60 @@ def create_app():
     server_config = get_server_config()
     app.config['DEBUG'] = server_config['debug']
 
-    # 初始化聊天管理器 / Initialize chat manager
-    chat_manager = ChatManager(config)
+    # 配置用量账本 / Configure usage ledger
+    usage_ledger.configure(USAGE)
+
+    # 配置流量录制 / Configure traffic capture
+    traffic_recorder.configure(CAPTURE)
+
+    # 配置请求采样分析 / Configure the request profiler
+    request_profiler.configure(PROFILER)
+
+    # 初始化机器人（每个机器人一个聊天管理器）/ Initialize bots (one chat manager per bot)
+    registry = BotRegistry(bot_configs)
+
+    # 准入控制（所有机器人共用 worker 容量）/ Admission control shared by all bots
+    admission = AdmissionController(ADMISSION)
+
+    # 就绪检查（供负载均衡判断实例是否饱和）/ Readiness probe for load balancers
+    readiness = ReadinessProbe(READINESS, admission)
+
+    # /api-test 复用共享的 Provider 及其连接池 / Reuse the shared provider and its connection pool
+    api_tester = APITester(bot_configs[0])
 
     @app.route('/webhook', methods=['POST'])
     def webhook():
         """处理来自Synology Chat的webhook请求 / Handle webhook requests from Synology Chat"""
         try:
+            received_at = time.time()
+            start = time.perf_counter()
             form_data = request.form
-            event = {key: form_data.get(key) for key in form_data}
-            chat_manager.handle_event(event)
-            return 'OK', 200
+            # 先校验 token 再构建事件 / Validate the token before building the event
+            chat_manager = registry.get(form_data.get('token', ''))
+            if chat_manager is None:
+                app.logger.warning("Webhook token does not match any bot, rejecting request")
+                return 'OK', 200
+
+            # 请求截止时间沿调用链传递，每一跳只使用剩余时间 / The deadline bounds every downstream hop
+            with deadline_scope(Deadline(DEADLINE['budget']) if DEADLINE['budget'] else None):
+                # 超出处理能力时快速拒绝 / Shed load early when over capacity
+                if not admission.try_acquire():
+                    chat_manager.reject(form_data.get('user_id', ''), admission.busy_text)
+                    status = 503
+                else:
+                    try:
+                        event = {key: form_data.get(key) for key in form_data}
+                        # 抽样或慢请求的调用栈写入 PROFILE_DIR / Sampled or slow requests are profiled
+                        with request_profiler.profile(chat_manager.name):
+                            chat_manager.handle_event(event)
+                        status = 200
+                    finally:
+                        admission.release()
+
+            # 录制请求与耗时（可选）/ Record the request and its timing (opt-in)
+            traffic_recorder.record(form_data, chat_manager.name, status,
+                                    time.perf_counter() - start, received_at)
+            return ('OK', 200) if status == 200 else ('Busy', 503)
         except Exception as e:
             app.logger.error(f"Error processing webhook: {str(e)}")
             return 'Error', 500
@@ -131,11 +106,60 @@ def create_app():
             'api_model': CHAT_API['model'] or 'N/A (configured on platform)'
         }), 200
 
+    @app.route('/ready', methods=['GET'])
+    def ready_check():
+        """就绪检查端点，饱和时返回 503 / Readiness endpoint, 503 when saturated"""
+        ready, details = readiness.check()
+        return jsonify({'status': 'ready' if ready else 'saturated', **details}), 200 if ready else 503
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """运行指标端点 / Runtime metrics endpoint"""
+        return jsonify(metrics.snapshot()), 200
+
+    def is_admin():
+        """校验 ADMIN_TOKEN（Authorization: Bearer 或 ?token=）/ Check the admin token"""
+        if not ADMIN['token']:
+            return False
+        supplied = request.headers.get('Authorization', '')
+        supplied = supplied[7:] if supplied.startswith('Bearer ') else request.args.get('token', '')
+        return hmac.compare_digest(supplied.encode('utf-8'), ADMIN['token'].encode('utf-8'))
+
+    @app.route('/admin/bots', methods=['GET'])
+    def bots_stats():
+        """各机器人的会话占用与吞吐统计（需要 ADMIN_TOKEN）/ Per-bot memory and throughput stats"""
+        if not is_admin():
+            return jsonify({'error': 'unauthorized'}), 401 if ADMIN['token'] else 404
+        return jsonify(registry.get_stats()), 200
+
+    @app.route('/admin/usage', methods=['GET'])
+    def usage_summary():
+        """Token 用量汇总（需要 ADMIN_TOKEN）/ Token usage summary endpoint"""
+        if not is_admin():
+            return jsonify({'error': 'unauthorized'}), 401 if ADMIN['token'] else 404
+        return jsonify(usage_ledger.summary(
+            day=request.args.get('day'),
+            user_id=request.args.get('user_id'),
+            top=request.args.get('top', 10, type=int)
+        )), 200
+
+    @app.route('/admin/profile', methods=['GET'])
+    def profile_report():
+        """热点函数汇总（需要 ADMIN_TOKEN）/ Aggregated top-N functions from request profiles"""
+        if not is_admin():
+            return jsonify({'error': 'unauthorized'}), 401 if ADMIN['token'] else 404
+        return jsonify(request_profiler.report(
+            top=request.args.get('top', 20, type=int),
+            by=request.args.get('by', 'function'),
+            sort=request.args.get('sort', 'self'),
+            limit=request.args.get('limit', 0, type=int)
+        )), 200
+
     @app.route('/api-test', methods=['GET'])
     def api_test():
-        """API测试端点 / API test endpoint"""
-        tester = APITester(config)
-        result = tester.test_chat_api()
+        """API测试端点（结果按 API_TEST_CACHE_TTL 缓存）/ API test endpoint (cached for API_TEST_CACHE_TTL)"""
+        result = api_tester.get_cached_result()
+        result['stats'] = api_tester.get_stats()
         return jsonify(result)
 
     @app.route('/', methods=['GET'])
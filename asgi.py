@@ -0,0 +1,277 @@
+# asgi.py
+"""
+ASGI 入口 / ASGI entry point
+
+与 app.py 提供相同的端点，但 webhook 处理全程运行在事件循环中：LLM 请求、回复投递、
+输入提示与准入排队都使用 httpx.AsyncClient 和 asyncio，等待上游时不占用线程，
+单个进程可以同时等待数千个上游请求。
+Serves the same endpoints as app.py, but the webhook pipeline runs on the event loop:
+upstream waits hold no thread, so one process can keep thousands of LLM calls in flight.
+
+使用方法 / Usage:
+    pip install httpx uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 8008
+    GUNICORN_WORKER_CLASS=asgi gunicorn --config gunicorn.conf.py asgi:app
+
+请求采样分析（PROFILE_*）按线程采样，只在 WSGI 模式（app.py）中可用。
+The request profiler samples per thread and is only available in WSGI mode.
+"""
+import hmac
+import json
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from urllib.parse import parse_qsl
+
+from config.settings import (
+    CHAT_API, USAGE, ADMISSION, CAPTURE, READINESS, DEADLINE, PROFILER, ADMIN,
+    get_server_config, ENVIRONMENT, APP_VERSION
+)
+from src.bot.admission import AdmissionController
+from src.bot.bot_registry import BotRegistry
+from src.bot.conversation_store import ConversationStore
+from src.bot.dead_letter import DeadLetterSpool
+from src.bot.readiness import ReadinessProbe
+from src.bot.startup import run_startup_checks
+from src.utils.api_tester import APITester
+from src.utils.async_http import close_async_clients, require_httpx
+from src.utils.deadline import Deadline, deadline_scope
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.utils.traffic_recorder import traffic_recorder
+from src.utils.usage_ledger import usage_ledger
+
+# (状态码, 内容类型, 响应体) / (status, content type, body)
+Response = Tuple[int, str, bytes]
+Handler = Callable[[Dict[str, Any], Dict[str, str], bytes], Awaitable[Response]]
+
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    return status, 'application/json', json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def text_response(text: str, status: int = 200) -> Response:
+    return status, 'text/plain; charset=utf-8', text.encode('utf-8')
+
+
+def parse_form(body: bytes) -> Dict[str, str]:
+    """解析 urlencoded 表单，同名字段取第一个值（与 Flask request.form.get 一致）/ Parse an urlencoded form"""
+    form: Dict[str, str] = {}
+    for key, value in parse_qsl(body.decode('utf-8', errors='replace'), keep_blank_values=True):
+        form.setdefault(key, value)
+    return form
+
+
+def query_int(query: Dict[str, str], key: str, default: int) -> int:
+    try:
+        return int(query[key])
+    except (KeyError, ValueError):
+        return default
+
+
+def is_admin(scope: Dict[str, Any], query: Dict[str, str]) -> bool:
+    """校验 ADMIN_TOKEN（Authorization: Bearer 或 ?token=）/ Check the admin token"""
+    if not ADMIN['token']:
+        return False
+    headers = dict(scope.get('headers', []))
+    supplied = headers.get(b'authorization', b'').decode('latin-1')
+    supplied = supplied[7:] if supplied.startswith('Bearer ') else query.get('token', '')
+    return hmac.compare_digest(supplied.encode('utf-8'), ADMIN['token'].encode('utf-8'))
+
+
+async def read_body(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def create_app():
+    """ASGI 应用工厂函数 / ASGI application factory function"""
+    print("🚀 Starting Synology Chat Bot (ASGI)")
+    print("=" * 50)
+
+    try:
+        require_httpx()
+    except RuntimeError as e:
+        print(f"❌ {str(e)}")
+        sys.exit(1)
+
+    # 加载机器人配置并执行启动检查 / Load bot configurations and run startup checks
+    bot_configs = run_startup_checks()
+
+    print("✅ All startup checks passed, initializing application...")
+
+    server_config = get_server_config()
+
+    # 配置用量账本 / Configure usage ledger
+    usage_ledger.configure(USAGE)
+
+    # 配置流量录制 / Configure traffic capture
+    traffic_recorder.configure(CAPTURE)
+
+    if PROFILER['sample_rate'] or PROFILER['slow_threshold']:
+        print("⚠️  Request profiler is not supported in ASGI mode, PROFILE_* settings ignored")
+
+    # 初始化机器人（每个机器人一个聊天管理器）/ Initialize bots (one chat manager per bot)
+    registry = BotRegistry(bot_configs)
+
+    # 准入控制（排队在事件循环中进行）/ Admission control, queueing on the event loop
+    admission = AdmissionController(ADMISSION)
+
+    # 就绪检查（供负载均衡判断实例是否饱和）/ Readiness probe for load balancers
+    readiness = ReadinessProbe(READINESS, admission)
+
+    # /api-test 复用共享的 Provider / Reuse the shared provider
+    api_tester = APITester(bot_configs[0])
+
+    async def webhook(scope, query, body):
+        """处理来自Synology Chat的webhook请求 / Handle webhook requests from Synology Chat"""
+        try:
+            received_at = time.time()
+            start = time.perf_counter()
+            form_data = parse_form(body)
+            # 先校验 token 再构建事件 / Validate the token before building the event
+            chat_manager = registry.get(form_data.get('token', ''))
+            if chat_manager is None:
+                logger.warning("Webhook token does not match any bot, rejecting request")
+                return text_response('OK')
+
+            # 请求截止时间沿调用链传递，每一跳只使用剩余时间 / The deadline bounds every downstream hop
+            with deadline_scope(Deadline(DEADLINE['budget']) if DEADLINE['budget'] else None):
+                # 超出处理能力时快速拒绝 / Shed load early when over capacity
+                if not await admission.try_acquire_async():
+                    await chat_manager.reject_async(form_data.get('user_id', ''), admission.busy_text)
+                    status = 503
+                else:
+                    try:
+                        await chat_manager.handle_event_async(dict(form_data))
+                        status = 200
+                    finally:
+                        admission.release()
+
+            # 录制请求与耗时（可选）/ Record the request and its timing (opt-in)
+            traffic_recorder.record(form_data, chat_manager.name, status,
+                                    time.perf_counter() - start, received_at)
+            return text_response('OK') if status == 200 else text_response('Busy', 503)
+        except Exception as e:
+            logger.error(f"Error processing webhook: {str(e)}")
+            return text_response('Error', 500)
+
+    async def health_check(scope, query, body):
+        """健康检查端点 / Health check endpoint"""
+        return json_response({
+            'status': 'healthy',
+            'service': 'synology-chat-bot',
+            'environment': ENVIRONMENT,
+            'debug_mode': server_config['debug'],
+            'version': APP_VERSION,
+            'api_type': CHAT_API['type'],
+            'api_model': CHAT_API['model'] or 'N/A (configured on platform)',
+            'server': 'asgi'
+        })
+
+    async def ready_check(scope, query, body):
+        """就绪检查端点，饱和时返回 503 / Readiness endpoint, 503 when saturated"""
+        ready, details = readiness.check()
+        return json_response({'status': 'ready' if ready else 'saturated', **details}, 200 if ready else 503)
+
+    async def metrics_endpoint(scope, query, body):
+        """运行指标端点 / Runtime metrics endpoint"""
+        return json_response(metrics.snapshot())
+
+    async def bots_stats(scope, query, body):
+        """各机器人的会话占用与吞吐统计（需要 ADMIN_TOKEN）/ Per-bot memory and throughput stats"""
+        if not is_admin(scope, query):
+            return json_response({'error': 'unauthorized'}, 401 if ADMIN['token'] else 404)
+        return json_response(registry.get_stats())
+
+    async def usage_summary(scope, query, body):
+        """Token 用量汇总（需要 ADMIN_TOKEN）/ Token usage summary endpoint"""
+        if not is_admin(scope, query):
+            return json_response({'error': 'unauthorized'}, 401 if ADMIN['token'] else 404)
+        return json_response(usage_ledger.summary(
+            day=query.get('day'),
+            user_id=query.get('user_id'),
+            top=query_int(query, 'top', 10)
+        ))
+
+    async def api_test(scope, query, body):
+        """API测试端点（结果按 API_TEST_CACHE_TTL 缓存）/ API test endpoint (cached for API_TEST_CACHE_TTL)"""
+        result = await api_tester.get_cached_result_async()
+        result['stats'] = api_tester.get_stats()
+        return json_response(result)
+
+    async def root(scope, query, body):
+        """根路径 / Root path"""
+        return json_response({
+            'message': 'Synology Chat Bot is running',
+            'status': 'ok',
+            'environment': ENVIRONMENT,
+            'api_type': CHAT_API['type'],
+            'api_model': CHAT_API['model'] or 'N/A (configured on platform)'
+        })
+
+    routes: Dict[Tuple[str, str], Handler] = {
+        ('POST', '/webhook'): webhook,
+        ('GET', '/health'): health_check,
+        ('GET', '/ready'): ready_check,
+        ('GET', '/metrics'): metrics_endpoint,
+        ('GET', '/admin/bots'): bots_stats,
+        ('GET', '/admin/usage'): usage_summary,
+        ('GET', '/api-test'): api_test,
+        ('GET', '/'): root,
+    }
+    paths = {path for _, path in routes}
+
+    async def lifespan(receive, send):
+        """进程退出时关闭连接池并写入剩余用量和会话快照 / Close pools, flush usage and conversation state on shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # 重投上次运行遗留的回复 / Redeliver replies left over from the last run
+                DeadLetterSpool.start_all()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_clients()
+                usage_ledger.stop()
+                ConversationStore.stop_all()
+                DeadLetterSpool.stop_all()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        handler = routes.get((scope['method'], scope['path']))
+        if handler is not None:
+            query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+            status, content_type, payload = await handler(scope, query, await read_body(receive))
+        elif scope['path'] in paths:
+            status, content_type, payload = text_response('Method Not Allowed', 405)
+        else:
+            status, content_type, payload = text_response('Not Found', 404)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', content_type.encode('latin-1')),
+                        (b'content-length', str(len(payload)).encode('latin-1'))],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    print("🎉 Application initialization completed!")
+    return app
+
+
+# 创建应用实例（用于 uvicorn / gunicorn）/ Create application instance (for uvicorn / gunicorn)
+app = create_app()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+批量离线提问脚本 / Bulk offline prompt runner
+
+从 JSONL 读取提示（每行 {"id": ..., "prompt": ...}），通过与机器人相同的
+ProviderFactory / ChatProvider 以受限并发发送，结果逐行写入输出 JSONL
+（含延迟与 token 用量）。输出文件即检查点：中断后以相同命令重新运行，
+已成功的 id 会被跳过，失败的会重试。
+
+并发按 AIMD 自适应调整：请求成功时逐步增加，失败（含上游限流重试耗尽）时减半；
+上游连接失败和 429/502/503 由 Provider 的重试策略处理（遵循 Retry-After）。
+
+使用方法:
+    python batch_run.py prompts.jsonl results.jsonl
+    python batch_run.py prompts.jsonl results.jsonl --concurrency 16 --rps 5
+    python batch_run.py faq.jsonl faq-new-prompt.jsonl --system-prompt "You are ..."
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Set
+
+# 批量运行时默认只输出警告，避免每个请求都打印日志
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from config.settings import CHAT_API, CIRCUIT_BREAKER, CONVERSATION, HTTP, USAGE
+from src.models.conversation import Conversation
+from src.providers.circuit_breaker import OPEN
+from src.providers.factory import ProviderFactory
+from src.utils.usage_ledger import usage_ledger
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 并发限制器
+
+    成功时窗口每轮加 1（每次成功加 1/limit），失败时减半，范围 [1, max_concurrency]；
+    可选按 rps 限制请求发起速率。
+    """
+
+    def __init__(self, max_concurrency: int, rps: float = 0.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.min_interval = 1.0 / rps if rps > 0 else 0.0
+        self._inflight = 0
+        self._next_start = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self._inflight >= int(self.limit):
+                self._cond.wait()
+            self._inflight += 1
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, success: bool) -> None:
+        with self._cond:
+            self._inflight -= 1
+            if success:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(1.0, self.limit / 2)
+            self._cond.notify_all()
+
+
+def load_prompts(path: str) -> List[Dict[str, Any]]:
+    """读取提示文件，缺少 id 时使用行号"""
+    prompts: List[Dict[str, Any]] = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                print(f"⚠️  Skipping invalid JSON on line {line_no}")
+                continue
+            if isinstance(item, str):
+                item = {'prompt': item}
+            item.setdefault('id', line_no)
+            prompts.append(item)
+    return prompts
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """读取已有输出，返回已成功完成的 id"""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # 中断时最后一行可能不完整
+            if result.get('error') is None:
+                done.add(str(result.get('id')))
+    return done
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_prompt(provider, item: Dict[str, Any]) -> Dict[str, Any]:
+    """通过 Provider 发送一条提示"""
+    user_id = str(item.get('user_id') or f"batch-{item['id']}")
+    conversation = Conversation(user_id, CONVERSATION['max_history'], CONVERSATION['timeout'])
+    conversation.add_message('user', item['prompt'])
+
+    start = time.perf_counter()
+    response = provider.send_message(user_id, item['prompt'], conversation)
+    latency = time.perf_counter() - start
+    usage = dict(provider.last_usage())
+
+    # Dify 按用户保存服务端会话，批量请求之间互不关联
+    if hasattr(provider, 'clear_user_conversation'):
+        provider.clear_user_conversation(user_id)
+
+    return {
+        'id': item['id'],
+        'response': response,
+        'error': None if response is not None else 'request failed (see log)',
+        'latency': round(latency, 3),
+        'model': usage.pop('model', CHAT_API.get('model', '')),
+        'usage': usage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the configured chat provider")
+    parser.add_argument('input', help='JSONL with {"id": ..., "prompt": ...} per line')
+    parser.add_argument('output', help="JSONL results file (also the resume checkpoint)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Maximum concurrent requests")
+    parser.add_argument('--rps', type=float, default=0.0, help="Maximum requests started per second (0 = unlimited)")
+    parser.add_argument('--system-prompt', default=None, help="Override CHAT_API_SYSTEM_PROMPT")
+    parser.add_argument('--model', default=None, help="Override CHAT_API_MODEL")
+    args = parser.parse_args()
+
+    chat_api = dict(CHAT_API)
+    if args.system_prompt is not None:
+        chat_api['system_prompt'] = args.system_prompt
+    if args.model:
+        chat_api['model'] = args.model
+        chat_api['router_models'] = ''
+    config = {
+        'CHAT_API': chat_api,
+        'HTTP': {**HTTP, 'pool_size': max(HTTP.get('pool_size', 10), args.concurrency)},
+        'CIRCUIT_BREAKER': CIRCUIT_BREAKER,
+    }
+
+    prompts = load_prompts(args.input)
+    done = load_checkpoint(args.output)
+    pending = [item for item in prompts if str(item['id']) not in done]
+    print(f"📋 {len(prompts)} prompt(s), {len(prompts) - len(pending)} already done, {len(pending)} to run")
+    if not pending:
+        return
+
+    usage_ledger.configure(USAGE)
+    provider = ProviderFactory.get(config)
+    limiter = AdaptiveLimiter(args.concurrency, args.rps)
+    write_lock = threading.Lock()
+    latencies: List[float] = []
+    totals = {'ok': 0, 'failed': 0, 'tokens': 0}
+    start = time.perf_counter()
+
+    with open(args.output, 'a', encoding='utf-8') as out:
+        def work(item: Dict[str, Any]) -> None:
+            success = False
+            try:
+                result = run_prompt(provider, item)
+                success = result['error'] is None
+            except Exception as e:
+                result = {'id': item['id'], 'response': None, 'error': str(e)}
+            finally:
+                limiter.release(success)
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+                if success:
+                    totals['ok'] += 1
+                    latencies.append(result['latency'])
+                    totals['tokens'] += result['usage'].get('total_tokens', 0) or 0
+                else:
+                    totals['failed'] += 1
+                finished = totals['ok'] + totals['failed']
+                if finished % 50 == 0:
+                    print(f"   {finished}/{len(pending)} done "
+                          f"({finished / (time.perf_counter() - start):.1f}/s, concurrency {limiter.limit:.1f})")
+
+        pool = ThreadPoolExecutor(max_workers=args.concurrency)
+        try:
+            for item in pending:
+                if 'prompt' not in item:
+                    print(f"⚠️  Skipping id {item['id']}: missing 'prompt'")
+                    continue
+                # 上游熔断期间暂停提交，避免剩余的提示全部立即失败
+                while provider.breaker.state == OPEN:
+                    time.sleep(0.5)
+                limiter.acquire()
+                pool.submit(work, item)
+        except KeyboardInterrupt:
+            print("\n⏹️  Interrupted, waiting for in-flight requests (rerun the same command to resume)...")
+        finally:
+            pool.shutdown(wait=True)
+
+    usage_ledger.stop()
+    ProviderFactory.close_all()
+    elapsed = time.perf_counter() - start
+    print("=" * 72)
+    print(f"ok {totals['ok']}  failed {totals['failed']}  elapsed {elapsed:.1f}s  "
+          f"throughput {totals['ok'] / elapsed if elapsed > 0 else 0:.2f}/s")
+    print(f"latency p50={percentile(latencies, 50):.3f}s p95={percentile(latencies, 95):.3f}s  "
+          f"tokens {totals['tokens']}")
+    if totals['failed']:
+        print("💡 Failed prompts are retried when the same command is run again")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Worker 配置压测脚本 / Worker profile load benchmark
+
+启动一个本地模拟上游（OpenAI 兼容接口 + Synology incoming webhook），
+依次以不同的 gunicorn worker 配置启动应用，并发投递 /webhook 请求，
+输出每种配置的吞吐量和延迟分位数。
+
+使用方法:
+    python bench.py
+    python bench.py --profiles sync,gthread,gevent,asgi --requests 400 --concurrency 64 --latency 0.5
+    python bench.py --cpus 1          # 通过 taskset 将 gunicorn 限制在单核
+"""
+import argparse
+import importlib.util
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+# 每种 profile 对应的 gunicorn 环境变量
+PROFILES: Dict[str, Dict[str, str]] = {
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync'},
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '16'},
+    'gevent': {'GUNICORN_WORKER_CLASS': 'gevent', 'GUNICORN_WORKER_CONNECTIONS': '200'},
+    # 连接池需覆盖并发数，否则请求在 httpx 连接池中排队
+    'asgi': {'GUNICORN_WORKER_CLASS': 'asgi', 'HTTP_POOL_SIZE': '200'},
+}
+
+# 各 profile 额外需要的模块
+PROFILE_MODULES: Dict[str, List[str]] = {
+    'gevent': ['gevent'],
+    'asgi': ['httpx', 'uvicorn'],
+}
+
+BENCH_TOKEN = 'bench-token'
+
+# 消息以该标记开头时，模拟上游按标记中的秒数延迟响应（replay.py 用于还原录制的上游耗时）
+LATENCY_MARKER = re.compile(r'^\[\[latency=(\d+(?:\.\d+)?)\]\]')
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """模拟 LLM API 与 Synology incoming webhook"""
+
+    latency = 0.2
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length)
+        if 'chat' in self.path:
+            time.sleep(self._request_latency(raw))
+            body = json.dumps({
+                "choices": [{"message": {"role": "assistant", "content": "pong"}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11}
+            }).encode()
+        else:
+            body = b'{"success": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _request_latency(self, raw: bytes) -> float:
+        """读取最后一条消息中的延迟标记，没有时使用默认延迟"""
+        try:
+            messages = json.loads(raw).get('messages') or [{}]
+            match = LATENCY_MARKER.match(messages[-1].get('content', ''))
+        except (ValueError, AttributeError):
+            match = None
+        return float(match.group(1)) if match else self.latency
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_upstream(latency: float) -> ThreadingHTTPServer:
+    """在后台线程中启动模拟上游，返回 server（端口见 server.server_port）"""
+    handler = type('Handler', (StubUpstreamHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def wait_for_health(url: str, timeout: float = 30) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=1) as resp:
+                if resp.status == 200:
+                    return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+def post_webhook(url: str, user_id: int) -> float:
+    data = urllib.parse.urlencode({
+        'token': BENCH_TOKEN,
+        'user_id': str(user_id),
+        'text': 'ping'
+    }).encode()
+    start = time.perf_counter()
+    with urllib.request.urlopen(f"{url}/webhook", data=data, timeout=120) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_load(url: str, total: int, concurrency: int) -> Dict[str, Any]:
+    """以固定并发投递 total 个 webhook 请求"""
+    latencies: List[float] = []
+    errors = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(post_webhook, url, i % 1000) for i in range(total)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': total,
+        'errors': errors,
+        'elapsed': elapsed,
+        'rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def build_command(cpus: Optional[int], module: str = 'app:app') -> List[str]:
+    command = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', module]
+    if cpus:
+        if not shutil.which('taskset'):
+            print("⚠️  taskset not found, running without CPU pinning")
+        else:
+            command = ['taskset', '-c', f"0-{cpus - 1}"] + command
+    return command
+
+
+def launch_app(profile: str, workers: int, cpus: Optional[int], upstream_port: int, port: int,
+               extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """以指定 worker 配置启动 gunicorn，上游指向模拟服务"""
+    upstream = f"http://127.0.0.1:{upstream_port}"
+    env = dict(os.environ)
+    env.update({
+        'ENVIRONMENT': 'production',
+        'LOG_LEVEL': 'WARNING',
+        'CHAT_API_TYPE': 'openai',
+        'CHAT_API_URL': f"{upstream}/v1/chat/completions",
+        'CHAT_API_KEY': 'bench-key',
+        'CHAT_API_MODEL': 'bench-model',
+        'SYNOLOGY_INCOMING_WEBHOOK_URL': f"{upstream}/synology",
+        'SYNOLOGY_OUTGOING_WEBHOOK_TOKEN': BENCH_TOKEN,
+        'CONVERSATION_TYPING_TEXT': '',
+        'GUNICORN_BIND': f"127.0.0.1:{port}",
+        'GUNICORN_WORKERS': str(workers),
+    })
+    env.update(PROFILES[profile])
+    env.update(extra_env or {})
+    # 压测时不录制流量 / Never capture benchmark traffic
+    env.pop('TRAFFIC_CAPTURE_PATH', None)
+    env.pop('BOTS_CONFIG_FILE', None)
+
+    module = 'asgi:app' if env.get('GUNICORN_WORKER_CLASS') == 'asgi' else 'app:app'
+    return subprocess.Popen(
+        build_command(cpus, module),
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def stop_app(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def bench_profile(name: str, args: argparse.Namespace, upstream_port: int, port: int) -> Optional[Dict[str, Any]]:
+    process = launch_app(name, args.workers, args.cpus, upstream_port, port)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_for_health(url):
+            print(f"❌ [{name}] server did not become healthy")
+            return None
+        run_load(url, min(args.concurrency, args.requests), args.concurrency)  # 预热
+        return run_load(url, args.requests, args.concurrency)
+    finally:
+        stop_app(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gunicorn worker profiles")
+    parser.add_argument('--profiles', default='sync,gthread,gevent,asgi',
+                        help="Comma separated profiles: " + ', '.join(PROFILES))
+    parser.add_argument('--requests', type=int, default=200, help="Requests per profile")
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent clients")
+    parser.add_argument('--latency', type=float, default=0.2, help="Simulated LLM latency in seconds")
+    parser.add_argument('--workers', type=int, default=1, help="GUNICORN_WORKERS for every profile")
+    parser.add_argument('--cpus', type=int, default=None, help="Pin gunicorn to the first N CPUs")
+    parser.add_argument('--port', type=int, default=18008, help="Port for the app under test")
+    args = parser.parse_args()
+
+    upstream = start_stub_upstream(args.latency)
+    print(f"🧪 Stub upstream on port {upstream.server_port} (latency {args.latency:.2f}s)")
+    print(f"   workers={args.workers} cpus={args.cpus or 'all'} "
+          f"requests={args.requests} concurrency={args.concurrency}")
+    print("=" * 72)
+    print(f"{'profile':<10}{'rps':>10}{'p50(s)':>10}{'p95(s)':>10}{'p99(s)':>10}{'errors':>10}{'time(s)':>12}")
+
+    for name in [p.strip() for p in args.profiles.split(',') if p.strip()]:
+        if name not in PROFILES:
+            print(f"⚠️  Unknown profile: {name}")
+            continue
+        missing = [m for m in PROFILE_MODULES.get(name, []) if importlib.util.find_spec(m) is None]
+        if missing:
+            print(f"⚠️  [{name}] skipped, not installed: {', '.join(missing)}")
+            continue
+        result = bench_profile(name, args, upstream.server_port, args.port)
+        if result:
+            print(f"{name:<10}{result['rps']:>10.1f}{result['p50']:>10.3f}{result['p95']:>10.3f}"
+                  f"{result['p99']:>10.3f}{result['errors']:>10}{result['elapsed']:>12.2f}")
+
+    upstream.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -46,26 +46,224 @@ CHAT_API: Dict[str, Any] = {
     'model': os.getenv('CHAT_API_MODEL', ''),
     'temperature': get_env_float('CHAT_API_TEMPERATURE', 0.7),
     'max_tokens': get_env_int('CHAT_API_MAX_TOKENS', 4096),
-    'system_prompt': os.getenv('CHAT_API_SYSTEM_PROMPT', '你是一个智能助手，可以帮助用户解答问题。')
+    'system_prompt': os.getenv('CHAT_API_SYSTEM_PROMPT', '你是一个智能助手，可以帮助用户解答问题。'),
+    # 模型路由（仅 OpenAI）：按从小到大排列，如 "gpt-4o-mini=2000,gpt-4o"，为空时固定使用 model
+    'router_models': os.getenv('CHAT_API_ROUTER_MODELS', ''),
+    # 复杂度（0~1）达到该阈值时跳过最小的模型
+    'router_complexity_threshold': get_env_float('CHAT_API_ROUTER_COMPLEXITY_THRESHOLD', 0.3),
+    # 进行中的请求数达到该值时进入降级模式，0 表示不按并发降级
+    'router_degrade_inflight': get_env_int('CHAT_API_ROUTER_DEGRADE_INFLIGHT', 0),
+    # 最近请求的延迟 EWMA 超过该值（秒）时进入降级模式，0 表示不按延迟降级
+    'router_latency_slo': get_env_float('CHAT_API_ROUTER_LATENCY_SLO', 0.0),
+    # 降级模式下各模型 prompt 上限的放大倍数
+    'router_degrade_factor': get_env_float('CHAT_API_ROUTER_DEGRADE_FACTOR', 2.0),
+    # prompt 缓存键（仅 OpenAI，对应 prompt_cache_key 参数），支持 {user_id} 占位符，为空时不发送
+    'prompt_cache_key': os.getenv('CHAT_API_PROMPT_CACHE_KEY', '')
 }
 
 # Synology Chat Configuration
-SYNOLOGY: Dict[str, str] = {
+SYNOLOGY: Dict[str, Any] = {
     'incoming_webhook_url': os.getenv('SYNOLOGY_INCOMING_WEBHOOK_URL', ''),
     'outgoing_webhook_token': os.getenv('SYNOLOGY_OUTGOING_WEBHOOK_TOKEN', ''),
+    # 单条消息的最大字节数，超长回复按代码块/段落/句子拆分发送，0 表示不拆分
+    'max_message_bytes': get_env_int('SYNOLOGY_MAX_MESSAGE_BYTES', 4000),
+    # 单块发送失败时的重试次数及退避基数（秒）
+    'chunk_retries': get_env_int('SYNOLOGY_CHUNK_RETRIES', 2),
+    'chunk_retry_backoff': get_env_float('SYNOLOGY_CHUNK_RETRY_BACKOFF', 0.5),
 }
 
 # Conversation Settings
 CONVERSATION: Dict[str, Any] = {
     'max_history': get_env_int('CONVERSATION_MAX_HISTORY', 10),
+    # 历史超出 max_history 时一次移除的消息数，按块滑动以保持 prompt 前缀稳定（利于上游前缀缓存）
+    'trim_block': get_env_int('CONVERSATION_TRIM_BLOCK', 4),
     'timeout': get_env_int('CONVERSATION_TIMEOUT', 1800),
-    'typing_text': os.getenv('CONVERSATION_TYPING_TEXT', '...')
+    'typing_text': os.getenv('CONVERSATION_TYPING_TEXT', '...'),
+    # 回复在该时间（秒）内返回时不发送输入提示
+    'typing_delay': get_env_float('CONVERSATION_TYPING_DELAY', 1.0),
+    # 回复较慢时重复发送进度提示的间隔（秒），0 表示不重复
+    'typing_repeat_interval': get_env_float('CONVERSATION_TYPING_REPEAT_INTERVAL', 0.0),
+    'typing_repeat_text': os.getenv('CONVERSATION_TYPING_REPEAT_TEXT', ''),
+    # 同一用户在该窗口（毫秒）内连续发送的消息合并为一轮对话，0 表示关闭
+    'debounce_ms': get_env_int('CONVERSATION_DEBOUNCE_MS', 0),
+    # 合并消息时从第一条消息起最多等待的时间（毫秒）
+    'debounce_max_wait_ms': get_env_int('CONVERSATION_DEBOUNCE_MAX_WAIT_MS', 3000),
+    # 同一用户的新消息取代其尚未完成的请求（旧结果被丢弃）
+    'supersede': get_env_bool('CONVERSATION_SUPERSEDE', False),
+    # 会话持久化目录，为空时不持久化（重启后会话丢失）
+    'store_dir': os.getenv('CONVERSATION_STORE_DIR', ''),
+    # 日志批量写入间隔与快照间隔（秒）
+    'store_flush_interval': get_env_float('CONVERSATION_STORE_FLUSH_INTERVAL', 1.0),
+    'store_snapshot_interval': get_env_int('CONVERSATION_STORE_SNAPSHOT_INTERVAL', 300),
+    # 内存中保留的会话数与估算字节数上限，超出时按 LRU 逐出（配置了 store_dir 时写入磁盘），0 表示不限制
+    'max_conversations': get_env_int('CONVERSATION_MAX_CONVERSATIONS', 0),
+    'max_bytes': get_env_int('CONVERSATION_MAX_BYTES', 0)
 }
 
 # HTTP Client Settings
-HTTP: Dict[str, int] = {
+HTTP: Dict[str, Any] = {
     'timeout': get_env_int('HTTP_TIMEOUT', 30),
-    'max_retries': get_env_int('HTTP_MAX_RETRIES', 3)
+    # POST 只在连接失败或 429/502/503 时重试（优先遵循 Retry-After，否则为带抖动的指数退避）
+    'max_retries': get_env_int('HTTP_MAX_RETRIES', 3),
+    'retry_backoff': get_env_float('HTTP_RETRY_BACKOFF', 0.5),
+    'retry_backoff_max': get_env_float('HTTP_RETRY_BACKOFF_MAX', 8.0),
+    # 单个请求包括所有重试在内的总时长上限（秒），应小于 GUNICORN_TIMEOUT，0 表示不限制
+    'retry_deadline': get_env_float('HTTP_RETRY_DEADLINE', 60.0),
+    # 每个上游主机的连接池大小，默认不小于 gunicorn 每个 worker 的线程数
+    'pool_size': get_env_int('HTTP_POOL_SIZE', max(10, get_env_int('GUNICORN_THREADS', 1)))
+}
+
+# Circuit Breaker Settings
+CIRCUIT_BREAKER: Dict[str, Any] = {
+    # 连续失败（超时、连接错误、429、5xx）达到该次数时暂停向该上游发送请求，0 表示不熔断
+    'failure_threshold': get_env_int('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5),
+    # 熔断后经过该时间（秒）放行一个探测请求
+    'reset_timeout': get_env_float('CIRCUIT_BREAKER_RESET_TIMEOUT', 30.0)
+}
+
+# Usage Ledger Settings
+USAGE: Dict[str, Any] = {
+    # 用量持久化文件，.csv 结尾写 CSV，否则写 SQLite；为空时只保存在内存中
+    'ledger_path': os.getenv('USAGE_LEDGER_PATH', ''),
+    # 批量写入间隔（秒）
+    'flush_interval': get_env_int('USAGE_FLUSH_INTERVAL', 60),
+    # 模型单价（每百万 token），如 "gpt-4o=2.5:10,gpt-4o-mini=0.15:0.6"
+    'model_prices': os.getenv('USAGE_MODEL_PRICES', '')
+}
+
+# API Test Endpoint Settings
+API_TEST: Dict[str, int] = {
+    # /api-test 结果缓存时间（秒），期间不会重复请求上游
+    'cache_ttl': get_env_int('API_TEST_CACHE_TTL', 60)
+}
+
+# Request Deadline Settings
+DEADLINE: Dict[str, Any] = {
+    # 每个 webhook 请求从到达起可用的总时间（秒），输入提示、LLM 和回复投递的超时都不超过剩余时间；
+    # 应小于 GUNICORN_TIMEOUT，0 表示不限制
+    'budget': get_env_float('REQUEST_DEADLINE', max(get_env_int('GUNICORN_TIMEOUT', 120) - 10, 1)),
+    # 为投递回复预留的时间（秒），LLM 请求必须在此之前完成
+    'delivery_reserve': get_env_float('REQUEST_DEADLINE_DELIVERY_RESERVE', 5.0),
+    # 时间耗尽、未能得到回复时发送给用户的提示，为空时不发送
+    'timeout_text': os.getenv('REQUEST_DEADLINE_TIMEOUT_TEXT', '抱歉，这次回复超时了，请稍后再试。')
+}
+
+# Admission Control Settings
+ADMISSION: Dict[str, Any] = {
+    # 同时处理的 webhook 请求上限，0 表示不限制
+    'max_inflight': get_env_int('ADMISSION_MAX_INFLIGHT', 0),
+    # 达到上限后允许排队等待的请求数，以及最长等待时间（秒）
+    'max_queue': get_env_int('ADMISSION_MAX_QUEUE', 0),
+    'queue_timeout': get_env_float('ADMISSION_QUEUE_TIMEOUT', 10.0),
+    # 请求被拒绝时发送给用户的提示，为空时不发送
+    'busy_text': os.getenv('ADMISSION_BUSY_TEXT', '当前请求较多，请稍后再试。')
+}
+
+# Readiness Settings (/ready)
+READINESS: Dict[str, Any] = {
+    # 进行中 / 排队的 webhook 请求数达到该值时返回 503，0 表示不检查
+    'max_inflight': get_env_int('READY_MAX_INFLIGHT', 0),
+    'max_queue': get_env_int('READY_MAX_QUEUE', 0),
+    # 上游延迟 EWMA 超过该值（秒）时返回 503，0 表示不检查
+    'max_latency': get_env_float('READY_MAX_LATENCY', 0.0),
+    # 熔断器打开 / 连接池被进行中的请求占满时返回 503
+    'fail_on_open_circuit': get_env_bool('READY_FAIL_ON_OPEN_CIRCUIT', True),
+    'fail_on_pool_exhausted': get_env_bool('READY_FAIL_ON_POOL_EXHAUSTED', True)
+}
+
+# Traffic Capture Settings
+CAPTURE: Dict[str, Any] = {
+    # 录制 /webhook 请求与上游耗时的 JSONL 文件，为空时不录制
+    'path': os.getenv('TRAFFIC_CAPTURE_PATH', ''),
+    # 不记录 webhook token 和消息原文（只保留长度）
+    'redact': get_env_bool('TRAFFIC_CAPTURE_REDACT', True)
+}
+
+# Request Profiler Settings
+PROFILER: Dict[str, Any] = {
+    # 按比例抽样分析 /webhook 请求（0-1），0 表示不抽样
+    'sample_rate': get_env_float('PROFILE_SAMPLE_RATE', 0.0),
+    # 耗时超过该值（秒）的请求写入分析结果，0 表示不启用；启用后所有请求都会被采样
+    'slow_threshold': get_env_float('PROFILE_SLOW_THRESHOLD', 0.0),
+    # 栈采样间隔（秒）
+    'interval': get_env_float('PROFILE_INTERVAL', 0.01),
+    # 分析结果目录（多个 worker 共用），最多保留 max_files 个文件
+    'dir': os.getenv('PROFILE_DIR', 'profiles'),
+    'max_files': get_env_int('PROFILE_MAX_FILES', 200)
+}
+
+# Admin Settings
+ADMIN: Dict[str, str] = {
+    # 管理端点（/admin/*）的访问令牌，为空时管理端点不可用
+    'token': os.getenv('ADMIN_TOKEN', '')
+}
+
+# Semantic Cache Settings
+SEMANTIC_CACHE: Dict[str, Any] = {
+    # 对首轮提问按相似度复用已有回答（不调用 LLM）
+    'enabled': get_env_bool('SEMANTIC_CACHE_ENABLED', False),
+    # 余弦相似度达到该值时命中。学到的答案由所有用户共享，阈值过低时只差一个关键词的问题
+    # （本地哈希向量下 "VPN address" 与 "wifi address" 相似度为 0.8）会得到彼此的答案
+    'threshold': get_env_float('SEMANTIC_CACHE_THRESHOLD', 0.8),
+    # 命中还要求关键词完全相同（英文去掉常见虚词后的单词、中日韩文本的相邻二字组合）；
+    # 使用能区分近义词的嵌入模型时可关闭
+    'match_keywords': get_env_bool('SEMANTIC_CACHE_MATCH_KEYWORDS', True),
+    # 运行中缓存的问答数上限（按 LRU 覆盖），不含预置 FAQ；0 表示只使用 FAQ
+    'capacity': get_env_int('SEMANTIC_CACHE_CAPACITY', 1000),
+    # 预置 FAQ 文件（JSON），常驻缓存
+    'faq_file': os.getenv('SEMANTIC_CACHE_FAQ_FILE', ''),
+    # 嵌入函数 "module:function"，为空时使用本地哈希向量；dim 为本地哈希向量的维数
+    'embedding': os.getenv('SEMANTIC_CACHE_EMBEDDING', ''),
+    'dim': get_env_int('SEMANTIC_CACHE_DIM', 512)
+}
+
+# Local Command Settings
+COMMANDS: Dict[str, Any] = {
+    # 以前缀开头的命令在本地处理（不调用 LLM），为 false 时所有消息都发送给 LLM
+    'enabled': get_env_bool('COMMANDS_ENABLED', True),
+    # 命令前缀，为空时整条消息（或第一个词）与别名相同即视为命令
+    'prefix': os.getenv('COMMAND_PREFIX', '/'),
+    # 命令别名 "命令=别名|别名,..."，命令为 reset、help、usage、model
+    'aliases': os.getenv('COMMAND_ALIASES',
+                         'reset=reset|new|new chat|clear|新对话|清空,help=help|帮助,usage=usage|用量,model=model|模型'),
+    # /model 可切换的模型（逗号分隔），为空时为 CHAT_API_MODEL 与 CHAT_API_ROUTER_MODELS 中的模型
+    'models': os.getenv('COMMAND_MODELS', '')
+}
+
+# Dead-letter Spool Settings
+SPOOL: Dict[str, Any] = {
+    # 投递失败的回复写入该目录（每个机器人一个子目录）并在后台重投，为空时不重投（回复丢失）
+    'dir': os.getenv('SPOOL_DIR', ''),
+    # 磁盘占用上限与单个日志段大小（字节），超出上限时丢弃最旧的回复
+    'max_bytes': get_env_int('SPOOL_MAX_BYTES', 50_000_000),
+    'segment_bytes': get_env_int('SPOOL_SEGMENT_BYTES', 1_000_000),
+    # 超过该时间（秒）仍未投递的回复不再重投，0 表示不限制
+    'max_age': get_env_int('SPOOL_MAX_AGE', 86400),
+    # 重投失败后的退避基数与上限（秒）
+    'retry_backoff': get_env_float('SPOOL_RETRY_BACKOFF', 5.0),
+    'retry_backoff_max': get_env_float('SPOOL_RETRY_BACKOFF_MAX', 300.0)
+}
+
+# Multi-bot Settings
+BOTS: Dict[str, str] = {
+    # 多机器人配置文件（JSON），设置后按 webhook token 在同一进程内托管多个机器人，
+    # 忽略 SYNOLOGY_INCOMING_WEBHOOK_URL / SYNOLOGY_OUTGOING_WEBHOOK_TOKEN
+    'config_file': os.getenv('BOTS_CONFIG_FILE', '')
+}
+
+# Dispatcher Settings (dispatcher.py)
+DISPATCH: Dict[str, Any] = {
+    # 后端机器人实例地址，逗号分隔，如 "http://10.0.0.1:8101,http://10.0.0.2:8101"
+    'backends': os.getenv('DISPATCH_BACKENDS', ''),
+    # 每个后端在哈希环上的虚拟节点数，越多分布越均匀
+    'virtual_nodes': get_env_int('DISPATCH_VIRTUAL_NODES', 100),
+    # 转发请求的连接超时与总超时（秒），总超时应不小于后端的 REQUEST_DEADLINE
+    'connect_timeout': get_env_float('DISPATCH_CONNECT_TIMEOUT', 2.0),
+    'timeout': get_env_float('DISPATCH_TIMEOUT', get_env_int('GUNICORN_TIMEOUT', 120)),
+    # 后端无法连接时暂停向其转发的时间（秒）
+    'down_interval': get_env_float('DISPATCH_DOWN_INTERVAL', 10.0),
+    # 每个后端的 keep-alive 连接数
+    'pool_size': get_env_int('DISPATCH_POOL_SIZE', 100)
 }
 
 def get_server_config() -> Dict[str, Any]:
@@ -0,0 +1,61 @@
+# dispatcher.py
+"""
+webhook 分发入口 / Sticky webhook dispatcher entry point
+
+按 user_id 一致性哈希把 Synology webhook 转发到多个机器人实例，每个用户的会话始终留在同一个进程中。
+Routes Synology webhooks to several bot instances by consistent hashing on user_id,
+so each user's conversation stays in one process.
+
+使用方法 / Usage:
+    DISPATCH_BACKENDS=http://127.0.0.1:8101,http://127.0.0.1:8102 \\
+        GUNICORN_WORKER_CLASS=gevent gunicorn --config gunicorn.conf.py dispatcher:app
+"""
+import sys
+from flask import Flask, request, jsonify
+from config.settings import DISPATCH, APP_VERSION
+from src.bot.dispatcher import Dispatcher
+from src.utils.metrics import metrics
+
+
+def create_dispatcher_app():
+    """创建分发器应用 / Create the dispatcher application"""
+    try:
+        dispatcher = Dispatcher(DISPATCH)
+    except ValueError as e:
+        print(f"❌ {str(e)}")
+        print("💡 Set DISPATCH_BACKENDS to a comma-separated list of bot instance URLs")
+        sys.exit(1)
+
+    app = Flask(__name__)
+
+    @app.route('/webhook', methods=['POST'])
+    def webhook():
+        """按 user_id 转发 webhook / Forward the webhook by user_id"""
+        status, body, _ = dispatcher.forward(request.form.to_dict())
+        return body, status
+
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        """健康检查端点 / Health check endpoint"""
+        return jsonify({
+            'status': 'healthy',
+            'service': 'synology-chat-bot-dispatcher',
+            'version': APP_VERSION,
+        }), 200
+
+    @app.route('/backends', methods=['GET'])
+    def backends():
+        """各后端的状态与转发数 / Backend status and forwarded counts"""
+        return jsonify(dispatcher.get_stats()), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """运行指标端点 / Runtime metrics endpoint"""
+        return jsonify(metrics.snapshot()), 200
+
+    print(f"🎉 Dispatcher ready with {len(dispatcher.backends)} backend(s)")
+    return app
+
+
+# 创建应用实例（用于gunicorn）/ Create application instance (for gunicorn)
+app = create_dispatcher_app()
@@ -0,0 +1,61 @@
+# gunicorn.conf.py
+"""
+Gunicorn 配置 / Gunicorn configuration
+
+Worker profiles (GUNICORN_WORKER_CLASS):
+    sync    - 每个 worker 同时处理一个请求（默认）
+    gthread - 每个 worker 使用 GUNICORN_THREADS 个线程
+    gevent  - 协程 worker，单个 worker 可同时等待 GUNICORN_WORKER_CONNECTIONS 个请求
+    asgi    - uvicorn worker，运行 asgi:app（asyncio + httpx），需要安装 httpx 与 uvicorn
+
+应用以 preload 方式加载：配置解析、代码导入和启动时的 API 检测只在 master 中执行一次，
+worker fork 之后通过 post_fork 钩子重建 HTTP 连接池。
+"""
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync').lower()
+
+# gevent 必须在 preload 导入 requests/ssl 之前完成 monkeypatch，
+# 否则 master 中创建的 socket 与 ssl 模块不会被协程化
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# asgi 使用 uvicorn 提供的 gunicorn worker / asgi runs uvicorn's gunicorn worker
+if worker_class == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8008')
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '4' if worker_class == 'gthread' else '1'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('true', '1', 'yes')
+
+accesslog = '-'
+errorlog = '-'
+loglevel = 'info'
+
+
+def post_fork(server, worker):
+    """worker fork 之后重建继承自 master 的连接池并启动死信重投 / Rebuild inherited connection pools and start dead-letter redelivery after fork"""
+    from src.bot.dead_letter import DeadLetterSpool
+    from src.utils.http_client import reset_session_pools
+    from src.providers.factory import ProviderFactory
+    count = reset_session_pools()
+    warmed = ProviderFactory.warmup_all()
+    spools = DeadLetterSpool.start_all()
+    server.log.info(f"Worker {worker.pid} ({worker_class}): reset {count} HTTP session pool(s), "
+                    f"warmed {warmed} provider(s), started {spools} dead-letter spool(s)")
+
+
+def worker_exit(server, worker):
+    """worker 退出时释放共享 Provider 的连接并写入剩余用量和会话快照 / Close providers, flush usage and conversation state on worker exit"""
+    from src.bot.conversation_store import ConversationStore
+    from src.bot.dead_letter import DeadLetterSpool
+    from src.providers.factory import ProviderFactory
+    from src.utils.usage_ledger import usage_ledger
+    ProviderFactory.close_all()
+    usage_ledger.stop()
+    ConversationStore.stop_all()
+    DeadLetterSpool.stop_all()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+流量回放脚本 / Traffic capture replay
+
+读取 TRAFFIC_CAPTURE_PATH 录制的 JSONL 文件，按原始到达间隔（可加速）向本地启动的
+gunicorn 投递 /webhook 请求。上游使用 bench.py 的模拟服务，每个请求按录制的上游耗时
+延迟响应，输出持续吞吐量与延迟分位数，用于根据真实流量形态确定 worker/线程数。
+
+使用方法:
+    python replay.py capture.jsonl                      # 1x 原速
+    python replay.py capture.jsonl --speed 10           # 10 倍速
+    python replay.py capture.jsonl --speed max --concurrency 128
+    python replay.py capture.jsonl --profile gthread --workers 2 --threads 32
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from bench import (
+    BENCH_TOKEN, PROFILES, launch_app, percentile, start_stub_upstream, stop_app, wait_for_health
+)
+
+
+def load_capture(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """读取录制文件，按到达时间排序"""
+    events: List[Dict[str, Any]] = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    events.sort(key=lambda e: e.get('t', 0))
+    return events[:limit] if limit else events
+
+
+def build_form(event: Dict[str, Any], default_latency: float) -> bytes:
+    """还原 webhook 表单，脱敏的文本用等长占位符代替，并带上录制的上游耗时"""
+    text = event.get('text')
+    if text is None:
+        text = 'x' * event.get('len', 0)
+    if text:
+        upstream = event['up'] if 'up' in event else default_latency
+        text = f"[[latency={upstream:.3f}]]{text}"
+    return urllib.parse.urlencode({
+        'token': BENCH_TOKEN,
+        'user_id': str(event.get('user') or 0),
+        'text': text,
+    }).encode()
+
+
+def post(url: str, data: bytes) -> Tuple[float, int]:
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(f"{url}/webhook", data=data, timeout=300) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return time.perf_counter() - start, status
+
+
+def replay(url: str, events: List[Dict[str, Any]], speed: Optional[float], concurrency: int,
+           default_latency: float) -> Dict[str, Any]:
+    """
+    按录制的到达间隔投递请求（speed 为 None 时尽可能快）
+
+    Returns:
+        吞吐量、延迟分位数、状态码分布与调度滞后
+    """
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    lags: List[float] = []
+    lock = threading.Lock()
+
+    def send(event: Dict[str, Any], scheduled: float) -> None:
+        lag = max(0.0, time.perf_counter() - scheduled) if speed else 0.0
+        try:
+            elapsed, status = post(url, build_form(event, default_latency))
+        except Exception:
+            elapsed, status = None, 0
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            lags.append(lag)
+            if status == 200 and elapsed is not None:
+                latencies.append(elapsed)
+
+    t0 = events[0].get('t', 0)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for event in events:
+            scheduled = start
+            if speed:
+                scheduled = start + (event.get('t', t0) - t0) / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, event, scheduled)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(events),
+        'ok': len(latencies),
+        'statuses': statuses,
+        'elapsed': elapsed,
+        'rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else 0.0,
+        'lag_p99': percentile(lags, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured webhook traffic against a local server")
+    parser.add_argument('capture', help="JSONL file written by TRAFFIC_CAPTURE_PATH")
+    parser.add_argument('--speed', default='1', help="Replay speed: 1, 10, ... or 'max'")
+    parser.add_argument('--profile', default='gthread', help="Worker profile: " + ', '.join(PROFILES))
+    parser.add_argument('--workers', type=int, default=1, help="GUNICORN_WORKERS")
+    parser.add_argument('--threads', type=int, default=None, help="Override GUNICORN_THREADS (gthread)")
+    parser.add_argument('--concurrency', type=int, default=256, help="Maximum concurrent client connections")
+    parser.add_argument('--latency', type=float, default=0.5,
+                        help="Upstream latency for events recorded without LLM timing")
+    parser.add_argument('--limit', type=int, default=None, help="Replay only the first N events")
+    parser.add_argument('--cpus', type=int, default=None, help="Pin gunicorn to the first N CPUs")
+    parser.add_argument('--port', type=int, default=18009, help="Port for the app under test")
+    args = parser.parse_args()
+
+    if args.profile not in PROFILES:
+        parser.error(f"Unknown profile: {args.profile}")
+    speed = None if args.speed == 'max' else float(args.speed)
+    events = load_capture(args.capture, args.limit)
+    if not events:
+        parser.error(f"No events in {args.capture}")
+
+    span = events[-1].get('t', 0) - events[0].get('t', 0)
+    recorded = [e['dur'] for e in events if e.get('status') == 200 and 'dur' in e]
+    print(f"📼 {len(events)} events over {span:.1f}s "
+          f"(recorded p50={percentile(recorded, 50):.3f}s p99={percentile(recorded, 99):.3f}s)")
+
+    extra_env: Dict[str, str] = {}
+    if args.threads:
+        extra_env['GUNICORN_THREADS'] = str(args.threads)
+    upstream = start_stub_upstream(args.latency)
+    process = launch_app(args.profile, args.workers, args.cpus, upstream.server_port, args.port, extra_env)
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        if not wait_for_health(url):
+            print("❌ Server did not become healthy")
+            return
+        print(f"▶️  Replaying at {'max' if speed is None else f'{speed:g}x'} speed "
+              f"(profile={args.profile}, workers={args.workers}, "
+              f"threads={extra_env.get('GUNICORN_THREADS', PROFILES[args.profile].get('GUNICORN_THREADS', '-'))})")
+        result = replay(url, events, speed, args.concurrency, args.latency)
+    finally:
+        stop_app(process)
+        upstream.shutdown()
+
+    print("=" * 72)
+    print(f"requests     {result['requests']} (ok {result['ok']}, statuses {result['statuses']})")
+    print(f"elapsed      {result['elapsed']:.2f}s")
+    print(f"throughput   {result['rps']:.2f} req/s")
+    print(f"latency      p50={result['p50']:.3f}s p90={result['p90']:.3f}s "
+          f"p99={result['p99']:.3f}s max={result['max']:.3f}s")
+    if speed:
+        # 调度滞后较大说明客户端并发不足，结果不能代表目标倍速
+        print(f"dispatch lag p99={result['lag_p99']:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
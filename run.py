@@ -11,7 +11,7 @@ def main():
     if not is_development():
         print("❌ This script is only for development!")
         print(f"🔧 Current environment: {ENVIRONMENT}")
-        print("🔧 For production, use: gunicorn --bind 0.0.0.0:8008 app:app")
+        print("🔧 For production, use: gunicorn --config gunicorn.conf.py app:app")
         sys.exit(1)
 
     server_config = get_server_config()
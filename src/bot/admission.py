@@ -0,0 +1,164 @@
+# src/bot/admission.py
+"""
+准入控制
+限制同时处理的 webhook 数量与排队数量，超出阈值时立即拒绝，避免请求堆积到 worker 超时
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Any, Optional, Tuple
+
+from ..utils.deadline import current_deadline
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+
+
+class AdmissionController:
+    """
+    准入控制器
+
+    - 进行中的请求少于 max_inflight 时直接放行
+    - 否则最多 max_queue 个请求排队等待空位，等待超过 queue_timeout 仍未轮到则拒绝
+    - 队列已满时立即拒绝
+    max_inflight 为 0 表示不限制。
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.max_inflight = config.get('max_inflight', 0)
+        self.max_queue = config.get('max_queue', 0)
+        self.queue_timeout = config.get('queue_timeout', 10.0)
+        self.busy_text = config.get('busy_text', '')
+
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._queued = 0
+        # 排队中的协程（ASGI 模式），名额直接移交给最早排队的一个
+        self._async_waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+        metrics.register_gauge('admission.inflight', lambda: self._inflight)
+        metrics.register_gauge('admission.queued', lambda: self._queued)
+        metrics.register_gauge('admission.shed_ratio', self.shed_ratio)
+        if self.enabled:
+            logger.info(f"Admission control enabled (max_inflight={self.max_inflight}, "
+                        f"max_queue={self.max_queue}, queue_timeout={self.queue_timeout}s)")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inflight > 0
+
+    @property
+    def inflight(self) -> int:
+        """正在处理的请求数"""
+        return self._inflight
+
+    @property
+    def queued(self) -> int:
+        """排队等待的请求数"""
+        return self._queued
+
+    def try_acquire(self) -> bool:
+        """
+        申请处理名额，必要时排队等待
+
+        Returns:
+            是否获得名额；获得名额后必须调用 release()
+        """
+        with self._cond:
+            if self._inflight < self.max_inflight or not self.enabled:
+                self._inflight += 1
+                metrics.inc('admission.admitted')
+                return True
+            if self._queued >= self.max_queue:
+                metrics.inc('admission.shed')
+                metrics.inc('admission.shed_queue_full')
+                return False
+
+            self._queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            # 排队时间也计入请求截止时间
+            request_deadline = current_deadline()
+            if request_deadline is not None:
+                deadline = min(deadline, request_deadline.expires_at)
+            try:
+                while self._inflight >= self.max_inflight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.inc('admission.shed')
+                        metrics.inc('admission.shed_timeout')
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._queued -= 1
+            self._inflight += 1
+            metrics.inc('admission.admitted')
+            metrics.inc('admission.admitted_after_wait')
+            return True
+
+    async def try_acquire_async(self) -> bool:
+        """try_acquire 的异步版本，排队时不占用线程"""
+        with self._cond:
+            if self._inflight < self.max_inflight or not self.enabled:
+                self._inflight += 1
+                metrics.inc('admission.admitted')
+                return True
+            if self._queued >= self.max_queue:
+                metrics.inc('admission.shed')
+                metrics.inc('admission.shed_queue_full')
+                return False
+
+            self._queued += 1
+            timeout = self.queue_timeout
+            request_deadline = current_deadline()
+            if request_deadline is not None:
+                timeout = min(timeout, request_deadline.remaining())
+            entry = (asyncio.get_running_loop(), asyncio.get_running_loop().create_future())
+            self._async_waiters.append(entry)
+
+        try:
+            await asyncio.wait_for(entry[1], timeout)
+        except asyncio.TimeoutError:
+            with self._cond:
+                # 超时与名额移交同时发生时，名额已经属于本请求
+                if entry in self._async_waiters:
+                    self._async_waiters.remove(entry)
+                    metrics.inc('admission.shed')
+                    metrics.inc('admission.shed_timeout')
+                    return False
+        except asyncio.CancelledError:
+            # 请求被取消（如客户端断开）：已移交的名额需要归还
+            with self._cond:
+                granted = entry not in self._async_waiters
+                if not granted:
+                    self._async_waiters.remove(entry)
+            if granted:
+                self.release()
+            raise
+        finally:
+            with self._cond:
+                self._queued -= 1
+        metrics.inc('admission.admitted')
+        metrics.inc('admission.admitted_after_wait')
+        return True
+
+    def release(self) -> None:
+        """归还处理名额（有协程在排队时直接移交给最早的一个）"""
+        with self._cond:
+            if self._async_waiters:
+                loop, future = self._async_waiters.popleft()
+                loop.call_soon_threadsafe(_grant, future)
+                return
+            self._inflight -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def shed_ratio() -> Optional[float]:
+        """被拒绝的请求占比"""
+        shed = metrics.get('admission.shed')
+        total = shed + metrics.get('admission.admitted')
+        return round(shed / total, 4) if total else None
+
+
+def _grant(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(True)
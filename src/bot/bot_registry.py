@@ -0,0 +1,110 @@
+# src/bot/bot_registry.py
+"""
+多机器人注册表
+在同一进程内托管多个 Synology Chat 机器人，按 webhook token 路由到各自的 ChatManager
+"""
+import json
+import os
+from typing import Dict, Any, List, Optional
+
+from .chat_manager import ChatManager
+from ..utils.http_client import HTTPClient
+from ..utils.retry import RetryPolicy
+from ..utils.logger import logger
+
+
+def load_bot_configs(path: str, base_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    从 JSON 文件加载机器人列表，并与全局配置合并为每个机器人的完整配置
+
+    文件格式为机器人数组或 {"bots": [...]}，每个机器人支持:
+        name, outgoing_webhook_token, incoming_webhook_url, system_prompt,
+        chat_api / synology / conversation / semantic_cache / commands（分别覆盖对应的全局配置项）
+
+    Args:
+        path: 配置文件路径
+        base_config: 全局配置字典（CHAT_API、SYNOLOGY、CONVERSATION 等）
+
+    Returns:
+        每个机器人的配置字典列表
+
+    Raises:
+        ValueError: 配置文件格式错误、名称或 token 重复时
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    bots = data.get('bots', []) if isinstance(data, dict) else data
+    if not isinstance(bots, list) or not bots:
+        raise ValueError(f"No bots defined in {path}")
+
+    configs: List[Dict[str, Any]] = []
+    names, tokens = set(), set()
+    for index, bot in enumerate(bots):
+        name = str(bot.get('name') or f"bot{index + 1}")
+        token = bot.get('outgoing_webhook_token', '')
+        if name in names:
+            raise ValueError(f"Duplicate bot name: {name}")
+        if token and token in tokens:
+            raise ValueError(f"Duplicate outgoing_webhook_token for bot: {name}")
+        names.add(name)
+        tokens.add(token)
+
+        chat_api = {**base_config['CHAT_API'], **bot.get('chat_api', {})}
+        if 'system_prompt' in bot:
+            chat_api['system_prompt'] = bot['system_prompt']
+        synology = {**base_config['SYNOLOGY'], **bot.get('synology', {}),
+                    'outgoing_webhook_token': token,
+                    'incoming_webhook_url': bot.get('incoming_webhook_url', '')}
+        conversation = {**base_config['CONVERSATION'], **bot.get('conversation', {})}
+        # 各机器人的会话分别持久化
+        if conversation.get('store_dir'):
+            conversation['store_dir'] = os.path.join(conversation['store_dir'], name)
+
+        semantic_cache = {**base_config.get('SEMANTIC_CACHE', {}), **bot.get('semantic_cache', {})}
+        commands = {**base_config.get('COMMANDS', {}), **bot.get('commands', {})}
+
+        configs.append({
+            **base_config,
+            'SEMANTIC_CACHE': semantic_cache,
+            'COMMANDS': commands,
+            'CHAT_API': chat_api,
+            'SYNOLOGY': synology,
+            'CONVERSATION': conversation,
+            'BOT': {'name': name},
+        })
+    return configs
+
+
+class BotRegistry:
+    """
+    机器人注册表
+
+    每个机器人拥有独立的 ChatManager（会话、系统提示、Provider 配置），
+    所有机器人共用发往 Synology 的 HTTP 连接池；访问同一上游的 Provider
+    通过 ProviderFactory / get_shared_session 共用 LLM 连接池。
+    """
+
+    def __init__(self, bot_configs: List[Dict[str, Any]]):
+        http_config = bot_configs[0]['HTTP']
+        self.http_client = HTTPClient(
+            timeout=http_config['timeout'],
+            max_retries=http_config['max_retries'],
+            pool_size=http_config.get('pool_size', 10),
+            retry_policy=RetryPolicy.from_config('synology', http_config)
+        )
+        self.managers: Dict[str, ChatManager] = {}
+        self._by_token: Dict[str, ChatManager] = {}
+        for config in bot_configs:
+            manager = ChatManager(config, http_client=self.http_client)
+            self.managers[manager.name] = manager
+            self._by_token[config['SYNOLOGY']['outgoing_webhook_token']] = manager
+        logger.info(f"BotRegistry initialized with {len(self.managers)} bot(s): "
+                    f"{', '.join(self.managers)}")
+
+    def get(self, token: str) -> Optional[ChatManager]:
+        """按 webhook token 查找机器人（O(1)）"""
+        return self._by_token.get(token)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各机器人的会话占用与吞吐统计"""
+        return {name: manager.get_stats() for name, manager in self.managers.items()}
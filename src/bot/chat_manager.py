@@ -1,37 +1,171 @@
-from typing import Dict, Any
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 from ..models.conversation import Conversation
+from .conversation_store import ConversationStore
 from .message_handler import MessageHandler
+from ..utils.http_client import HTTPClient
 from ..utils.logger import logger
+from ..utils.metrics import metrics
+from ..utils.retry import RetryPolicy
+
+# 繁忙提示只尝试一次且使用短超时：准入控制拒绝请求正是为了尽快释放 worker
+_NOTICE_POLICY = RetryPolicy('notice', max_retries=0)
+_NOTICE_TIMEOUT = 3.0
+
+
+class _Burst:
+    """同一用户在防抖窗口内连续发送的消息"""
+
+    def __init__(self, text: str, lock: threading.Lock):
+        self.texts: List[str] = [text]
+        self.first_at = self.last_at = time.monotonic()
+        self.cond = threading.Condition(lock)
 
 
 class ChatManager:
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], http_client: Optional[HTTPClient] = None):
         self.config = config
-        self.conversations: Dict[str, Conversation] = {}
-        self.message_handler = MessageHandler(config)
+        # 多机器人模式下的机器人名称，用于区分各机器人的统计
+        self.name = config.get('BOT', {}).get('name', 'default')
+        self._started_at = time.time()
+        # 按最近访问排序（最久未访问的在前），超出内存预算时从头部逐出
+        self.conversations: 'OrderedDict[str, Conversation]' = OrderedDict()
+        # gthread/gevent worker 下多个请求会并发访问会话表
+        self._lock = threading.Lock()
+        self.max_conversations = config['CONVERSATION'].get('max_conversations', 0)
+        self.max_bytes = config['CONVERSATION'].get('max_bytes', 0)
+        self._resident_bytes = 0
+        # 正在写入快照的被逐出会话，写完之前该用户的请求等待，避免读到旧快照
+        self._evicting: Dict[str, threading.Event] = {}
+        # 正在处理请求的用户，其会话不会被逐出
+        self._active: Dict[str, int] = {}
+        metrics.register_gauge(f"bots.{self.name}.conversations", lambda: len(self.conversations))
+        metrics.register_gauge(f"bots.{self.name}.resident_bytes", lambda: self._resident_bytes)
+        self.message_handler = MessageHandler(config, http_client=http_client)
+
+        # 会话持久化：重启后按需恢复历史
+        self.store = ConversationStore.from_config(config['CONVERSATION'])
+        if self.store:
+            self.store.attach(self._conversation_table)
+
+        # 消息防抖：窗口内连续到达的消息合并为一轮对话
+        self.debounce_window = config['CONVERSATION'].get('debounce_ms', 0) / 1000
+        self.debounce_max_wait = max(
+            self.debounce_window,
+            config['CONVERSATION'].get('debounce_max_wait_ms', 0) / 1000
+        )
+        self._bursts: Dict[str, _Burst] = {}
+        self._burst_lock = threading.Lock()
+
         logger.info(f"ChatManager initialized (max_history={config['CONVERSATION']['max_history']}, "
-                   f"timeout={config['CONVERSATION']['timeout']}s)")
+                   f"timeout={config['CONVERSATION']['timeout']}s, "
+                   f"debounce={self.debounce_window * 1000:.0f}ms, "
+                   f"max_conversations={self.max_conversations or 'unlimited'}, "
+                   f"max_bytes={self.max_bytes or 'unlimited'})")
 
     def get_conversation(self, user_id: str) -> Conversation:
-        """获取或创建用户会话"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = Conversation(
-                user_id,
-                self.config['CONVERSATION']['max_history'],
-                self.config['CONVERSATION']['timeout']
-            )
-            logger.debug(f"[User:{user_id}] Created new conversation")
-        return self.conversations[user_id]
+        """获取或创建用户会话（启用持久化时先尝试恢复）"""
+        with self._lock:
+            conversation = self.conversations.get(user_id)
+            if conversation is not None:
+                self.conversations.move_to_end(user_id)
+                return conversation
+            spilling = self._evicting.get(user_id)
+
+        if spilling is not None:
+            spilling.wait()
+        restored = self.store.load(user_id) if self.store else None
+        with self._lock:
+            if user_id not in self.conversations:
+                conversation = restored or Conversation(
+                    user_id,
+                    self.config['CONVERSATION']['max_history'],
+                    self.config['CONVERSATION']['timeout'],
+                    self.config['CONVERSATION'].get('trim_block', 1)
+                )
+                if self.store:
+                    self.store.track(conversation)
+                conversation.on_resize = self._on_resize
+                self._resident_bytes += conversation.approx_bytes
+                self.conversations[user_id] = conversation
+                if not restored:
+                    logger.debug(f"[User:{user_id}] Created new conversation")
+            conversation = self.conversations[user_id]
+        self.enforce_budget()
+        return conversation
+
+    def _on_resize(self, delta: int) -> None:
+        with self._lock:
+            self._resident_bytes += delta
+
+    def _over_budget(self) -> bool:
+        return ((self.max_conversations and len(self.conversations) > self.max_conversations) or
+                (self.max_bytes and self._resident_bytes > self.max_bytes))
+
+    def enforce_budget(self) -> int:
+        """
+        超出会话数或内存预算时按 LRU 逐出会话（正在处理请求的会话除外），
+        启用持久化时逐出的会话写入快照，下次访问时恢复
+
+        Returns:
+            逐出的会话数
+        """
+        if not (self.max_conversations or self.max_bytes):
+            return 0
+        evicted: List[Conversation] = []
+        with self._lock:
+            if not self._over_budget():
+                return 0
+            for user_id in list(self.conversations):
+                if not self._over_budget():
+                    break
+                if self._active.get(user_id):
+                    continue
+                conversation = self.conversations.pop(user_id)
+                conversation.on_resize = None
+                self._resident_bytes -= conversation.approx_bytes
+                evicted.append(conversation)
+                if self.store:
+                    self._evicting[user_id] = threading.Event()
+
+        for conversation in evicted:
+            if self.store:
+                try:
+                    self.store.spill(conversation)
+                finally:
+                    with self._lock:
+                        spilled = self._evicting.pop(conversation.user_id, None)
+                    if spilled is not None:
+                        spilled.set()
+        if evicted:
+            metrics.inc(f"bots.{self.name}.evicted", len(evicted))
+            logger.info(f"Evicted {len(evicted)} least recently used conversation(s) "
+                        f"({'spilled to disk' if self.store else 'discarded'}), "
+                        f"resident={len(self.conversations)} / {self._resident_bytes} bytes")
+        return len(evicted)
+
+    def _conversation_table(self) -> Dict[str, Conversation]:
+        """返回会话表的副本（供存储写快照）"""
+        with self._lock:
+            return dict(self.conversations)
 
     def cleanup_expired_conversations(self) -> None:
         """清理过期的会话"""
-        expired_users = [
-            user_id for user_id, conv in self.conversations.items()
-            if conv.is_expired()
-        ]
-        if expired_users:
+        with self._lock:
+            expired_users = [
+                user_id for user_id, conv in self.conversations.items()
+                if conv.is_expired()
+            ]
             for user_id in expired_users:
-                del self.conversations[user_id]
+                conversation = self.conversations.pop(user_id)
+                conversation.on_resize = None
+                self._resident_bytes -= conversation.approx_bytes
+                if self.store:
+                    self.store.drop(user_id)
+        if expired_users:
             logger.info(f"Cleaned up {len(expired_users)} expired conversation(s)")
             logger.debug(f"Active conversations: {len(self.conversations)}")
 
@@ -44,15 +178,219 @@ class ChatManager:
 
         logger.debug(f"[User:{user_id}] Processing webhook event")
 
+        # 合并连续消息，被合并的请求直接返回
+        if self.debounce_window > 0:
+            event = self.debounce_event(user_id, event)
+            if event is None:
+                return
+
         # 清理过期会话
         self.cleanup_expired_conversations()
 
-        # 获取用户会话
-        conversation = self.get_conversation(user_id)
+        # 获取用户会话（处理期间不会被逐出）
+        self._pin(user_id)
+        try:
+            conversation = self.get_conversation(user_id)
+
+            # 处理消息
+            start = time.monotonic()
+            metrics.inc(f"bots.{self.name}.requests")
+            response = self.message_handler.handle_message(event, conversation)
+
+            # 发送响应
+            if response:
+                self.message_handler.send_message(int(user_id), response, spool=True)
+                metrics.inc(f"bots.{self.name}.replies")
+            metrics.inc(f"bots.{self.name}.busy_seconds", time.monotonic() - start)
+        finally:
+            self._unpin(user_id)
+        # 本轮新增的消息可能使内存超出预算
+        self.enforce_budget()
+
+    async def handle_event_async(self, event: Dict[str, Any]) -> None:
+        """handle_event 的异步版本（ASGI 模式使用），LLM 请求与回复投递不占用线程"""
+        user_id = str(event.get('user_id'))
+        if not user_id:
+            logger.warning("Received event without user_id, ignoring")
+            return
+
+        logger.debug(f"[User:{user_id}] Processing webhook event")
+
+        if self.debounce_window > 0:
+            event = await self.debounce_event_async(user_id, event)
+            if event is None:
+                return
+
+        self.cleanup_expired_conversations()
+
+        self._pin(user_id)
+        try:
+            # 从持久化存储恢复会话需要读文件，放到线程池中执行
+            if self.store:
+                conversation = await asyncio.to_thread(self.get_conversation, user_id)
+            else:
+                conversation = self.get_conversation(user_id)
+
+            start = time.monotonic()
+            metrics.inc(f"bots.{self.name}.requests")
+            response = await self.message_handler.handle_message_async(event, conversation)
+
+            if response:
+                await self.message_handler.send_message_async(int(user_id), response, spool=True)
+                metrics.inc(f"bots.{self.name}.replies")
+            metrics.inc(f"bots.{self.name}.busy_seconds", time.monotonic() - start)
+        finally:
+            self._unpin(user_id)
+        if self.store:
+            await asyncio.to_thread(self.enforce_budget)
+        else:
+            self.enforce_budget()
+
+    def _pin(self, user_id: str) -> None:
+        """标记用户正在处理请求，其会话不会被逐出"""
+        with self._lock:
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+
+    def _unpin(self, user_id: str) -> None:
+        with self._lock:
+            self._active[user_id] -= 1
+            if not self._active[user_id]:
+                del self._active[user_id]
+
+    def reject(self, user_id: str, text: str) -> None:
+        """
+        拒绝一条消息（准入控制），尽力向用户发送一次繁忙提示，不重试
+
+        Args:
+            user_id: 用户唯一标识
+            text: 提示文本，为空时不发送
+        """
+        if self._shed(user_id, text):
+            self.message_handler.http_client.send_chat_message(
+                self.message_handler.synology_config['incoming_webhook_url'], text, [int(user_id)],
+                timeout=_NOTICE_TIMEOUT, retry_policy=_NOTICE_POLICY
+            )
+
+    async def reject_async(self, user_id: str, text: str) -> None:
+        """reject 的异步版本"""
+        if self._shed(user_id, text):
+            await self.message_handler.http_client.send_chat_message_async(
+                self.message_handler.synology_config['incoming_webhook_url'], text, [int(user_id)],
+                timeout=_NOTICE_TIMEOUT, retry_policy=_NOTICE_POLICY
+            )
+
+    def _shed(self, user_id: str, text: str) -> bool:
+        """记录被拒绝的消息，返回是否需要发送繁忙提示"""
+        metrics.inc(f"bots.{self.name}.shed")
+        logger.warning(f"[User:{user_id}] Request shed by admission control")
+        return bool(text) and str(user_id).isdigit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """会话占用与吞吐统计"""
+        with self._lock:
+            conversations = list(self.conversations.values())
+            approx_bytes = self._resident_bytes
+        messages = sum(len(conv.messages) for conv in conversations)
+        requests = metrics.get(f"bots.{self.name}.requests")
+        busy = metrics.get(f"bots.{self.name}.busy_seconds")
+        uptime = max(time.time() - self._started_at, 1e-9)
+        return {
+            'conversations': len(conversations),
+            'messages': messages,
+            'approx_bytes': approx_bytes,
+            'requests': requests,
+            'replies': metrics.get(f"bots.{self.name}.replies"),
+            'shed': metrics.get(f"bots.{self.name}.shed"),
+            'evicted': metrics.get(f"bots.{self.name}.evicted"),
+            'requests_per_minute': round(requests * 60 / uptime, 3),
+            'avg_handle_seconds': round(busy / requests, 3) if requests else None,
+        }
+
+    def debounce_event(self, user_id: str, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        合并同一用户在防抖窗口内连续发送的消息
+
+        第一条消息的请求负责等待：直到窗口内没有新消息或达到最大等待时间，
+        再以合并后的文本继续处理；窗口内后续到达的消息追加到该批次后直接返回。
+
+        Args:
+            user_id: 用户唯一标识
+            event: webhook 事件
+
+        Returns:
+            合并后的事件；消息已并入其他请求时返回 None
+        """
+        text = self._burst_text(event)
+        if text is None:
+            return event
+
+        with self._burst_lock:
+            burst = self._join_burst(user_id, text)
+            if burst is None:
+                return None
+            while True:
+                remaining = self._burst_remaining(burst)
+                if remaining <= 0:
+                    break
+                burst.cond.wait(remaining)
+            del self._bursts[user_id]
+
+        return self._merge_burst(user_id, event, burst)
+
+    async def debounce_event_async(self, user_id: str, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """debounce_event 的异步版本：第一条消息的任务按窗口休眠，不占用线程"""
+        text = self._burst_text(event)
+        if text is None:
+            return event
+
+        with self._burst_lock:
+            burst = self._join_burst(user_id, text)
+            if burst is None:
+                return None
+        while True:
+            with self._burst_lock:
+                remaining = self._burst_remaining(burst)
+                if remaining <= 0:
+                    del self._bursts[user_id]
+                    break
+            await asyncio.sleep(remaining)
+
+        return self._merge_burst(user_id, event, burst)
+
+    def _burst_text(self, event: Dict[str, Any]) -> Optional[str]:
+        """参与合并的消息文本，token 无效或空消息不参与合并（交由后续流程处理）时返回 None"""
+        # 不记录日志：无效 token 由后续处理流程校验并记录一次
+        if not self.message_handler.token_matches(event.get('token', '')):
+            return None
+        return (event.get('text') or '').strip() or None
+
+    def _join_burst(self, user_id: str, text: str) -> Optional[_Burst]:
+        """
+        将消息并入用户进行中的批次（须持有 _burst_lock）
+
+        Returns:
+            新建的批次（调用方负责等待）；已并入其他请求的批次时返回 None
+        """
+        burst = self._bursts.get(user_id)
+        if burst is not None:
+            burst.texts.append(text)
+            burst.last_at = time.monotonic()
+            burst.cond.notify()
+            logger.debug(f"[User:{user_id}] Message merged into pending burst ({len(burst.texts)} messages)")
+            return None
+        burst = _Burst(text, self._burst_lock)
+        self._bursts[user_id] = burst
+        return burst
 
-        # 处理消息
-        response = self.message_handler.handle_message(event, conversation)
+    def _burst_remaining(self, burst: _Burst) -> float:
+        """批次还需等待的时间（秒）"""
+        deadline = min(burst.last_at + self.debounce_window,
+                       burst.first_at + self.debounce_max_wait)
+        return deadline - time.monotonic()
 
-        # 发送响应
-        if response:
-            self.message_handler.send_message(int(user_id), response)
\ No newline at end of file
+    def _merge_burst(self, user_id: str, event: Dict[str, Any], burst: _Burst) -> Dict[str, Any]:
+        if len(burst.texts) > 1:
+            logger.info(f"[User:{user_id}] Merged {len(burst.texts)} messages into one turn")
+        merged = dict(event)
+        merged['text'] = '\n'.join(burst.texts)
+        return merged
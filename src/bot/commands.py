@@ -0,0 +1,171 @@
+# src/bot/commands.py
+"""
+本地命令
+以前缀开头的消息（如 /reset、/help）在本地处理后直接回复，不调用 LLM、不消耗 token
+"""
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from ..models.conversation import Conversation
+from ..providers.model_router import parse_router_models
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+from ..utils.usage_ledger import usage_ledger
+
+# 恢复按配置选择模型的参数
+_AUTO_MODEL = ('auto', 'default', '默认')
+
+
+def parse_command_aliases(value: str) -> Dict[str, str]:
+    """
+    解析命令别名配置
+
+    格式: "reset=reset|new|新对话,help=help|帮助"，等号前为命令名，等号后为以 | 分隔的别名
+    （不含前缀，不区分大小写，可以包含空格）。
+
+    Returns:
+        别名 -> 命令名
+    """
+    aliases: Dict[str, str] = {}
+    for item in (value or '').split(','):
+        name, _, words = item.partition('=')
+        name = name.strip().lower()
+        if not name:
+            continue
+        for word in (words or name).split('|'):
+            word = ' '.join(word.lower().split())
+            if word:
+                aliases[word] = name
+    return aliases
+
+
+class CommandDispatcher:
+    """
+    本地命令分发
+
+    - 消息去掉前缀后，先按整条消息查找别名（支持 "new chat" 这类多词命令），
+      再按第一个词查找并把其余部分作为参数；两次都是字典查找
+    - 内置命令: reset（清空会话历史和 Dify 会话）、help、usage（本人用量）、model（切换模型）
+    - 不匹配任何命令的消息照常发送给 LLM
+    """
+
+    def __init__(self, config: Dict[str, Any], chat_config: Dict[str, Any], chat_provider: Any):
+        """
+        Args:
+            config: COMMANDS 配置（prefix, aliases, models）
+            chat_config: CHAT_API 配置（用于确定可切换的模型）
+            chat_provider: 当前机器人的 Chat Provider
+        """
+        self.prefix = config.get('prefix', '/')
+        self.chat_provider = chat_provider
+        self._handlers: Dict[str, Callable[[Conversation, str], str]] = {
+            'reset': self._reset,
+            'help': self._help,
+            'usage': self._usage,
+            'model': self._model,
+        }
+        self._aliases: Dict[str, str] = {}
+        for alias, name in parse_command_aliases(config.get('aliases', '')).items():
+            if name in self._handlers:
+                self._aliases[alias] = name
+            else:
+                logger.warning(f"Unknown command '{name}' in COMMAND_ALIASES ignored")
+
+        # Dify 在平台侧配置模型，不支持切换
+        self.models: List[str] = []
+        if chat_config.get('type', 'openai').lower() == 'openai':
+            models = [m.strip() for m in config.get('models', '').split(',') if m.strip()]
+            if not models:
+                models = [chat_config.get('model', '')]
+                models += [m for m, _ in parse_router_models(chat_config.get('router_models', ''))]
+            self.models = [m for i, m in enumerate(models) if m and m not in models[:i]]
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], chat_config: Dict[str, Any],
+                    chat_provider: Any) -> Optional['CommandDispatcher']:
+        """COMMANDS 中启用时创建命令分发器"""
+        return cls(config, chat_config, chat_provider) if config.get('enabled') else None
+
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """
+        匹配命令
+
+        Returns:
+            (命令名, 参数)，不是命令时返回 None
+        """
+        if not text.startswith(self.prefix):
+            return None
+        body = ' '.join(text[len(self.prefix):].split())
+        lowered = body.lower()
+        name = self._aliases.get(lowered)
+        if name is not None:
+            return name, ''
+        head = lowered.partition(' ')[0]
+        name = self._aliases.get(head)
+        if name is None:
+            return None
+        # 参数保留原始大小写（模型名可能区分大小写）
+        return name, body[len(head):].strip()
+
+    def handle(self, text: str, conversation: Conversation) -> Optional[str]:
+        """
+        处理命令
+
+        Args:
+            text: 用户消息
+            conversation: 用户会话
+
+        Returns:
+            回复文本，不是命令时返回 None
+        """
+        matched = self.match(text)
+        if matched is None:
+            return None
+        name, argument = matched
+        metrics.inc(f"commands.{name}")
+        logger.info(f"[User:{conversation.user_id}] Handling local command: {name}")
+        return self._handlers[name](conversation, argument)
+
+    def _command(self, name: str) -> Optional[str]:
+        """命令的第一个别名（带前缀），未配置别名时返回 None"""
+        alias = next((a for a, n in self._aliases.items() if n == name), None)
+        return f"{self.prefix}{alias}" if alias is not None else None
+
+    def _reset(self, conversation: Conversation, argument: str) -> str:
+        conversation.clear_history()
+        if hasattr(self.chat_provider, 'clear_user_conversation'):
+            self.chat_provider.clear_user_conversation(conversation.user_id)
+        return '已开始新的对话。'
+
+    def _help(self, conversation: Conversation, argument: str) -> str:
+        usage = [('reset', '', '清空对话记录，开始新的对话'),
+                 ('usage', '', '查看我的 token 用量'),
+                 ('model', ' [模型名|auto]', '查看或切换模型'),
+                 ('help', '', '显示本帮助')]
+        lines = ['可用命令：']
+        for name, args, description in usage:
+            command = self._command(name)
+            if command and (name != 'model' or self.models):
+                lines.append(f"{command}{args} - {description}")
+        return '\n'.join(lines)
+
+    def _usage(self, conversation: Conversation, argument: str) -> str:
+        today = usage_ledger.summary(day=time.strftime('%Y-%m-%d'), user_id=conversation.user_id)['total']
+        total = usage_ledger.summary(user_id=conversation.user_id)['total']
+        return (f"今日：{int(today['requests'])} 次请求，{int(today['total_tokens'])} tokens\n"
+                f"累计：{int(total['requests'])} 次请求，{int(total['total_tokens'])} tokens")
+
+    def _model(self, conversation: Conversation, argument: str) -> str:
+        if not self.models:
+            return '当前机器人不支持切换模型。'
+        if not argument:
+            current = conversation.model or 'auto'
+            return f"当前模型：{current}\n可选模型：{', '.join(self.models)}（auto 表示按配置自动选择）"
+        if argument.lower() in _AUTO_MODEL:
+            conversation.set_model(None)
+            return '已恢复按配置自动选择模型。'
+        model = next((m for m in self.models if m.lower() == argument.lower()), None)
+        if model is None:
+            return f"未知模型：{argument}\n可选模型：{', '.join(self.models)}"
+        conversation.set_model(model)
+        return f"已切换到模型：{model}"
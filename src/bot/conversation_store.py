@@ -0,0 +1,348 @@
+# src/bot/conversation_store.py
+"""
+会话持久化
+以追加写日志 + 按用户快照的方式保存会话历史，重启后按需恢复
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Callable, List, Optional, IO
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不支持文件锁，仅用于单进程开发环境
+    fcntl = None
+
+from ..models.conversation import Conversation
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+
+
+class ConversationStore:
+    """
+    会话存储
+
+    - 请求路径上只向内存队列追加日志记录，后台线程按 flush_interval 批量写入当前日志段
+    - 每隔 snapshot_interval 切换到新的日志段，为有变更的用户写入快照文件，然后删除旧日志段
+    - 启动时不加载任何会话：后台线程先把上次运行遗留的日志段合并进快照，
+      之后每个用户在第一次访问时才读取自己的快照文件；过期会话直接丢弃
+
+    每个进程写自己的日志段并持有其文件锁，多 worker 部署时只合并没有进程持有的日志段。
+    """
+
+    _instances: List['ConversationStore'] = []
+
+    def __init__(self, directory: str, config: Dict[str, Any]):
+        self.directory = directory
+        self.snapshot_dir = os.path.join(directory, 'conversations')
+        self.max_history = config.get('max_history', 10)
+        self.timeout = config.get('timeout', 1800)
+        self.trim_block = config.get('trim_block', 1)
+        self.flush_interval = max(0.1, config.get('store_flush_interval', 1.0))
+        self.snapshot_interval = max(self.flush_interval, config.get('store_snapshot_interval', 300))
+
+        self._queue: deque = deque()
+        self._dirty: Dict[str, bool] = {}
+        self._state: Callable[[], Dict[str, Conversation]] = dict
+        self._segment: Optional[IO[str]] = None
+        self._segment_path = ''
+        self._writer_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._started_pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        ConversationStore._instances.append(self)
+        logger.info(f"Conversation store enabled at {directory} "
+                    f"(flush={self.flush_interval}s, snapshot={self.snapshot_interval}s)")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional['ConversationStore']:
+        """CONVERSATION 中配置了 store_dir 时创建存储"""
+        directory = config.get('store_dir', '')
+        return cls(directory, config) if directory else None
+
+    @classmethod
+    def stop_all(cls) -> None:
+        """停止所有存储（worker 退出时调用）"""
+        for store in cls._instances:
+            store.stop()
+
+    def attach(self, state: Callable[[], Dict[str, Conversation]]) -> None:
+        """
+        设置内存会话表的读取函数，写快照时使用
+
+        Args:
+            state: 返回 {user_id: Conversation} 的无参函数
+        """
+        self._state = state
+
+    def load(self, user_id: str) -> Optional[Conversation]:
+        """
+        恢复用户会话（读取该用户的快照文件）
+
+        Returns:
+            恢复的会话；快照已过期时返回沿用其序号的空会话；没有保存的会话时返回 None
+        """
+        self._ensure_started()
+        # 等待遗留日志段合并完成，避免读到旧快照
+        self._ready.wait(timeout=30)
+        snapshot = self._read_snapshot(user_id)
+        if snapshot is None:
+            return None
+        if time.time() - snapshot.get('last_activity', 0) > self.timeout:
+            self._remove_snapshot(user_id)
+            # 序号继续递增，新会话的日志记录不会被当作旧记录跳过
+            conversation = self._new_conversation(user_id)
+            conversation.seq = snapshot.get('seq', 0)
+            return conversation
+        conversation = self._from_snapshot(user_id, snapshot)
+        metrics.inc('conversation_store.restored')
+        logger.debug(f"[User:{user_id}] Restored conversation with {len(conversation.messages)} messages")
+        return conversation
+
+    def track(self, conversation: Conversation) -> None:
+        """为会话设置日志回调，之后的变更都会被持久化"""
+        conversation.journal = self.append
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        """追加一条日志记录（请求路径上调用，只写内存队列）"""
+        self._queue.append(entry)
+        if self._started_pid != os.getpid():
+            self._ensure_started()
+
+    def spill(self, conversation: Conversation) -> None:
+        """
+        将被逐出内存的会话立即写入快照，下次访问时通过 load() 恢复
+
+        Args:
+            conversation: 被逐出的会话
+        """
+        conversation.journal = None
+        with self._writer_lock:
+            self._write_snapshot(conversation.user_id, conversation.snapshot())
+        metrics.inc('conversation_store.spilled')
+
+    def drop(self, user_id: str) -> None:
+        """记录会话已被清理（下次写快照时删除快照文件）"""
+        self.append({'u': user_id, 's': 0, 't': time.time(), 'op': 'drop'})
+
+    def flush(self) -> int:
+        """
+        将队列中的日志记录写入当前日志段
+
+        Returns:
+            写入的记录数
+        """
+        with self._writer_lock:
+            return self._flush_locked()
+
+    def compact(self) -> int:
+        """
+        切换日志段并为有变更的用户写入快照，然后删除旧日志段
+
+        Returns:
+            写入或删除的快照数
+        """
+        with self._writer_lock:
+            self._flush_locked()
+            old_segment, old_path = self._segment, self._segment_path
+            dirty, self._dirty = self._dirty, {}
+            self._open_segment()
+
+            state = self._state()
+            written = 0
+            for user_id, dropped in dirty.items():
+                conversation = state.get(user_id)
+                if conversation is not None:
+                    self._write_snapshot(user_id, conversation.snapshot())
+                elif dropped:
+                    self._remove_snapshot(user_id)
+                else:
+                    continue
+                written += 1
+
+            if old_segment is not None:
+                old_segment.close()
+                self._remove_file(old_path)
+        if written:
+            metrics.inc('conversation_store.snapshots', written)
+            logger.debug(f"Conversation store compacted ({written} snapshot(s))")
+        return written
+
+    def stop(self) -> None:
+        """停止后台线程并写入最终快照"""
+        if self._started_pid != os.getpid():
+            return
+        self._stop.set()
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"❌ Failed to compact conversation store: {str(e)}")
+
+    def _ensure_started(self) -> None:
+        """启动后台写入线程（fork 后在子进程中重新启动）"""
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._ready.clear()
+            self._segment = None
+            with self._writer_lock:
+                self._open_segment()
+        threading.Thread(target=self._run, name='conversation-store', daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            self._recover()
+        except Exception as e:
+            logger.error(f"❌ Failed to recover conversation journal: {str(e)}")
+        finally:
+            self._ready.set()
+
+        last_snapshot = time.monotonic()
+        while not self._stop.wait(self.flush_interval):
+            try:
+                if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    self.compact()
+                    last_snapshot = time.monotonic()
+                else:
+                    self.flush()
+            except Exception as e:
+                logger.error(f"❌ Conversation store write failed: {str(e)}")
+
+    def _flush_locked(self) -> int:
+        entries = []
+        while True:
+            try:
+                entries.append(self._queue.popleft())
+            except IndexError:
+                break
+        if not entries or self._segment is None:
+            return 0
+        self._segment.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+        self._segment.flush()
+        for entry in entries:
+            user_id = str(entry['u'])
+            self._dirty[user_id] = entry['op'] == 'drop'
+        metrics.inc('conversation_store.journal_entries', len(entries))
+        return len(entries)
+
+    def _open_segment(self) -> None:
+        """打开新的日志段并持有其文件锁"""
+        path = os.path.join(self.directory, f"journal-{os.getpid()}-{time.time_ns()}.jsonl")
+        segment = open(path, 'a', encoding='utf-8')
+        if fcntl:
+            fcntl.flock(segment.fileno(), fcntl.LOCK_EX)
+        self._segment, self._segment_path = segment, path
+
+    def _journal_files(self) -> List[str]:
+        """目录中的日志段，按修改时间从旧到新（多个 worker 共用同一目录）"""
+        timed = []
+        for path in glob.glob(os.path.join(self.directory, 'journal-*.jsonl')):
+            try:
+                timed.append((os.path.getmtime(path), path))
+            except OSError:
+                continue  # 已被其他 worker 删除
+        return [path for _, path in sorted(timed)]
+
+    def _recover(self) -> None:
+        """将上次运行遗留（没有进程持有锁）的日志段合并进快照"""
+        start = time.monotonic()
+        conversations: Dict[str, Optional[Conversation]] = {}
+        merged: List[str] = []
+        for path in self._journal_files():
+            if path == self._segment_path:
+                continue
+            try:
+                f = open(path, 'r', encoding='utf-8')
+            except OSError:
+                continue  # 已被其他 worker 合并并删除
+            with f:
+                if fcntl:
+                    try:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # 其他 worker 正在写入
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 进程被强制终止时最后一行可能不完整
+                    self._replay(conversations, entry)
+            merged.append(path)
+
+        for user_id, conversation in conversations.items():
+            if conversation is None or conversation.is_expired():
+                self._remove_snapshot(user_id)
+            else:
+                self._write_snapshot(user_id, conversation.snapshot())
+        for path in merged:
+            self._remove_file(path)
+        if merged:
+            logger.info(f"Recovered {len(conversations)} conversation(s) from {len(merged)} journal "
+                        f"segment(s) in {time.monotonic() - start:.2f}s")
+
+    def _replay(self, conversations: Dict[str, Optional[Conversation]], entry: Dict[str, Any]) -> None:
+        """重放一条日志记录；conversations 中值为 None 表示会话已被清理"""
+        user_id = str(entry['u'])
+        if entry['op'] == 'drop':
+            conversations[user_id] = None
+            return
+        if user_id in conversations:
+            conversation = conversations[user_id]
+            if conversation is None:
+                # 清理后重新创建的会话：旧快照已失效，不再读取
+                conversation = conversations[user_id] = self._new_conversation(user_id)
+        else:
+            snapshot = self._read_snapshot(user_id)
+            conversation = (self._from_snapshot(user_id, snapshot) if snapshot
+                            else self._new_conversation(user_id))
+            conversations[user_id] = conversation
+        conversation.apply(entry)
+
+    def _new_conversation(self, user_id: str) -> Conversation:
+        return Conversation(user_id, self.max_history, self.timeout, self.trim_block)
+
+    def _from_snapshot(self, user_id: str, snapshot: Dict[str, Any]) -> Conversation:
+        conversation = self._new_conversation(user_id)
+        conversation.restore(snapshot.get('messages', []), snapshot.get('seq', 0),
+                             snapshot.get('last_activity', time.time()), snapshot.get('model'))
+        return conversation
+
+    def _snapshot_path(self, user_id: str) -> str:
+        name = hashlib.sha1(str(user_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.snapshot_dir, f"{name}.json")
+
+    def _read_snapshot(self, user_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._snapshot_path(user_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"[User:{user_id}] Ignoring unreadable conversation snapshot: {str(e)}")
+            return None
+
+    def _write_snapshot(self, user_id: str, snapshot: Dict[str, Any]) -> None:
+        """原子写入快照（先写临时文件再重命名）"""
+        path = self._snapshot_path(user_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _remove_snapshot(self, user_id: str) -> None:
+        self._remove_file(self._snapshot_path(user_id))
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
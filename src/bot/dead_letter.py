@@ -0,0 +1,436 @@
+# src/bot/dead_letter.py
+"""
+死信队列
+Synology 暂时不可用时，投递失败的回复写入本地追加写日志段，由后台线程退避重投
+"""
+import glob
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Callable, IO, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不支持文件锁，仅用于单进程开发环境
+    fcntl = None
+
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+
+
+class _Segment:
+    """一个日志段文件及其中尚未投递的回复"""
+
+    def __init__(self, path: str, handle: IO[str], size: int = 0):
+        self.path = path
+        self.handle = handle
+        self.size = size
+        self.pending: Set[str] = set()
+
+
+class _Letter:
+    """一条待重投的回复"""
+
+    def __init__(self, letter_id: str, user_id: int, text: str, created_at: float, segment: _Segment):
+        self.id = letter_id
+        self.user_id = user_id
+        self.text = text
+        self.created_at = created_at
+        self.segment = segment
+
+
+class DeadLetterSpool:
+    """
+    死信队列
+
+    - 投递失败的回复以 put 记录追加到当前日志段，重投成功（或过期、被丢弃）后追加 ack 记录；
+      日志段写满 segment_bytes 后切换到新段，只有当一个段及所有更早的段都没有待投递回复时才删除，
+      因此 ack 记录不会早于它确认的 put 记录被删除
+    - 磁盘占用超过 max_bytes 时丢弃最旧的日志段（连同其中的回复），超过 max_age 的回复不再重投
+    - 后台线程按用户合并待投递的回复（按到达顺序拼接）逐个用户重投；失败时按带抖动的指数退避等待，
+      任一回复直接投递成功时说明 Synology 已恢复，立即重投
+    - 某个用户还有待重投的回复时，新回复也写入队列，保证用户收到的顺序不变
+
+    每个进程写自己的日志段并持有其文件锁；启动时接管没有进程持有的日志段（上次运行遗留的回复）。
+    """
+
+    _instances: List['DeadLetterSpool'] = []
+
+    def __init__(self, directory: str, config: Dict[str, Any], name: str = 'default'):
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max(1, config.get('max_bytes', 50_000_000))
+        self.segment_bytes = max(1, min(self.max_bytes, config.get('segment_bytes', 1_000_000)))
+        self.max_age = config.get('max_age', 86400)
+        self.retry_backoff = max(0.1, config.get('retry_backoff', 5.0))
+        self.retry_backoff_max = max(self.retry_backoff, config.get('retry_backoff_max', 300.0))
+
+        self._send: Callable[[int, str], Optional[str]] = lambda user_id, text: None
+        self._segments: List[_Segment] = []
+        self._letters: 'OrderedDict[str, _Letter]' = OrderedDict()
+        self._users: Dict[int, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._failures = 0
+        self._next_attempt = 0.0
+        self._started_pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        metrics.register_gauge(f"spool.{name}.depth", lambda: len(self._letters))
+        metrics.register_gauge(f"spool.{name}.users", lambda: len(self._users))
+        metrics.register_gauge(f"spool.{name}.bytes", lambda: self._bytes)
+        metrics.register_gauge(f"spool.{name}.oldest_age", self.oldest_age)
+        DeadLetterSpool._instances.append(self)
+        logger.info(f"Dead-letter spool enabled at {directory} (max_bytes={self.max_bytes}, "
+                    f"max_age={self.max_age}s, backoff={self.retry_backoff}-{self.retry_backoff_max}s)")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], name: str = 'default') -> Optional['DeadLetterSpool']:
+        """SPOOL 中配置了 dir 时创建死信队列（每个机器人一个子目录）"""
+        directory = config.get('dir', '')
+        return cls(os.path.join(directory, name), config, name) if directory else None
+
+    @classmethod
+    def start_all(cls) -> int:
+        """启动所有死信队列，重投上次运行遗留的回复（worker 启动时调用）"""
+        for spool in cls._instances:
+            spool.ensure_started()
+        return len(cls._instances)
+
+    @classmethod
+    def stop_all(cls) -> None:
+        """停止所有死信队列（worker 退出时调用），待投递的回复留在磁盘上，下次启动时重投"""
+        for spool in cls._instances:
+            spool.stop()
+
+    def attach(self, send: Callable[[int, str], Optional[str]]) -> None:
+        """
+        设置重投函数
+
+        Args:
+            send: send(user_id, text)，返回未送达的部分：全部送达时为空字符串，完全失败时为 None
+        """
+        self._send = send
+
+    def has_pending(self, user_id: int) -> bool:
+        """用户是否还有待重投的回复"""
+        return user_id in self._users
+
+    def oldest_age(self) -> float:
+        """最早的待重投回复已等待的时间（秒），队列为空时为 0"""
+        with self._lock:
+            oldest = next(iter(self._letters.values()), None)
+        return round(time.time() - oldest.created_at, 3) if oldest else 0.0
+
+    def put(self, user_id: int, text: str, failed: bool = True) -> bool:
+        """
+        写入一条待重投的回复
+
+        Args:
+            user_id: 用户 ID
+            text: 回复文本（已发送的块除外）
+            failed: 是否为投递失败的回复；为 False 时只是排在该用户已有的待重投回复之后
+
+        Returns:
+            是否写入成功（单条回复超过 max_bytes 或写盘失败时返回 False）
+        """
+        self.ensure_started()
+        try:
+            if not self._append(user_id, text, time.time()):
+                return False
+        except OSError as e:
+            logger.error(f"❌ Failed to write dead-letter spool: {str(e)}")
+            return False
+        metrics.inc(f"spool.{self.name}.spooled")
+        logger.warning(f"[User:{user_id}] Reply spooled for redelivery ({len(self._letters)} pending)")
+        if failed and not self._failures:
+            # 刚刚投递失败，等待一个退避周期再重投
+            self._failed()
+        self._wake.set()
+        return True
+
+    def notify_delivered(self) -> None:
+        """一次直接投递成功：Synology 已恢复，立即重投队列中的回复"""
+        if self._letters and self._failures:
+            self._failures = 0
+            self._next_attempt = 0.0
+            self._wake.set()
+
+    def stop(self) -> None:
+        """停止后台线程并关闭日志段"""
+        if self._started_pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            for segment in self._segments:
+                segment.handle.close()
+            self._segments = []
+
+    def ensure_started(self) -> None:
+        """接管遗留日志段并启动重投线程（fork 后在子进程中重新启动）"""
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            with self._lock:
+                # fork 前打开的文件与锁属于父进程
+                self._segments, self._letters, self._users, self._bytes = [], OrderedDict(), {}, 0
+                self._recover()
+                self._open_segment()
+            self._started_pid = os.getpid()
+        threading.Thread(target=self._run, name=f"spool-{self.name}", daemon=True).start()
+
+    def redeliver(self) -> int:
+        """
+        按用户合并并重投队列中的回复，遇到失败时停止
+
+        Returns:
+            重投成功的回复数
+        """
+        self._expire()
+        delivered = 0
+        while not self._stop.is_set():
+            with self._lock:
+                first = next(iter(self._letters.values()), None)
+                if first is None:
+                    break
+                batch = [letter for letter in self._letters.values() if letter.user_id == first.user_id]
+            rest = self._send(first.user_id, '\n\n'.join(letter.text for letter in batch))
+            if rest is None:
+                self._failed()
+                metrics.inc(f"spool.{self.name}.failed_attempts")
+                return delivered
+            if rest:
+                # 部分送达：先写入未送达的部分再确认原回复，已发送的块不会重复发送
+                self._requeue(first.user_id, rest, first.created_at, batch)
+                self._failed()
+                metrics.inc(f"spool.{self.name}.failed_attempts")
+                metrics.inc(f"spool.{self.name}.partial")
+                return delivered
+            self._ack(batch)
+            delivered += len(batch)
+            metrics.inc(f"spool.{self.name}.redelivered", len(batch))
+            if len(batch) > 1:
+                metrics.inc(f"spool.{self.name}.coalesced", len(batch) - 1)
+            logger.info(f"[User:{first.user_id}] Redelivered {len(batch)} spooled repl"
+                        f"{'y' if len(batch) == 1 else 'ies'}")
+        self._failures = 0
+        self._next_attempt = 0.0
+        return delivered
+
+    def _append(self, user_id: int, text: str, created_at: float) -> bool:
+        """
+        追加一条 put 记录
+
+        Returns:
+            是否写入（单条超过 max_bytes 时丢弃并返回 False）
+
+        Raises:
+            OSError: 写盘失败时
+        """
+        letter_id = uuid.uuid4().hex
+        line = json.dumps({'op': 'put', 'id': letter_id, 'u': user_id, 'text': text, 't': created_at},
+                          ensure_ascii=False) + '\n'
+        size = len(line.encode('utf-8'))
+        if size > self.max_bytes:
+            metrics.inc(f"spool.{self.name}.dropped")
+            logger.error(f"[User:{user_id}] Reply too large for the dead-letter spool ({size} bytes), dropped")
+            return False
+        with self._lock:
+            self._reserve(size)
+            segment = self._write(line)
+            segment.pending.add(letter_id)
+            self._letters[letter_id] = _Letter(letter_id, user_id, text, created_at, segment)
+            self._users[user_id] = self._users.get(user_id, 0) + 1
+        return True
+
+    def _requeue(self, user_id: int, rest: str, created_at: float, batch: List[_Letter]) -> None:
+        """用未送达的部分替换一批回复（沿用最早一条的时间，max_age 仍按原回复计算）"""
+        try:
+            self._append(user_id, rest, created_at)
+        except OSError as e:
+            # 保留原回复：宁可重复发送也不丢失
+            logger.error(f"❌ Failed to write dead-letter spool: {str(e)}")
+            return
+        with self._lock:
+            # 重投期间排在该用户之后的新回复仍在未送达部分之后
+            batch_ids = {letter.id for letter in batch}
+            later = [letter.id for letter in self._letters.values()
+                     if letter.user_id == user_id and letter.id not in batch_ids and letter.created_at > created_at]
+            for letter_id in later:
+                self._letters.move_to_end(letter_id)
+        self._ack(batch)
+
+    def _failed(self) -> None:
+        """记录一次失败，按带抖动的指数退避安排下一次重投"""
+        self._failures += 1
+        delay = min(self.retry_backoff_max, self.retry_backoff * (2 ** (self._failures - 1)))
+        self._next_attempt = time.monotonic() + random.uniform(delay / 2, delay)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self._letters and time.monotonic() >= self._next_attempt:
+                try:
+                    self.redeliver()
+                except Exception as e:
+                    self._failed()
+                    logger.error(f"❌ Dead-letter redelivery failed: {str(e)}")
+            # 队列为空时等待新的回复
+            delay = max(0.0, self._next_attempt - time.monotonic()) if self._letters else None
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _expire(self) -> None:
+        """丢弃超过 max_age 的回复"""
+        if not self.max_age:
+            return
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            expired = [letter for letter in self._letters.values() if letter.created_at < cutoff]
+        if expired:
+            self._ack(expired)
+            metrics.inc(f"spool.{self.name}.expired", len(expired))
+            logger.warning(f"Dropped {len(expired)} spooled repl{'y' if len(expired) == 1 else 'ies'} "
+                           f"older than {self.max_age}s")
+
+    def _ack(self, letters: List[_Letter]) -> None:
+        """确认回复已处理：写入 ack 记录并删除不再需要的日志段"""
+        line = json.dumps({'op': 'ack', 'ids': [letter.id for letter in letters]}) + '\n'
+        with self._lock:
+            for letter in letters:
+                if self._letters.pop(letter.id, None) is None:
+                    continue
+                letter.segment.pending.discard(letter.id)
+                self._users[letter.user_id] -= 1
+                if not self._users[letter.user_id]:
+                    del self._users[letter.user_id]
+            try:
+                self._write(line)
+            except OSError as e:
+                # 未写入 ack 时重启后可能重复投递
+                logger.error(f"❌ Failed to write dead-letter ack: {str(e)}")
+            self._collect()
+
+    def _reserve(self, size: int) -> None:
+        """写入 size 字节前，超出 max_bytes 时丢弃最旧的日志段（须持有 _lock）"""
+        while self._bytes + size > self.max_bytes and self._segments:
+            if len(self._segments) == 1:
+                self._open_segment()
+            segment = self._segments.pop(0)
+            dropped = [self._letters.pop(letter_id) for letter_id in segment.pending if letter_id in self._letters]
+            for letter in dropped:
+                self._users[letter.user_id] -= 1
+                if not self._users[letter.user_id]:
+                    del self._users[letter.user_id]
+            self._remove(segment)
+            if dropped:
+                metrics.inc(f"spool.{self.name}.dropped", len(dropped))
+                logger.error(f"❌ Dead-letter spool full, dropped {len(dropped)} oldest repl"
+                             f"{'y' if len(dropped) == 1 else 'ies'}")
+
+    def _write(self, line: str) -> _Segment:
+        """向当前日志段追加一行，写满时先切换到新段（须持有 _lock）"""
+        if not self._segments:
+            raise OSError("dead-letter spool is stopped")
+        segment = self._segments[-1]
+        if segment.size and segment.size + len(line.encode('utf-8')) > self.segment_bytes:
+            self._open_segment()
+            segment = self._segments[-1]
+        segment.handle.write(line)
+        segment.handle.flush()
+        size = len(line.encode('utf-8'))
+        segment.size += size
+        self._bytes += size
+        return segment
+
+    def _collect(self) -> None:
+        """从最旧的段开始删除没有待投递回复的日志段（须持有 _lock）"""
+        while self._segments and not self._segments[0].pending:
+            if len(self._segments) == 1:
+                # 当前段已全部确认：切换到空段以释放磁盘
+                if not self._segments[0].size:
+                    return
+                self._open_segment()
+            self._remove(self._segments.pop(0))
+
+    def _open_segment(self) -> None:
+        """打开新的日志段并持有其文件锁（须持有 _lock）"""
+        path = os.path.join(self.directory, f"spool-{os.getpid()}-{time.time_ns()}.jsonl")
+        handle = open(path, 'a', encoding='utf-8')
+        if fcntl:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        self._segments.append(_Segment(path, handle))
+
+    def _remove(self, segment: _Segment) -> None:
+        segment.handle.close()
+        self._bytes -= segment.size
+        try:
+            os.remove(segment.path)
+        except FileNotFoundError:
+            pass
+
+    def _segment_files(self) -> List[str]:
+        """目录中的日志段，按修改时间从旧到新（多个 worker 共用同一目录）"""
+        timed = []
+        for path in glob.glob(os.path.join(self.directory, 'spool-*.jsonl')):
+            try:
+                timed.append((os.path.getmtime(path), path))
+            except OSError:
+                continue  # 已被其他 worker 删除
+        return [path for _, path in sorted(timed)]
+
+    def _recover(self) -> None:
+        """接管没有进程持有锁的日志段，恢复其中尚未确认的回复（须持有 _lock）"""
+        segments: List[_Segment] = []
+        puts: Dict[str, Dict[str, Any]] = {}
+        owners: Dict[str, _Segment] = {}
+        acked: Set[str] = set()
+        for path in self._segment_files():
+            try:
+                handle = open(path, 'r+', encoding='utf-8')
+            except OSError:
+                continue  # 已被其他 worker 删除
+            if fcntl:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    handle.close()
+                    continue  # 其他 worker 正在使用
+            segment = _Segment(path, handle, os.path.getsize(path))
+            segments.append(segment)
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 进程被强制终止时最后一行可能不完整
+                if entry.get('op') == 'put':
+                    puts[entry['id']] = entry
+                    owners[entry['id']] = segment
+                elif entry.get('op') == 'ack':
+                    acked.update(entry.get('ids', []))
+
+        # 按回复产生的时间排序（部分送达后写入的剩余部分沿用原回复的时间）
+        for letter_id, entry in sorted(puts.items(), key=lambda item: item[1].get('t', 0)):
+            if letter_id in acked:
+                continue
+            segment = owners[letter_id]
+            segment.pending.add(letter_id)
+            self._letters[letter_id] = _Letter(letter_id, entry['u'], entry['text'], entry['t'], segment)
+            self._users[entry['u']] = self._users.get(entry['u'], 0) + 1
+        self._segments = segments
+        self._bytes = sum(segment.size for segment in segments)
+        # 已全部确认的遗留段直接删除
+        while self._segments and not self._segments[0].pending:
+            self._remove(self._segments.pop(0))
+        if self._letters:
+            logger.info(f"Recovered {len(self._letters)} spooled repl{'y' if len(self._letters) == 1 else 'ies'} "
+                        f"from {len(segments)} segment(s)")
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from typing import Dict, Any, List, Optional
+from ..utils.deadline import current_deadline
+from ..utils.http_client import HTTPClient
+from ..utils.logger import logger
+from ..utils.text import iter_message_chunks
+from .dead_letter import DeadLetterSpool
+
+
+class ReplyDelivery:
+    """
+    回复投递阶段
+
+    将长回复按 Markdown 结构拆分为不超过 max_bytes 的块，按顺序通过
+    HTTPClient 的 keep-alive 连接逐块发送。拆分与编码是惰性的，
+    第一块在其余部分处理完成前即可发出；某一块发送失败时只重试该块，
+    重试耗尽后停止，已发送的块不会重复发送。
+    配置了死信队列时，未发送的部分写入队列，由后台线程重投。
+    """
+
+    def __init__(self, http_client: HTTPClient, webhook_url: str, config: Dict[str, Any],
+                 spool: Optional[DeadLetterSpool] = None):
+        self.http_client = http_client
+        self.webhook_url = webhook_url
+        self.max_bytes = config.get('max_message_bytes', 0)
+        self.chunk_retries = config.get('chunk_retries', 2)
+        self.retry_backoff = config.get('chunk_retry_backoff', 0.5)
+        self.spool = spool
+        if spool is not None:
+            spool.attach(self.redeliver)
+
+    def deliver(self, user_id: int, text: str, spool: bool = False) -> bool:
+        """
+        投递一条回复（必要时拆分为多块）
+
+        Args:
+            user_id: 用户 ID
+            text: 回复文本
+            spool: 投递失败时是否写入死信队列（输入提示等临时消息不写入）
+
+        Returns:
+            是否全部投递成功（写入死信队列时返回 False）
+        """
+        if self._queue_behind(user_id, text, spool):
+            return False
+        sent = 0
+        chunks = iter_message_chunks(text, self.max_bytes)
+        for index, chunk in enumerate(chunks):
+            if not self._send_chunk(user_id, chunk, index):
+                self._stopped(user_id, index, sent, [chunk, *chunks], spool)
+                return False
+            sent += 1
+        return self._delivered(user_id, sent)
+
+    async def deliver_async(self, user_id: int, text: str, spool: bool = False) -> bool:
+        """deliver 的异步版本（ASGI 模式使用）"""
+        if self._queue_behind(user_id, text, spool):
+            return False
+        sent = 0
+        chunks = iter_message_chunks(text, self.max_bytes)
+        for index, chunk in enumerate(chunks):
+            if not await self._send_chunk_async(user_id, chunk, index):
+                self._stopped(user_id, index, sent, [chunk, *chunks], spool)
+                return False
+            sent += 1
+        return self._delivered(user_id, sent)
+
+    def _queue_behind(self, user_id: int, text: str, spool: bool) -> bool:
+        """用户还有待重投的回复时，新回复排在其后写入死信队列，保证顺序"""
+        if not spool or self.spool is None:
+            return False
+        self.spool.ensure_started()
+        return self.spool.has_pending(user_id) and self.spool.put(user_id, text, failed=False)
+
+    def _stopped(self, user_id: int, index: int, sent: int, rest: List[str], spool: bool) -> None:
+        logger.warning(f"[User:{user_id}] Delivery stopped at chunk {index + 1} "
+                       f"({sent} chunk(s) delivered)")
+        if spool and self.spool is not None:
+            self.spool.put(user_id, '\n\n'.join(rest))
+
+    def _delivered(self, user_id: int, sent: int) -> bool:
+        if sent > 1:
+            logger.debug(f"[User:{user_id}] Reply delivered in {sent} chunks")
+        if sent and self.spool is not None:
+            self.spool.notify_delivered()
+        return sent > 0
+
+    def redeliver(self, user_id: int, text: str) -> Optional[str]:
+        """
+        重投死信队列中的回复（由死信队列的后台线程调用）
+
+        Returns:
+            全部送达时为空字符串；第一块就失败时为 None；部分送达时为未送达的部分
+        """
+        chunks = list(iter_message_chunks(text, self.max_bytes))
+        sent = self.deliver_chunks(user_id, chunks)
+        if sent == len(chunks):
+            return ''
+        if not sent:
+            return None
+        logger.warning(f"[User:{user_id}] Redelivery stopped at chunk {sent + 1} "
+                       f"({sent} chunk(s) delivered)")
+        return '\n\n'.join(chunks[sent:])
+
+    def deliver_chunks(self, user_id: int, chunks: List[str], start: int = 0) -> int:
+        """
+        从第 start 块开始按顺序投递已拆分的块
+
+        Returns:
+            第一个未投递成功的块的下标，全部成功时等于 len(chunks)
+        """
+        for index in range(start, len(chunks)):
+            if not self._send_chunk(user_id, chunks[index], index):
+                return index
+        return len(chunks)
+
+    def _send_chunk(self, user_id: int, chunk: str, index: int) -> bool:
+        """发送单个块，失败时按指数退避重试"""
+        for attempt in range(self.chunk_retries + 1):
+            if attempt:
+                delay = self._retry_delay(user_id, index, attempt)
+                if delay is None:
+                    return False
+                time.sleep(delay)
+            if self.http_client.send_chat_message(self.webhook_url, chunk, [user_id]):
+                return True
+        return False
+
+    async def _send_chunk_async(self, user_id: int, chunk: str, index: int) -> bool:
+        """_send_chunk 的异步版本"""
+        for attempt in range(self.chunk_retries + 1):
+            if attempt:
+                delay = self._retry_delay(user_id, index, attempt)
+                if delay is None:
+                    return False
+                await asyncio.sleep(delay)
+            if await self.http_client.send_chat_message_async(self.webhook_url, chunk, [user_id]):
+                return True
+        return False
+
+    def _retry_delay(self, user_id: int, index: int, attempt: int) -> Optional[float]:
+        """第 attempt 次尝试前的等待时间，剩余时间不足时返回 None"""
+        delay = self.retry_backoff * (2 ** (attempt - 1))
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() <= delay:
+            logger.warning(f"[User:{user_id}] No time left to retry chunk {index + 1}")
+            return None
+        logger.debug(f"[User:{user_id}] Retrying chunk {index + 1} in {delay:.1f}s "
+                     f"(attempt {attempt + 1}/{self.chunk_retries + 1})")
+        return delay
@@ -0,0 +1,116 @@
+# src/bot/dispatcher.py
+"""
+webhook 分发
+按 user_id 一致性哈希把请求转发到固定的后端实例，使每个用户的会话始终留在同一个进程的内存中
+"""
+import threading
+import time
+from typing import Dict, Any, List, Tuple
+
+import requests
+
+from ..utils.hash_ring import HashRing
+from ..utils.http_client import get_shared_session
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+from ..utils.retry import is_connect_error
+
+
+class Dispatcher:
+    """
+    webhook 分发器
+
+    - 后端为各自只运行一个 worker 的机器人实例（可分布在不同主机上）
+    - 同一 user_id 总是转发到哈希环上的同一后端；后端无法连接时标记为下线 down_interval 秒，
+      只有该后端的用户顺延到环上的下一个后端，恢复后自动回到原后端
+    - 只有连接失败时才转发给下一个后端（请求尚未被处理），其他错误直接返回
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.backends = [url.strip().rstrip('/') for url in config.get('backends', '').split(',') if url.strip()]
+        if not self.backends:
+            raise ValueError("No dispatch backends configured")
+        self.ring = HashRing(self.backends, config.get('virtual_nodes', 100))
+        self.timeout = config.get('timeout', 120.0)
+        self.connect_timeout = config.get('connect_timeout', 2.0)
+        self.down_interval = config.get('down_interval', 10.0)
+        pool_size = config.get('pool_size', 100)
+        # 重试由分发器自己处理（换到下一个后端），连接池层不重试
+        self._sessions = {url: get_shared_session(url, 0, pool_size) for url in self.backends}
+        self._down_until: Dict[str, float] = {}
+        self._forwarded: Dict[str, int] = {url: 0 for url in self.backends}
+        self._lock = threading.Lock()
+        metrics.register_gauge('dispatch.backends_up', lambda: sum(1 for url in self.backends if self.is_up(url)))
+        logger.info(f"Dispatcher routing to {len(self.backends)} backend(s): {', '.join(self.backends)}")
+
+    def is_up(self, backend: str) -> bool:
+        return time.monotonic() >= self._down_until.get(backend, 0.0)
+
+    def candidates(self, user_id: str) -> List[str]:
+        """
+        按优先顺序返回用户的候选后端
+
+        在线的后端按哈希环顺序排在前面；全部下线时仍按环顺序逐个尝试。
+        """
+        ordered = list(self.ring.iter_nodes(user_id))
+        up = [url for url in ordered if self.is_up(url)]
+        return up or ordered
+
+    def forward(self, form: Dict[str, Any]) -> Tuple[int, str, str]:
+        """
+        转发一个 webhook 请求
+
+        Args:
+            form: webhook 表单数据
+
+        Returns:
+            (HTTP 状态码, 响应内容, 处理请求的后端)
+        """
+        user_id = str(form.get('user_id') or '')
+        for index, backend in enumerate(self.candidates(user_id)):
+            try:
+                response = self._sessions[backend].post(
+                    f"{backend}/webhook",
+                    data=form,
+                    timeout=(self.connect_timeout, self.timeout)
+                )
+            except requests.exceptions.RequestException as e:
+                if is_connect_error(e):
+                    self._mark_down(backend, e)
+                    continue
+                metrics.inc('dispatch.errors')
+                logger.error(f"❌ Backend {backend} failed for user {user_id}: {str(e)}")
+                return 502, 'Bad Gateway', backend
+
+            with self._lock:
+                self._forwarded[backend] += 1
+                self._down_until.pop(backend, None)
+            metrics.inc('dispatch.forwarded')
+            if index:
+                metrics.inc('dispatch.failover')
+            return response.status_code, response.text, backend
+
+        metrics.inc('dispatch.unavailable')
+        return 503, 'No backend available', ''
+
+    def _mark_down(self, backend: str, error: Exception) -> None:
+        with self._lock:
+            self._down_until[backend] = time.monotonic() + self.down_interval
+        metrics.inc('dispatch.backend_down')
+        logger.warning(f"⚠️  Backend {backend} unreachable, routing its users to the next backend "
+                       f"for {self.down_interval:.0f}s: {type(error).__name__}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各后端的状态与转发数"""
+        with self._lock:
+            forwarded = dict(self._forwarded)
+        total = sum(forwarded.values())
+        return {
+            'backends': [{
+                'url': url,
+                'up': self.is_up(url),
+                'forwarded': forwarded[url],
+                'share': round(forwarded[url] / total, 4) if total else None,
+            } for url in self.backends],
+            'virtual_nodes': self.ring.virtual_nodes,
+        }
@@ -1,91 +1,317 @@
-from typing import Dict, Any, Optional
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
 from ..utils.http_client import HTTPClient
+from ..utils.retry import RetryPolicy
 from ..models.conversation import Conversation
 from ..providers.factory import ProviderFactory
+from ..utils.deadline import Deadline, current_deadline, deadline_scope
 from ..utils.logger import logger, log_error
+from ..utils.metrics import metrics
+from ..utils.text import estimate_tokens
+from ..utils.traffic_recorder import traffic_recorder
+from .commands import CommandDispatcher
+from .dead_letter import DeadLetterSpool
+from .delivery import ReplyDelivery
+from .semantic_cache import SemanticCache
+from .typing_indicator import AsyncTypingIndicator, TypingIndicator
+
+
+class _Turn:
+    """一次正在进行的 LLM 请求，被同一用户的新消息取代时置位 superseded"""
+
+    def __init__(self):
+        self.superseded = threading.Event()
 
 
 class MessageHandler:
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], http_client: Optional[HTTPClient] = None):
         self.config = config
-        self.http_client = HTTPClient(
+        # 多机器人模式下共用同一个 HTTPClient（及其连接池）
+        self.http_client = http_client or HTTPClient(
             timeout=config['HTTP']['timeout'],
-            max_retries=config['HTTP']['max_retries']
+            max_retries=config['HTTP']['max_retries'],
+            pool_size=config['HTTP'].get('pool_size', 10),
+            retry_policy=RetryPolicy.from_config('synology', config['HTTP'])
         )
         self.chat_config = config['CHAT_API']
         self.synology_config = config['SYNOLOGY']
         self.conversation_config = config['CONVERSATION']
-        # 使用 Provider 工厂创建对应的 Chat Provider
-        self.chat_provider = ProviderFactory.create(config)
+        # 投递失败的回复写入死信队列，在后台重投（可选）
+        self.delivery = ReplyDelivery(
+            self.http_client,
+            self.synology_config['incoming_webhook_url'],
+            self.synology_config,
+            spool=DeadLetterSpool.from_config(config.get('SPOOL', {}), config.get('BOT', {}).get('name', 'default'))
+        )
+        # 从 Provider 工厂获取进程内共享的 Chat Provider
+        self.chat_provider = ProviderFactory.get(config)
+        # 新消息取代同一用户尚未完成的请求（可选）
+        self.supersede = self.conversation_config.get('supersede', False)
+        # 请求截止时间内为投递回复预留的时间，以及时间耗尽时的提示
+        deadline_config = config.get('DEADLINE', {})
+        self.delivery_reserve = deadline_config.get('delivery_reserve', 0.0)
+        self.timeout_text = deadline_config.get('timeout_text', '')
+        # 首轮提问的语义缓存（可选）
+        self.semantic_cache = SemanticCache.from_config(
+            config.get('SEMANTIC_CACHE', {}), config.get('BOT', {}).get('name', 'default')
+        )
+        # 本地命令（/reset、/help 等），直接回复，不调用 LLM
+        self.commands = CommandDispatcher.from_config(
+            config.get('COMMANDS', {}), self.chat_config, self.chat_provider
+        )
+        self._active_turns: Dict[str, _Turn] = {}
+        self._turn_lock = threading.Lock()
         logger.info(f"MessageHandler initialized with {self.chat_provider.provider_name}")
 
+    def token_matches(self, token: str) -> bool:
+        """token 是否与 outgoing webhook token 一致（不记录日志）"""
+        return token == self.synology_config['outgoing_webhook_token']
+
     def validate_token(self, token: str) -> bool:
         """验证webhook token"""
-        is_valid = token == self.synology_config['outgoing_webhook_token']
+        is_valid = self.token_matches(token)
         if not is_valid:
             logger.warning("Webhook token validation failed")
         return is_valid
 
-    def send_message(self, user_id: int, text: str) -> bool:
-        """发送消息到Synology Chat"""
+    def send_message(self, user_id: int, text: str, spool: bool = False) -> bool:
+        """发送消息到Synology Chat（spool 为 True 时投递失败的回复写入死信队列）"""
         logger.debug(f"[User:{user_id}] Sending message to Synology Chat...")
-        success = self.http_client.send_chat_message(
-            self.synology_config['incoming_webhook_url'],
-            text,
-            [user_id]
-        )
+        return self._log_delivery(user_id, self.delivery.deliver(user_id, text, spool=spool))
+
+    async def send_message_async(self, user_id: int, text: str, spool: bool = False) -> bool:
+        """send_message 的异步版本"""
+        logger.debug(f"[User:{user_id}] Sending message to Synology Chat...")
+        return self._log_delivery(user_id, await self.delivery.deliver_async(user_id, text, spool=spool))
+
+    def _log_delivery(self, user_id: int, success: bool) -> bool:
+        spool = self.delivery.spool
         if success:
             logger.debug(f"[User:{user_id}] Message sent successfully")
+        elif spool is not None and spool.has_pending(user_id):
+            logger.info(f"[User:{user_id}] Message queued in the dead-letter spool for redelivery")
         else:
             log_error("Synology", f"Failed to send message to user {user_id}",
                      suggestion="Check SYNOLOGY_INCOMING_WEBHOOK_URL configuration")
         return success
 
-    def get_chat_response(self, conversation: Conversation) -> Optional[str]:
-        """从Chat API获取响应（使用 Provider 抽象层）"""
+    def _typing_options(self) -> Dict[str, Any]:
+        return {
+            'text': self.conversation_config['typing_text'],
+            'delay': self.conversation_config.get('typing_delay', 0.0),
+            'repeat_text': self.conversation_config.get('typing_repeat_text', ''),
+            'repeat_interval': self.conversation_config.get('typing_repeat_interval', 0.0),
+        }
+
+    def start_typing_indicator(self, user_id: int) -> TypingIndicator:
+        """启动与 LLM 请求并行的输入提示"""
+        return TypingIndicator(
+            str(user_id),
+            lambda text: self.send_message(user_id, text),
+            **self._typing_options()
+        ).start()
+
+    def start_typing_indicator_async(self, user_id: int) -> AsyncTypingIndicator:
+        """start_typing_indicator 的异步版本（必须在事件循环中调用）"""
+        return AsyncTypingIndicator(
+            str(user_id),
+            lambda text: self.send_message_async(user_id, text),
+            **self._typing_options()
+        ).start()
+
+    def begin_turn(self, user_id: str) -> tuple:
+        """
+        登记用户的新一轮请求，启用 supersede 时取消该用户尚未完成的请求
+
+        Returns:
+            (当前轮次, 是否取代了进行中的请求)
+        """
+        turn = _Turn()
+        with self._turn_lock:
+            previous = self._active_turns.get(user_id)
+            self._active_turns[user_id] = turn
+        if previous is None:
+            return turn, False
+        previous.superseded.set()
+        metrics.inc('supersede.cancelled')
+        logger.info(f"[User:{user_id}] New message supersedes in-flight request")
+        return turn, True
+
+    def end_turn(self, user_id: str, turn: _Turn) -> None:
+        """结束一轮请求"""
+        with self._turn_lock:
+            if self._active_turns.get(user_id) is turn:
+                del self._active_turns[user_id]
+
+    def _prompt(self, conversation: Conversation, merge_pending: bool) -> Tuple[str, bool, Optional[str]]:
+        """
+        确定本轮发送给 LLM 的消息，并查询语义缓存
+
+        Returns:
+            (本轮消息, 是否可以使用语义缓存, 缓存命中的回复)
+        """
         # 获取最后一条用户消息
         last_message = ''
         if conversation.messages:
             last_message = conversation.messages[-1].get('content', '')
+        if merge_pending:
+            pending = []
+            for msg in reversed(conversation.messages):
+                if msg.get('role') != 'user':
+                    break
+                pending.append(msg.get('content', ''))
+            last_message = '\n'.join(reversed(pending))
+
+        # 只有首轮提问与上下文无关，可以使用语义缓存
+        cacheable = self.semantic_cache is not None and len(conversation.messages) == 1
+        cached = self.semantic_cache.lookup(last_message) if cacheable else None
+        return last_message, cacheable, cached
+
+    def get_chat_response(self, conversation: Conversation, merge_pending: bool = False) -> Optional[str]:
+        """
+        从Chat API获取响应（使用 Provider 抽象层）
 
-        return self.chat_provider.send_message(
+        Args:
+            conversation: 用户会话
+            merge_pending: 是否将末尾所有未得到回复的用户消息合并为本轮消息
+                           （取代旧请求时，被取代的消息需要随新消息一起发送）
+        """
+        last_message, cacheable, cached = self._prompt(conversation, merge_pending)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        response = self.chat_provider.send_message(
             conversation.user_id,
             last_message,
             conversation
         )
+        traffic_recorder.note_upstream(time.perf_counter() - start)
+        if cacheable and response:
+            self.semantic_cache.add(last_message, response)
+        return response
+
+    async def get_chat_response_async(self, conversation: Conversation,
+                                      merge_pending: bool = False) -> Optional[str]:
+        """get_chat_response 的异步版本（Provider 的 send_message_async）"""
+        last_message, cacheable, cached = self._prompt(conversation, merge_pending)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        response = await self.chat_provider.send_message_async(
+            conversation.user_id,
+            last_message,
+            conversation
+        )
+        traffic_recorder.note_upstream(time.perf_counter() - start)
+        if cacheable and response:
+            self.semantic_cache.add(last_message, response)
+        return response
 
     def handle_message(self, event: Dict[str, Any], conversation: Conversation) -> Optional[str]:
         """处理接收到的消息"""
+        proceed, reply, llm_deadline = self._accept(event, conversation)
+        if not proceed:
+            return reply
+
+        # 获取API响应，输入提示（可选）在后台并行发送
+        turn, merge_pending = self.begin_turn(conversation.user_id) if self.supersede else (None, False)
+        typing = self.start_typing_indicator(event['user_id'])
+        try:
+            # LLM 请求须在预留投递时间之前完成
+            with deadline_scope(llm_deadline):
+                response = self.get_chat_response(conversation, merge_pending=merge_pending)
+        finally:
+            typing.stop()
+            if turn is not None:
+                self.end_turn(conversation.user_id, turn)
+
+        return self._complete(event, conversation, turn, response, llm_deadline)
+
+    async def handle_message_async(self, event: Dict[str, Any], conversation: Conversation) -> Optional[str]:
+        """handle_message 的异步版本，等待 LLM 期间不占用线程"""
+        proceed, reply, llm_deadline = self._accept(event, conversation)
+        if not proceed:
+            return reply
+
+        turn, merge_pending = self.begin_turn(conversation.user_id) if self.supersede else (None, False)
+        typing = self.start_typing_indicator_async(event['user_id'])
+        try:
+            with deadline_scope(llm_deadline):
+                response = await self.get_chat_response_async(conversation, merge_pending=merge_pending)
+        finally:
+            await typing.stop()
+            if turn is not None:
+                self.end_turn(conversation.user_id, turn)
+
+        return self._complete(event, conversation, turn, response, llm_deadline)
+
+    def _accept(self, event: Dict[str, Any],
+                conversation: Conversation) -> Tuple[bool, Optional[str], Optional[Deadline]]:
+        """
+        调用 LLM 之前的处理：校验 token、本地命令、写入用户消息、检查剩余时间
+
+        Returns:
+            (是否需要调用 LLM, 不调用时直接回复的文本, LLM 请求的截止时间)
+        """
         user_id = event.get('user_id', 'unknown')
         
         # Token 验证
         if not self.validate_token(event.get('token', '')):
             logger.warning(f"[User:{user_id}] Invalid webhook token, rejecting request")
-            return None
+            return False, None, None
 
         message = event.get('text', '').strip()
         if not message:
             logger.debug(f"[User:{user_id}] Empty message received, ignoring")
-            return None
+            return False, None, None
 
         logger.info(f"[User:{user_id}] Received message: {message[:50]}{'...' if len(message) > 50 else ''}")
 
-        # 发送输入提示（可选）
-        typing_text = self.conversation_config['typing_text']
-        if typing_text:
-            logger.debug(f"[User:{user_id}] Sending typing indicator")
-            self.send_message(event['user_id'], typing_text)
+        # 本地命令：不写入会话历史，也不调用 LLM
+        if self.commands is not None:
+            reply = self.commands.handle(message, conversation)
+            if reply is not None:
+                return False, reply, None
 
         # 添加用户消息到会话
         conversation.add_message("user", message)
         logger.debug(f"[User:{user_id}] Conversation history: {len(conversation.messages)} messages")
 
-        # 获取API响应
-        response = self.get_chat_response(conversation)
+        # 剩余时间已不足以调用 LLM（如排队过久）：直接发送超时提示
+        request_deadline = current_deadline()
+        llm_deadline = request_deadline.reserve(self.delivery_reserve) if request_deadline else None
+        if llm_deadline is not None and llm_deadline.expired:
+            metrics.inc('deadline.skipped')
+            logger.warning(f"[User:{user_id}] Request deadline exhausted before calling the AI API")
+            return False, self.timeout_text or None, None
+        return True, None, llm_deadline
+
+    def _complete(self, event: Dict[str, Any], conversation: Conversation, turn: Optional[_Turn],
+                  response: Optional[str], llm_deadline: Optional[Deadline]) -> Optional[str]:
+        """LLM 返回之后的处理，返回需要发送给用户的回复"""
+        user_id = event.get('user_id', 'unknown')
+
+        # 已被更新的消息取代：丢弃结果，不写入会话历史，也不发送给用户
+        if turn is not None and turn.superseded.is_set():
+            metrics.inc('supersede.dropped_responses')
+            if response:
+                # 被丢弃回复的估算 completion token 数（已经计费，只是不再发送给用户）
+                metrics.inc('supersede.dropped_tokens', estimate_tokens(response))
+            logger.info(f"[User:{user_id}] Dropped superseded response")
+            return None
+
         if response:
             conversation.add_message("assistant", response)
             logger.info(f"[User:{user_id}] Response generated: {len(response)} chars")
             return response
 
+        if llm_deadline is not None and llm_deadline.expired:
+            metrics.inc('deadline.expired')
+            logger.warning(f"[User:{user_id}] Request deadline exhausted while waiting for the AI API")
+            return self.timeout_text or None
+
         logger.warning(f"[User:{user_id}] Failed to get response from AI API")
-        return None
\ No newline at end of file
+        return None
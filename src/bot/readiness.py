@@ -0,0 +1,68 @@
+# src/bot/readiness.py
+"""
+就绪检查
+根据进行中的请求、排队数、上游延迟、熔断状态和连接池占用判断实例是否还能接收新请求
+"""
+import time
+from typing import Dict, Any, List, Tuple
+
+from .admission import AdmissionController
+from ..providers.circuit_breaker import CircuitBreaker, OPEN
+
+# 超过该时间（秒）没有新请求时不再使用延迟 EWMA，避免被摘除流量后因旧数据一直无法恢复
+_LATENCY_STALE_AFTER = 60
+
+
+class ReadinessProbe:
+    """
+    就绪检查
+
+    所有信号都直接读取实时计数器，检查开销与请求量无关；
+    任一信号超过阈值时返回未就绪（阈值为 0 表示不检查该项）。
+    熔断器半开时视为就绪，以便负载均衡放行探测请求。
+    """
+
+    def __init__(self, config: Dict[str, Any], admission: AdmissionController):
+        self.max_inflight = config.get('max_inflight', 0)
+        self.max_queue = config.get('max_queue', 0)
+        self.max_latency = config.get('max_latency', 0.0)
+        self.fail_on_open_circuit = config.get('fail_on_open_circuit', True)
+        self.fail_on_pool_exhausted = config.get('fail_on_pool_exhausted', True)
+        self.admission = admission
+
+    def check(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        计算当前就绪状态
+
+        Returns:
+            (是否就绪, 各项信号及未就绪原因)
+        """
+        reasons: List[str] = []
+        inflight = self.admission.inflight
+        queued = self.admission.queued
+        if self.max_inflight and inflight >= self.max_inflight:
+            reasons.append(f"inflight {inflight} >= {self.max_inflight}")
+        if self.max_queue and queued >= self.max_queue:
+            reasons.append(f"queued {queued} >= {self.max_queue}")
+
+        now = time.monotonic()
+        upstreams = []
+        for breaker in CircuitBreaker.instances():
+            stats = breaker.get_stats()
+            upstreams.append(stats)
+            latency = stats['latency_ewma']
+            if (self.max_latency and latency is not None and latency > self.max_latency
+                    and now - breaker.last_request_at < _LATENCY_STALE_AFTER):
+                reasons.append(f"{breaker.upstream} latency {latency:.2f}s > {self.max_latency}s")
+            if self.fail_on_open_circuit and stats['state'] == OPEN:
+                reasons.append(f"{breaker.upstream} circuit open")
+            if self.fail_on_pool_exhausted and breaker.pool_exhausted:
+                reasons.append(f"{breaker.upstream} connection pool exhausted "
+                               f"({stats['inflight']}/{stats['pool_size']})")
+
+        return not reasons, {
+            'inflight': inflight,
+            'queued': queued,
+            'upstreams': upstreams,
+            'reasons': reasons,
+        }
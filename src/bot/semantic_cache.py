@@ -0,0 +1,305 @@
+# src/bot/semantic_cache.py
+"""
+语义缓存
+对首轮提问按向量相似度匹配已回答过的问题（或预置的 FAQ），命中时直接返回答案，不调用 LLM
+"""
+import importlib
+import json
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Callable, FrozenSet, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时逐行计算相似度，仅适合较小的缓存
+    np = None
+
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+
+Embedding = Callable[[str], Sequence[float]]
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+')
+_CJK_PATTERN = re.compile(r'[^\x00-\x7f\s\W]')
+# 不计入关键词的常见英文虚词（同一问题的不同问法通常只在这些词上不同）
+_STOPWORDS = frozenset(
+    'a an and are at be by can could did do does for from get have how i in is it me my of on or our '
+    'please should the there this to was we what when where which who why will with would you your'.split()
+)
+
+
+def hashing_embedding(text: str, dim: int = 512) -> List[float]:
+    """
+    基于特征哈希的本地文本向量（不依赖模型，可离线使用）
+
+    特征为英文/数字单词、单词内的字符三元组，以及中日韩等非 ASCII 字符的单字和相邻二字组合；
+    每个特征用 crc32 哈希到 dim 维中的一维并带随机符号，结果做 L2 归一化。
+
+    Args:
+        text: 文本
+        dim: 向量维数
+
+    Returns:
+        长度为 dim 的向量（空文本时全为 0）
+    """
+    text = (text or '').lower()
+    features: List[str] = []
+    for word in _WORD_PATTERN.findall(text):
+        features.append(word)
+        padded = f"#{word}#"
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    chars = _CJK_PATTERN.findall(text)
+    features.extend(chars)
+    features.extend(a + b for a, b in zip(chars, chars[1:]))
+
+    vector = [0.0] * dim
+    for feature in features:
+        h = zlib.crc32(feature.encode('utf-8'))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else vector
+
+
+def keywords(text: str) -> FrozenSet[str]:
+    """
+    提取关键词：英文/数字单词（去掉常见虚词），以及中日韩字符的相邻二字组合（只有一个字时为单字）
+
+    "What is the VPN address?" 与 "What is the wifi address?" 的哈希向量相似度为 0.8，
+    比较关键词可以排除这类只差一个关键词的误命中。中日韩文本没有分词，二字组合必须完全相同，
+    因此 "写道歉邮件" 与 "写感谢邮件" 不会互相命中（同义改写也不会，需要自定义嵌入函数）。
+    """
+    text = (text or '').lower()
+    words = {word for word in _WORD_PATTERN.findall(text) if word not in _STOPWORDS}
+    chars = _CJK_PATTERN.findall(text)
+    words.update(a + b for a, b in zip(chars, chars[1:]))
+    if len(chars) == 1:
+        words.add(chars[0])
+    return frozenset(words)
+
+
+def load_embedding(spec: str, dim: int) -> Embedding:
+    """
+    解析嵌入函数配置
+
+    Args:
+        spec: "package.module:function"，函数接收文本返回向量；为空时使用 hashing_embedding
+        dim: 默认嵌入的向量维数
+
+    Raises:
+        ValueError: 配置格式错误或函数不存在时
+    """
+    if not spec:
+        return lambda text: hashing_embedding(text, dim)
+    module_name, _, func_name = spec.partition(':')
+    if not func_name:
+        raise ValueError(f"Invalid embedding function '{spec}', expected 'module:function'")
+    try:
+        return getattr(importlib.import_module(module_name), func_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Cannot load embedding function '{spec}': {str(e)}")
+
+
+def load_faq(path: str) -> List[Tuple[str, str]]:
+    """
+    读取 FAQ 文件
+
+    文件为数组或 {"faq": [...]}，每项 {"question": "..." 或 [...], "answer": "..."}，
+    question 为数组时每种问法都指向同一答案。
+
+    Returns:
+        (问题, 答案) 列表
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    items = data.get('faq', []) if isinstance(data, dict) else data
+    pairs: List[Tuple[str, str]] = []
+    for item in items:
+        questions = item.get('question') or item.get('questions') or []
+        if isinstance(questions, str):
+            questions = [questions]
+        answer = item.get('answer', '')
+        if answer:
+            pairs.extend((q, answer) for q in questions if q)
+    return pairs
+
+
+class SemanticCache:
+    """
+    语义缓存
+
+    - 所有问题的向量保存在一个 (容量, 维数) 的矩阵中，查询时一次矩阵向量乘法得到全部余弦相似度，
+      再取 top-k；未安装 numpy 时退化为逐行计算
+    - 相似度达到 threshold 且关键词完全相同（match_keywords）时命中；学到的答案由该机器人的
+      所有用户共享，误命中会把一个用户的答案发给其他用户
+    - 预置的 FAQ 常驻缓存；运行中学到的问答最多 capacity 条，超出时按 LRU 覆盖最久未命中的一条
+    """
+
+    def __init__(self, config: Dict[str, Any], name: str = 'default',
+                 embedding: Optional[Embedding] = None):
+        self.name = name
+        self.threshold = config.get('threshold', 0.8)
+        self.match_keywords = config.get('match_keywords', True)
+        self.capacity = max(0, config.get('capacity', 1000))
+        self._embed = lru_cache(maxsize=256)(
+            embedding or load_embedding(config.get('embedding', ''), config.get('dim', 512))
+        )
+
+        self._lock = threading.Lock()
+        self._questions: List[str] = []
+        self._answers: List[str] = []
+        self._keywords: List[FrozenSet[str]] = []
+        self._rows: List[List[float]] = []  # 未安装 numpy 时使用
+        self._matrix = None
+        # 学到的问答所在行，按最近命中排序（最久未命中的在前）
+        self._lru: 'OrderedDict[int, None]' = OrderedDict()
+
+        metrics.register_gauge(self._metric('entries'), lambda: len(self._questions))
+        metrics.register_gauge(self._metric('hit_ratio'), self.hit_ratio)
+        metrics.register_gauge(self._metric('avg_lookup_ms'), self.avg_lookup_ms)
+
+        faq = load_faq(config['faq_file']) if config.get('faq_file') else []
+        self._seed(faq)
+        logger.info(f"Semantic cache enabled for {name} (threshold={self.threshold}, "
+                    f"match_keywords={self.match_keywords}, "
+                    f"capacity={self.capacity}, faq={len(faq)}, "
+                    f"backend={'numpy' if np is not None else 'python'})")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], name: str = 'default') -> Optional['SemanticCache']:
+        """SEMANTIC_CACHE 中启用时创建缓存"""
+        return cls(config, name) if config.get('enabled') else None
+
+    def _vector(self, text: str) -> List[float]:
+        """计算归一化向量"""
+        vector = [float(v) for v in self._embed(text.strip())]
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def _seed(self, faq: List[Tuple[str, str]]) -> None:
+        """写入预置 FAQ 并分配向量矩阵"""
+        vectors = [self._vector(question) for question, _ in faq]
+        # 自定义嵌入函数的维数由一次试算得到
+        dim = len(vectors[0]) if vectors else len(self._vector('probe'))
+        if np is not None:
+            self._matrix = np.zeros((len(faq) + self.capacity, dim), dtype=np.float32)
+        for (question, answer), vector in zip(faq, vectors):
+            self._set_row(len(self._questions), question, answer, vector)
+
+    def _set_row(self, row: int, question: str, answer: str, vector: List[float]) -> None:
+        if row == len(self._questions):
+            self._questions.append(question)
+            self._answers.append(answer)
+            self._keywords.append(keywords(question))
+            if np is None:
+                self._rows.append(vector)
+        else:
+            self._questions[row] = question
+            self._answers[row] = answer
+            self._keywords[row] = keywords(question)
+            if np is None:
+                self._rows[row] = vector
+        if np is not None:
+            self._matrix[row] = vector
+
+    def _scores(self, vector: List[float], k: int) -> List[Tuple[float, int]]:
+        """返回相似度最高的 k 行 (相似度, 行号)，按相似度降序（调用方持有锁）"""
+        size = len(self._questions)
+        if not size:
+            return []
+        k = min(k, size)
+        if np is not None:
+            scores = self._matrix[:size] @ np.asarray(vector, dtype=np.float32)
+            top = np.argpartition(-scores, k - 1)[:k] if k < size else np.arange(size)
+            return sorted(((float(scores[i]), int(i)) for i in top), reverse=True)
+        scored = [(sum(a * b for a, b in zip(row, vector)), i) for i, row in enumerate(self._rows)]
+        return sorted(scored, reverse=True)[:k]
+
+    def _match(self, question: str, vector: List[float]) -> Optional[Tuple[float, int]]:
+        """返回命中的 (相似度, 行号)，没有达到阈值且关键词相同的问题时返回 None（调用方持有锁）"""
+        words = keywords(question) if self.match_keywords else None
+        for score, row in self._scores(vector, 3):
+            if score < self.threshold:
+                break
+            if words is None or self._keywords[row] == words:
+                return score, row
+        return None
+
+    def search(self, question: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        查找最相似的 k 个已缓存问题
+
+        Returns:
+            [{'score', 'question', 'answer'}]，按相似度降序
+        """
+        vector = self._vector(question)
+        with self._lock:
+            return [{'score': round(score, 4), 'question': self._questions[i], 'answer': self._answers[i]}
+                    for score, i in self._scores(vector, k)]
+
+    def lookup(self, question: str) -> Optional[str]:
+        """
+        查找相似问题的答案
+
+        Returns:
+            命中时返回缓存的答案，否则返回 None
+        """
+        start = time.perf_counter()
+        vector = self._vector(question)
+        with self._lock:
+            best = self._match(question, vector)
+            hit = best is not None
+            if hit:
+                row = best[1]
+                answer = self._answers[row]
+                if row in self._lru:
+                    self._lru.move_to_end(row)
+        elapsed = time.perf_counter() - start
+
+        metrics.inc(self._metric('lookups'))
+        metrics.inc(self._metric('lookup_seconds'), elapsed)
+        if not hit:
+            metrics.inc(self._metric('misses'))
+            return None
+        metrics.inc(self._metric('hits'))
+        logger.info(f"Semantic cache hit (score={best[0]:.3f}, {elapsed * 1000:.2f}ms): "
+                    f"{question[:50]}{'...' if len(question) > 50 else ''}")
+        return answer
+
+    def add(self, question: str, answer: str) -> bool:
+        """
+        缓存一条问答；已有足够相似的问题时不重复缓存
+
+        Returns:
+            是否写入
+        """
+        if not self.capacity or not question.strip() or not answer:
+            return False
+        vector = self._vector(question)
+        with self._lock:
+            if self._match(question, vector) is not None:
+                return False
+            if len(self._lru) < self.capacity:
+                row = len(self._questions)
+            else:
+                row, _ = self._lru.popitem(last=False)
+                metrics.inc(self._metric('evicted'))
+            self._set_row(row, question, answer, vector)
+            self._lru[row] = None
+        metrics.inc(self._metric('stored'))
+        return True
+
+    def _metric(self, key: str) -> str:
+        return f"bots.{self.name}.semantic_cache.{key}"
+
+    def hit_ratio(self) -> Optional[float]:
+        lookups = metrics.get(self._metric('lookups'))
+        return round(metrics.get(self._metric('hits')) / lookups, 4) if lookups else None
+
+    def avg_lookup_ms(self) -> Optional[float]:
+        lookups = metrics.get(self._metric('lookups'))
+        return round(metrics.get(self._metric('lookup_seconds')) * 1000 / lookups, 3) if lookups else None
@@ -0,0 +1,129 @@
+# src/bot/startup.py
+"""
+启动检查 / Startup checks
+WSGI（app.py）与 ASGI（asgi.py）入口共用的机器人配置加载、配置校验与 API 连通性检测
+"""
+import sys
+from typing import Any, Dict, List
+
+from config.settings import (
+    CHAT_API, SYNOLOGY, CONVERSATION, HTTP, API_TEST, USAGE, BOTS, SEMANTIC_CACHE,
+    CIRCUIT_BREAKER, DEADLINE, COMMANDS, SPOOL
+)
+from ..utils.api_tester import APITester
+from .bot_registry import load_bot_configs
+
+
+def build_bot_configs() -> List[Dict[str, Any]]:
+    """构建每个机器人的配置（未配置 BOTS_CONFIG_FILE 时只有一个机器人）/ Build per-bot configurations"""
+    config = {
+        'CHAT_API': CHAT_API,
+        'SYNOLOGY': SYNOLOGY,
+        'CONVERSATION': CONVERSATION,
+        'HTTP': HTTP,
+        'API_TEST': API_TEST,
+        'USAGE': USAGE,
+        'SEMANTIC_CACHE': SEMANTIC_CACHE,
+        'CIRCUIT_BREAKER': CIRCUIT_BREAKER,
+        'DEADLINE': DEADLINE,
+        'COMMANDS': COMMANDS,
+        'SPOOL': SPOOL
+    }
+    if BOTS['config_file']:
+        return load_bot_configs(BOTS['config_file'], config)
+    return [dict(config, BOT={'name': 'default'})]
+
+
+def validate_startup_requirements(bot_configs: List[Dict[str, Any]]) -> bool:
+    """验证启动所需的配置 / Validate startup requirements"""
+    print("🔍 Validating startup configuration...")
+
+    missing_configs = []
+    for bot_config in bot_configs:
+        chat_api = bot_config['CHAT_API']
+        synology = bot_config['SYNOLOGY']
+        api_type = chat_api['type'].lower()
+        # 多机器人模式下缺失项带上机器人名称 / Prefix missing keys with the bot name in multi-bot mode
+        prefix = f"[{bot_config['BOT']['name']}] " if BOTS['config_file'] else ''
+        print(f"   {prefix}API Type: {api_type}")
+
+        # 基础必须配置 / Base required configurations
+        required_configs = {
+            'CHAT_API_URL': chat_api['url'],
+            'CHAT_API_KEY': chat_api['api_key'],
+            'SYNOLOGY_INCOMING_WEBHOOK_URL': synology['incoming_webhook_url'],
+            'SYNOLOGY_OUTGOING_WEBHOOK_TOKEN': synology['outgoing_webhook_token'],
+        }
+
+        # CHAT_API_MODEL 仅在 OpenAI 类型时必需，Dify 在平台侧配置模型
+        # CHAT_API_MODEL is only required for OpenAI type, Dify configures model on platform side
+        if api_type == 'openai':
+            required_configs['CHAT_API_MODEL'] = chat_api['model']
+
+        for key, value in required_configs.items():
+            if not value or value == '' or 'your_' in value.lower():
+                missing_configs.append(f"{prefix}{key}")
+
+    if missing_configs:
+        print("❌ Missing required configurations:")
+        for config in missing_configs:
+            print(f"   - {config}")
+        return False
+
+    print("✅ Configuration validation passed")
+    return True
+
+
+def test_api_connectivity(bot_configs: List[Dict[str, Any]]) -> bool:
+    """测试API连接性（相同的上游只测试一次）/ Test API connectivity (once per distinct upstream)"""
+    print("🧪 Testing LLM API connectivity...")
+
+    tested = set()
+    for bot_config in bot_configs:
+        chat_api = bot_config['CHAT_API']
+        upstream = (chat_api['type'], chat_api['url'], chat_api['api_key'], chat_api['model'])
+        if upstream in tested:
+            continue
+        tested.add(upstream)
+
+        tester = APITester(bot_config)
+        result = tester.test_chat_api()
+
+        if not result['success']:
+            print("❌ API test failed:")
+            print(f"   Error: {result['error']}")
+            if 'details' in result:
+                print(f"   Details: {result['details']}")
+            return False
+
+    print("✅ API test passed")
+    return True
+
+
+def run_startup_checks() -> List[Dict[str, Any]]:
+    """加载配置并执行启动检查，任一检查失败时退出进程 / Load bot configs and run startup checks, exit on failure"""
+    # 加载机器人配置 / Load bot configurations
+    try:
+        bot_configs = build_bot_configs()
+    except (OSError, ValueError) as e:
+        print(f"❌ Failed to load BOTS_CONFIG_FILE: {str(e)}")
+        sys.exit(1)
+
+    # 验证启动要求 / Validate startup requirements
+    if not validate_startup_requirements(bot_configs):
+        print("❌ Startup configuration validation failed")
+        sys.exit(1)
+
+    # 测试API连接 / Test API connection
+    if not test_api_connectivity(bot_configs):
+        print("❌ API connectivity test failed")
+        print("💡 Please check:")
+        print("   1. CHAT_API_URL is correct")
+        print("   2. CHAT_API_KEY is valid")
+        if CHAT_API['type'].lower() == 'openai':
+            print("   3. CHAT_API_MODEL is correct")
+        print("   4. Network connection is working")
+        sys.exit(1)
+
+
+    return bot_configs
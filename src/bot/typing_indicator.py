@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import threading
+from typing import Awaitable, Callable, Optional
+from ..utils.logger import logger
+
+
+class TypingIndicator:
+    """
+    与 LLM 请求并行发送的输入提示
+
+    提示在后台线程中发送，不占用请求的关键路径：
+    - 回复在 delay 秒内返回时不发送提示，用户只收到一条消息
+    - 回复较慢时发送提示，之后每隔 repeat_interval 秒发送一次进度提示（0 表示不重复）
+    """
+
+    def __init__(self, user_id: str, send: Callable[[str], bool], text: str,
+                 delay: float = 0.0, repeat_text: str = '', repeat_interval: float = 0.0):
+        self.user_id = user_id
+        self.send = send
+        self.text = text
+        self.delay = max(0.0, delay)
+        self.repeat_text = repeat_text or text
+        self.repeat_interval = repeat_interval
+        self.sent = 0
+        self._done = threading.Event()
+        # 保证提示不会晚于回复发出
+        self._send_lock = threading.Lock()
+
+    def start(self) -> 'TypingIndicator':
+        """启动后台发送线程（提示文本为空时不启动），线程继承当前请求的截止时间"""
+        if self.text:
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._run,),
+                name=f"typing-{self.user_id}",
+                daemon=True
+            ).start()
+        return self
+
+    def stop(self) -> None:
+        """回复已就绪，取消尚未发送的提示并等待正在发送的提示完成"""
+        self._done.set()
+        with self._send_lock:
+            pass
+        if self.sent == 0 and self.text:
+            logger.debug(f"[User:{self.user_id}] Typing indicator suppressed (reply within {self.delay}s)")
+
+    def _run(self) -> None:
+        if self._done.wait(self.delay):
+            return
+        self._send(self.text)
+        if self.repeat_interval <= 0:
+            return
+        while not self._done.wait(self.repeat_interval):
+            self._send(self.repeat_text)
+
+    def _send(self, text: str) -> None:
+        with self._send_lock:
+            if self._done.is_set():
+                return
+            logger.debug(f"[User:{self.user_id}] Sending typing indicator")
+            self.sent += 1
+            self.send(text)
+
+
+class AsyncTypingIndicator(TypingIndicator):
+    """
+    TypingIndicator 的异步版本（ASGI 模式使用）
+
+    提示在与 LLM 请求并行的 asyncio 任务中发送，send 为返回协程的函数。
+    """
+
+    def __init__(self, user_id: str, send: Callable[[str], Awaitable[bool]], text: str,
+                 delay: float = 0.0, repeat_text: str = '', repeat_interval: float = 0.0):
+        super().__init__(user_id, send, text, delay, repeat_text, repeat_interval)
+        self._done = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> 'AsyncTypingIndicator':
+        """启动发送任务（提示文本为空时不启动），任务继承当前请求的截止时间"""
+        if self.text:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        """回复已就绪，取消尚未发送的提示并等待正在发送的提示完成"""
+        self._done.set()
+        async with self._send_lock:
+            pass
+        if self._task is not None:
+            self._task.cancel()
+        if self.sent == 0 and self.text:
+            logger.debug(f"[User:{self.user_id}] Typing indicator suppressed (reply within {self.delay}s)")
+
+    async def _wait(self, timeout: float) -> bool:
+        """等待 stop()，返回是否已停止"""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _run(self) -> None:
+        if await self._wait(self.delay):
+            return
+        await self._send(self.text)
+        if self.repeat_interval <= 0:
+            return
+        while not await self._wait(self.repeat_interval):
+            await self._send(self.repeat_text)
+
+    async def _send(self, text: str) -> None:
+        async with self._send_lock:
+            if self._done.is_set():
+                return
+            logger.debug(f"[User:{self.user_id}] Sending typing indicator")
+            self.sent += 1
+            await self.send(text)
@@ -1,20 +1,62 @@
+import sys
+import threading
 from time import time
-from typing import List, Dict, Optional
+from typing import List, Dict, Any, Callable, Optional
+
+# 每条消息除内容外的大致内存开销（dict 及其键值）
+_MESSAGE_OVERHEAD = 240
+
+
+def message_size(content: str) -> int:
+    """估算一条消息占用的内存字节数"""
+    return sys.getsizeof(content) + _MESSAGE_OVERHEAD
+
 
 class Conversation:
-    def __init__(self, user_id: str, max_history: int = 10, timeout: int = 1800):
+    def __init__(self, user_id: str, max_history: int = 10, timeout: int = 1800, trim_block: int = 1):
         self.user_id = user_id
         self.max_history = max_history
         self.timeout = timeout
+        # 超出 max_history 时一次移除的消息数：按块滑动窗口，使上下文前缀在多轮对话间保持不变，
+        # 便于上游（OpenAI、vLLM 等）复用 prompt 前缀缓存
+        self.trim_block = max(1, min(trim_block, max_history))
         self.messages: List[Dict[str, str]] = []
         self.last_activity = time()
+        self._system_message: Optional[Dict[str, str]] = None
+        # 用户通过 /model 命令选择的模型，为空时按配置（含模型路由）选择
+        self.model: Optional[str] = None
+        # 变更序号与日志回调（由 ConversationStore 设置），用于持久化和重启后恢复
+        self.seq = 0
+        self.journal: Optional[Callable[[Dict[str, Any]], None]] = None
+        # 历史占用的估算字节数（随消息增删增量维护），变化时通知 on_resize(delta)
+        self.approx_bytes = 0
+        self.on_resize: Optional[Callable[[int], None]] = None
+        self._lock = threading.Lock()
 
     def add_message(self, role: str, content: str) -> None:
         """添加新消息到历史记录"""
-        self.messages.append({"role": role, "content": content})
-        if len(self.messages) > self.max_history:
-            self.messages.pop(0)
-        self.last_activity = time()
+        with self._lock:
+            self.messages.append({"role": role, "content": content})
+            delta = message_size(content)
+            if len(self.messages) > self.max_history:
+                delta -= self._trim()
+            self.last_activity = time()
+            self._record('add', r=role, c=content)
+            self._resize(delta)
+
+    def _trim(self) -> int:
+        """按块移除最早的消息，并保证历史以用户消息开头；返回释放的估算字节数"""
+        drop = max(len(self.messages) - self.max_history, self.trim_block)
+        while drop < len(self.messages) - 1 and self.messages[drop].get('role') != 'user':
+            drop += 1
+        freed = sum(message_size(msg.get('content', '')) for msg in self.messages[:drop])
+        del self.messages[:drop]
+        return freed
+
+    def _resize(self, delta: int) -> None:
+        self.approx_bytes += delta
+        if self.on_resize and delta:
+            self.on_resize(delta)
 
     def get_messages(self) -> List[Dict[str, str]]:
         """获取所有消息历史"""
@@ -22,15 +64,65 @@ class Conversation:
 
     def clear_history(self) -> None:
         """清空历史记录"""
-        self.messages = []
-        self.last_activity = time()
+        with self._lock:
+            self.messages = []
+            self.last_activity = time()
+            self._record('clear')
+            self._resize(-self.approx_bytes)
+
+    def set_model(self, model: Optional[str]) -> None:
+        """设置用户选择的模型（None 表示按配置选择），随会话一起持久化"""
+        with self._lock:
+            self.model = model
+            self._record('model', m=model)
+
+    def _record(self, op: str, **fields: Any) -> None:
+        """递增变更序号并写入日志（调用方持有 _lock）"""
+        self.seq += 1
+        if self.journal:
+            self.journal({'u': self.user_id, 's': self.seq, 't': self.last_activity, 'op': op, **fields})
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出会话状态（序号与历史保持一致）"""
+        with self._lock:
+            return {'user_id': self.user_id, 'seq': self.seq, 'last_activity': self.last_activity,
+                    'model': self.model, 'messages': list(self.messages)}
+
+    def restore(self, messages: List[Dict[str, str]], seq: int, last_activity: float,
+                model: Optional[str] = None) -> None:
+        """从快照恢复历史与所选模型（不写入日志）"""
+        with self._lock:
+            self.messages = list(messages)[-self.max_history:]
+            self.seq = seq
+            self.last_activity = last_activity
+            self.model = model
+            self._resize(sum(message_size(msg.get('content', '')) for msg in self.messages) - self.approx_bytes)
+
+    def apply(self, entry: Dict[str, Any]) -> None:
+        """重放一条日志记录（不再写入日志），序号不大于当前序号的记录会被忽略"""
+        if entry.get('s', 0) <= self.seq:
+            return
+        journal, self.journal = self.journal, None
+        try:
+            if entry.get('op') == 'add':
+                self.add_message(entry.get('r', 'user'), entry.get('c', ''))
+            elif entry.get('op') == 'clear':
+                self.clear_history()
+            elif entry.get('op') == 'model':
+                self.set_model(entry.get('m'))
+        finally:
+            self.journal = journal
+        self.seq = entry['s']
+        self.last_activity = entry.get('t', self.last_activity)
 
     def is_expired(self) -> bool:
         """检查会话是否过期"""
         return (time() - self.last_activity) > self.timeout
 
     def get_context(self, system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
-        """获取完整的对话上下文，包括系统提示"""
+        """获取完整的对话上下文，包括系统提示（系统消息与历史构成稳定的前缀）"""
         if system_prompt:
-            return [{"role": "system", "content": system_prompt}] + self.messages
-        return self.messages.copy()
\ No newline at end of file
+            if self._system_message is None or self._system_message['content'] != system_prompt:
+                self._system_message = {"role": "system", "content": system_prompt}
+            return [self._system_message] + self.messages
+        return self.messages.copy()
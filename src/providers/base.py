@@ -3,13 +3,27 @@
 Chat Provider 抽象基类
 定义所有 Chat API Provider 必须实现的接口
 """
+import asyncio
+import contextvars
+import time
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
 
+import requests
+
+from .circuit_breaker import CircuitBreaker
+from ..utils.async_http import get_async_client
+from ..utils.http_client import error_kind, warm_connection
+from ..utils.logger import logger, log_error
+from ..utils.retry import RetryPolicy
+
 
 class ChatProvider(ABC):
     """Chat API Provider 抽象基类"""
 
+    # 是否保存按用户区分的会话状态（如 Dify 的 conversation_id）；为 True 时每个机器人使用独立的实例
+    stateful: bool = False
+
     def __init__(self, config: Dict[str, Any]):
         """
         初始化 Provider
@@ -20,6 +34,14 @@ class ChatProvider(ABC):
         self.config = config
         self.chat_config = config.get('CHAT_API', {})
         self.http_config = config.get('HTTP', {})
+        # 当前线程（或协程任务）最近一次请求的用量（模型、token 数等）
+        self._usage: contextvars.ContextVar = contextvars.ContextVar(f"{self.provider_name}.usage", default={})
+        # POST 重试策略（只重试连接失败和 429/502/503，并受整体截止时间限制）
+        self.retry_policy = RetryPolicy.from_config(self.chat_config.get('type', 'llm').lower(), self.http_config)
+        # 同一上游的 Provider 共用熔断器（失败、延迟与并发统计）
+        self.breaker = CircuitBreaker.get(
+            self.get_api_url(), config.get('CIRCUIT_BREAKER', {}), self.http_config.get('pool_size', 10)
+        )
 
     @abstractmethod
     def send_message(
@@ -41,6 +63,24 @@ class ChatProvider(ABC):
         """
         pass
 
+    async def send_message_async(
+        self,
+        user_id: str,
+        message: str,
+        context: Optional[Any] = None
+    ) -> Optional[str]:
+        """
+        send_message 的异步版本（ASGI 模式使用）
+
+        默认在线程池中调用 send_message，子类可基于 httpx 提供原生实现。
+        """
+        def call():
+            return self.send_message(user_id, message, context), self.last_usage()
+
+        response, usage = await asyncio.to_thread(call)
+        self._set_usage(usage)
+        return response
+
     @abstractmethod
     def test_connection(self) -> Dict[str, Any]:
         """
@@ -56,6 +96,126 @@ class ChatProvider(ABC):
         """
         pass
 
+    async def test_connection_async(self) -> Dict[str, Any]:
+        """test_connection 的异步版本，默认在线程池中调用 test_connection"""
+        return await asyncio.to_thread(self.test_connection)
+
+    def last_usage(self) -> Dict[str, Any]:
+        """
+        返回当前线程（或协程任务）最近一次 send_message 的用量
+
+        Returns:
+            包含 model、prompt_tokens、completion_tokens、total_tokens 等字段的字典，
+            请求失败或上游未返回用量时为空字典
+        """
+        return self._usage.get()
+
+    def _set_usage(self, usage: Dict[str, Any]) -> None:
+        self._usage.set(usage)
+
+    def _post_upstream(self, url: str, **kwargs) -> requests.Response:
+        """
+        通过熔断器和重试策略向上游发送 POST 请求，重试后仍为超时、连接错误、429 或 5xx 时计为失败
+
+        Raises:
+            CircuitOpenError: 熔断器打开时（请求未发送）
+            requests.exceptions.RequestException: 请求失败时
+        """
+        with self.breaker.track():
+            try:
+                response = self.retry_policy.post(self.session, url, **kwargs)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+        self._record_status(response.status_code)
+        return response
+
+    async def _post_upstream_async(self, url: str, **kwargs) -> 'httpx.Response':
+        """
+        _post_upstream 的异步版本，使用当前事件循环中共享的 httpx.AsyncClient
+
+        Raises:
+            CircuitOpenError: 熔断器打开时（请求未发送）
+            httpx.HTTPError: 请求失败时
+        """
+        client = get_async_client(url, self.http_config.get('pool_size', 10))
+        with self.breaker.track():
+            try:
+                response = await self.retry_policy.post_async(client, url, **kwargs)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+        self._record_status(response.status_code)
+        return response
+
+    def _record_status(self, status_code: int) -> None:
+        """429 和 5xx 计为熔断器失败"""
+        if status_code == 429 or status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _log_request_error(self, error: Exception, start_time: float, endpoint: str,
+                           server: str, timeout_suggestion: str, connection_suggestion: str) -> None:
+        """
+        记录一次失败的请求（requests 与 httpx 的异常）
+
+        Args:
+            error: 捕获的异常
+            start_time: 请求开始时间（time.time()）
+            endpoint: 请求地址
+            server: 日志中的上游名称（如 "API server"）
+            timeout_suggestion: 超时时的建议
+            connection_suggestion: 无法连接时的建议
+        """
+        kind = error_kind(error)
+        if kind == 'timeout':
+            log_error("Timeout", f"Request timeout after {time.time() - start_time:.1f}s",
+                      suggestion=timeout_suggestion)
+        elif kind == 'connection':
+            log_error("Connection", f"Cannot connect to {server}: {endpoint}",
+                      details=str(error), suggestion=connection_suggestion)
+        elif kind == 'http':
+            response = error.response
+            status_code = response.status_code if response is not None else 'Unknown'
+            try:
+                error_body = response.json()
+            except Exception:
+                error_body = response.text if response is not None else str(error)
+            log_error("HTTP", f"Status {status_code}: {error_body}",
+                      suggestion=self._get_http_error_suggestion(status_code))
+        else:
+            log_error("Unexpected", str(error))
+
+    def _get_http_error_suggestion(self, status_code: int) -> str:
+        """根据 HTTP 状态码返回建议"""
+        return "Check API configuration"
+
+    def warmup(self) -> bool:
+        """
+        预热到上游 API 的连接，使首个真实请求无需再建立 TCP/TLS 连接
+
+        Returns:
+            是否成功建立连接
+        """
+        session = getattr(self, 'session', None)
+        url = self.get_api_url()
+        if session is None or not url:
+            return False
+        try:
+            warm_connection(session, url, timeout=min(self.get_timeout(), 5))
+            logger.debug(f"{self.provider_name} connection warmed up: {url}")
+            return True
+        except Exception as e:
+            logger.debug(f"{self.provider_name} warmup failed: {str(e)}")
+            return False
+
+    def close(self) -> None:
+        """释放 Provider 持有的连接"""
+        session = getattr(self, 'session', None)
+        if session is not None:
+            session.close()
+
     @property
     def provider_name(self) -> str:
         """返回 Provider 名称"""
@@ -0,0 +1,162 @@
+# src/providers/circuit_breaker.py
+"""
+熔断器
+按上游地址统计 LLM 请求的失败、延迟与并发，连续失败时暂停请求，避免 worker 阻塞在不可用的上游上
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求未发送"""
+
+
+class CircuitBreaker:
+    """
+    上游熔断器
+
+    - 连续 failure_threshold 次失败（超时、连接错误、429、5xx）后打开，期间请求直接失败
+    - 打开 reset_timeout 秒后进入半开状态，只放行一个探测请求：成功则关闭，失败则重新打开
+    - 同时维护进行中的请求数与延迟 EWMA，供 /ready 判断是否饱和
+    failure_threshold 为 0 表示只统计、不熔断。
+    """
+
+    _instances: Dict[str, 'CircuitBreaker'] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, upstream: str, config: Dict[str, Any], pool_size: int = 10):
+        self.upstream = upstream
+        self.failure_threshold = config.get('failure_threshold', 0)
+        self.reset_timeout = config.get('reset_timeout', 30.0)
+        self.pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.inflight = 0
+        self.latency_ewma: Optional[float] = None
+        self.last_request_at = 0.0
+        metrics.register_gauge('circuit.open', CircuitBreaker.open_count)
+
+    @classmethod
+    def get(cls, url: str, config: Dict[str, Any], pool_size: int = 10) -> 'CircuitBreaker':
+        """
+        获取上游共享的熔断器（以 scheme://host:port 为键）
+
+        Args:
+            url: 上游请求地址
+            config: CIRCUIT_BREAKER 配置
+            pool_size: 访问该上游的连接池大小
+        """
+        parts = urlsplit(url)
+        upstream = f"{parts.scheme}://{parts.netloc}"
+        with cls._registry_lock:
+            breaker = cls._instances.get(upstream)
+            if breaker is None:
+                breaker = cls(upstream, config, pool_size)
+                cls._instances[upstream] = breaker
+            else:
+                breaker.pool_size = max(breaker.pool_size, pool_size)
+            return breaker
+
+    @classmethod
+    def instances(cls) -> List['CircuitBreaker']:
+        with cls._registry_lock:
+            return list(cls._instances.values())
+
+    @classmethod
+    def open_count(cls) -> int:
+        """未处于关闭状态的上游数"""
+        return sum(1 for breaker in cls.instances() if breaker.state != CLOSED)
+
+    @property
+    def state(self) -> str:
+        """当前状态（打开超过 reset_timeout 后视为半开）"""
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def pool_exhausted(self) -> bool:
+        """进行中的请求已占满连接池"""
+        return self.inflight >= self.pool_size
+
+    def allow(self) -> bool:
+        """是否允许发送请求（半开状态下只放行一个探测请求）"""
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._state = HALF_OPEN
+                self._probing = True
+                logger.info(f"Circuit half-open for {self.upstream}, sending probe request")
+                return True
+        metrics.inc('circuit.rejected')
+        return False
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """
+        统计一次请求的并发数与延迟
+
+        Raises:
+            CircuitOpenError: 熔断器打开时
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit open for {self.upstream}, retry in "
+                                   f"{max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)):.0f}s")
+        with self._lock:
+            self.inflight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.inflight -= 1
+                self.last_request_at = time.monotonic()
+                self.latency_ewma = elapsed if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * elapsed
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != CLOSED:
+                self._state = CLOSED
+                logger.info(f"✅ Circuit closed for {self.upstream}")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            probe_failed = self._state == HALF_OPEN
+            self._probing = False
+            if not self.failure_threshold:
+                return
+            if probe_failed or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                metrics.inc('circuit.opened')
+                logger.warning(f"⚠️  Circuit opened for {self.upstream} after {self._failures} "
+                               f"consecutive failure(s), pausing for {self.reset_timeout:.0f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'upstream': self.upstream,
+            'state': self.state,
+            'inflight': self.inflight,
+            'pool_size': self.pool_size,
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+        }
@@ -5,17 +5,22 @@ Dify API Provider
 """
 import time
 import requests
-from typing import Dict, Any, Optional
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from typing import Dict, Any, Optional, Tuple
 
 from .base import ChatProvider
+from .circuit_breaker import CircuitOpenError
+from ..utils.async_http import get_async_client
+from ..utils.http_client import error_kind, get_shared_session
 from ..utils.logger import logger, log_request, log_response, log_error
+from ..utils.usage_ledger import usage_ledger
 
 
 class DifyProvider(ChatProvider):
     """Dify API Provider"""
 
+    # conversation_id 按用户保存，不能在机器人之间共享
+    stateful = True
+
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         self._init_session()
@@ -25,17 +30,10 @@ class DifyProvider(ChatProvider):
 
     def _init_session(self) -> None:
         """初始化 HTTP Session 并配置重试策略"""
-        self.session = requests.Session()
         max_retries = self.http_config.get('max_retries', 3)
-        retry_strategy = Retry(
-            total=max_retries,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
-        logger.debug(f"HTTP session initialized with max_retries={max_retries}")
+        pool_size = self.http_config.get('pool_size', 10)
+        self.session = get_shared_session(self.get_api_url(), max_retries, pool_size)
+        logger.debug(f"HTTP session initialized with max_retries={max_retries}, pool_size={pool_size}")
 
     def _get_chat_endpoint(self) -> str:
         """
@@ -83,6 +81,56 @@ class DifyProvider(ChatProvider):
         }
         return suggestions.get(status_code, "Check Dify API configuration")
 
+    def _prepare_request(self, user_id: str, message: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """构建请求头与请求体（带上用户已有的 conversation_id）"""
+        headers = {
+            "Authorization": f"Bearer {self.get_api_key()}",
+            "Content-Type": "application/json"
+        }
+
+        # 构建 Dify API 请求体
+        json_data: Dict[str, Any] = {
+            "inputs": {},
+            "query": message,
+            "response_mode": "blocking",
+            "user": user_id
+        }
+
+        # 如果有现有会话，添加 conversation_id
+        conversation_id = self._get_conversation_id(user_id)
+        if conversation_id:
+            json_data["conversation_id"] = conversation_id
+            logger.debug(f"[User:{user_id}] Continuing conversation: {conversation_id[:8]}...")
+        else:
+            logger.debug(f"[User:{user_id}] Starting new conversation")
+        return headers, json_data
+
+    def _parse_response(self, user_id: str, result: Dict[str, Any], response_time: float) -> str:
+        """解析响应，保存 conversation_id 并记录 token 用量"""
+        # 保存返回的 conversation_id，用于后续对话
+        if 'conversation_id' in result:
+            self._set_conversation_id(user_id, result['conversation_id'])
+
+        ai_response = result.get('answer', '')
+        logger.info(f"[User:{user_id}] Response received in {response_time:.2f}s "
+                   f"(message_id: {result.get('message_id', 'N/A')[:8]}...)")
+
+        # 记录 token 用量（Dify 在 metadata.usage 中返回用量和费用）
+        usage = result.get('metadata', {}).get('usage')
+        if usage:
+            total_price = usage.get('total_price')
+            self._set_usage({**usage, 'model': 'dify'})
+            usage_ledger.record(
+                user_id,
+                'dify',
+                usage.get('prompt_tokens', 0),
+                usage.get('completion_tokens', 0),
+                usage.get('total_tokens', 0),
+                cost=float(total_price) if total_price is not None else None
+            )
+
+        return ai_response
+
     def send_message(
         self,
         user_id: str,
@@ -102,33 +150,14 @@ class DifyProvider(ChatProvider):
         """
         logger.info(f"[User:{user_id}] Sending message to Dify API...")
         start_time = time.time()
+        self._set_usage({})
 
         try:
-            headers = {
-                "Authorization": f"Bearer {self.get_api_key()}",
-                "Content-Type": "application/json"
-            }
-
-            # 构建 Dify API 请求体
-            json_data: Dict[str, Any] = {
-                "inputs": {},
-                "query": message,
-                "response_mode": "blocking",
-                "user": user_id
-            }
-
-            # 如果有现有会话，添加 conversation_id
-            conversation_id = self._get_conversation_id(user_id)
-            if conversation_id:
-                json_data["conversation_id"] = conversation_id
-                logger.debug(f"[User:{user_id}] Continuing conversation: {conversation_id[:8]}...")
-            else:
-                logger.debug(f"[User:{user_id}] Starting new conversation")
-
+            headers, json_data = self._prepare_request(user_id, message)
             endpoint = self._get_chat_endpoint()
             log_request("POST", endpoint, headers=headers)
 
-            response = self.session.post(
+            response = self._post_upstream(
                 endpoint,
                 headers=headers,
                 json=json_data,
@@ -139,54 +168,68 @@ class DifyProvider(ChatProvider):
             log_response(response.status_code, response_time)
 
             response.raise_for_status()
+            return self._parse_response(user_id, response.json(), response_time)
 
-            result = response.json()
+        except CircuitOpenError as e:
+            logger.warning(f"[User:{user_id}] {str(e)}")
+            return None
+        except (KeyError, ValueError) as e:
+            log_error("Parse", f"Failed to parse Dify response: {str(e)}",
+                     suggestion="Dify response format may be invalid")
+            return None
+        except Exception as e:
+            self._log_error(e, start_time)
+            return None
+
+    async def send_message_async(
+        self,
+        user_id: str,
+        message: str,
+        context: Optional[Any] = None
+    ) -> Optional[str]:
+        """send_message 的异步版本（httpx），等待上游期间不占用线程"""
+        logger.info(f"[User:{user_id}] Sending message to Dify API...")
+        start_time = time.time()
+        self._set_usage({})
 
-            # 保存返回的 conversation_id，用于后续对话
-            if 'conversation_id' in result:
-                self._set_conversation_id(user_id, result['conversation_id'])
+        try:
+            headers, json_data = self._prepare_request(user_id, message)
+            endpoint = self._get_chat_endpoint()
+            log_request("POST", endpoint, headers=headers)
 
-            ai_response = result.get('answer', '')
-            logger.info(f"[User:{user_id}] Response received in {response_time:.2f}s "
-                       f"(message_id: {result.get('message_id', 'N/A')[:8]}...)")
+            response = await self._post_upstream_async(
+                endpoint,
+                headers=headers,
+                json=json_data,
+                timeout=self.get_timeout()
+            )
 
-            return ai_response
+            response_time = time.time() - start_time
+            log_response(response.status_code, response_time)
 
-        except requests.exceptions.Timeout:
-            log_error("Timeout", f"Request timeout after {self.get_timeout()}s",
-                     suggestion="Increase HTTP_TIMEOUT or check Dify server performance")
-            return None
-        except requests.exceptions.ConnectionError as e:
-            log_error("Connection", f"Cannot connect to Dify server: {self._get_chat_endpoint()}",
-                     details=str(e),
-                     suggestion="Check CHAT_API_URL is correct and Dify server is running")
-            return None
-        except requests.exceptions.HTTPError as e:
-            status_code = e.response.status_code if e.response else 'Unknown'
-            error_body = ""
-            try:
-                error_body = e.response.json() if e.response else {}
-            except Exception:
-                error_body = e.response.text if e.response else str(e)
+            response.raise_for_status()
+            return self._parse_response(user_id, response.json(), response_time)
 
-            log_error("HTTP", f"Status {status_code}: {error_body}",
-                     suggestion=self._get_http_error_suggestion(status_code))
+        except CircuitOpenError as e:
+            logger.warning(f"[User:{user_id}] {str(e)}")
             return None
         except (KeyError, ValueError) as e:
             log_error("Parse", f"Failed to parse Dify response: {str(e)}",
                      suggestion="Dify response format may be invalid")
             return None
         except Exception as e:
-            log_error("Unexpected", str(e))
+            self._log_error(e, start_time)
             return None
 
-    def test_connection(self) -> Dict[str, Any]:
-        """
-        测试 Dify API 连接
+    def _log_error(self, error: Exception, start_time: float) -> None:
+        self._log_request_error(
+            error, start_time, self._get_chat_endpoint(), "Dify server",
+            timeout_suggestion="Increase HTTP_TIMEOUT or check Dify server performance",
+            connection_suggestion="Check CHAT_API_URL is correct and Dify server is running"
+        )
 
-        Returns:
-            测试结果字典
-        """
+    def _test_request(self) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """构建连接测试请求并输出配置信息"""
         logger.info("=" * 50)
         logger.info("🧪 Testing Dify API connection...")
         logger.info("=" * 50)
@@ -210,74 +253,68 @@ class DifyProvider(ChatProvider):
         logger.info(f"⏱️  Timeout: {self.get_timeout()}s")
         logger.info(f"🔄 Max Retries: {self.http_config.get('max_retries', 3)}")
         logger.info(f"📝 Response Mode: blocking")
+        return endpoint, headers, test_data
 
-        try:
-            start_time = time.time()
-
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=test_data,
-                timeout=self.get_timeout()
-            )
+    def _test_result(self, response: Any, response_time: float) -> Dict[str, Any]:
+        """解析连接测试的响应（requests 或 httpx 的响应）"""
+        if response.status_code == 200:
+            result = response.json()
 
-            response_time = time.time() - start_time
+            if 'answer' in result:
+                ai_response = result['answer'].strip()
 
-            if response.status_code == 200:
-                result = response.json()
-
-                if 'answer' in result:
-                    ai_response = result['answer'].strip()
-
-                    logger.info(f"✅ API response successful (time: {response_time:.2f}s)")
-                    logger.info(f"🤖 AI reply: {ai_response}")
-                    logger.info(f"📋 Conversation ID: {result.get('conversation_id', 'N/A')}")
-                    logger.info(f"📋 Message ID: {result.get('message_id', 'N/A')}")
-
-                    # Dify 返回的 metadata
-                    if 'metadata' in result:
-                        metadata = result['metadata']
-                        if 'usage' in metadata:
-                            usage = metadata['usage']
-                            logger.info(f"📊 Token usage: total={usage.get('total_tokens', 'N/A')}")
-
-                    return {
-                        "success": True,
-                        "provider": self.provider_name,
-                        "response": ai_response,
-                        "response_time": response_time,
-                        "conversation_id": result.get('conversation_id', ''),
-                        "message_id": result.get('message_id', '')
-                    }
-                else:
-                    logger.error("❌ API response format error: missing 'answer' field")
-                    logger.error(f"   Response body: {result}")
-                    return {
-                        "success": False,
-                        "provider": self.provider_name,
-                        "error": "Invalid response format: missing 'answer' field",
-                        "details": result
-                    }
-            else:
-                error_msg = f"HTTP {response.status_code}"
-                try:
-                    error_detail = response.json()
-                    error_msg += f": {error_detail}"
-                except Exception:
-                    error_msg += f": {response.text}"
+                logger.info(f"✅ API response successful (time: {response_time:.2f}s)")
+                logger.info(f"🤖 AI reply: {ai_response}")
+                logger.info(f"📋 Conversation ID: {result.get('conversation_id', 'N/A')}")
+                logger.info(f"📋 Message ID: {result.get('message_id', 'N/A')}")
 
-                logger.error(f"❌ API request failed: {error_msg}")
-                logger.info(f"💡 Suggestion: {self._get_http_error_suggestion(response.status_code)}")
+                # Dify 返回的 metadata
+                if 'metadata' in result:
+                    metadata = result['metadata']
+                    if 'usage' in metadata:
+                        usage = metadata['usage']
+                        logger.info(f"📊 Token usage: total={usage.get('total_tokens', 'N/A')}")
 
+                return {
+                    "success": True,
+                    "provider": self.provider_name,
+                    "response": ai_response,
+                    "response_time": response_time,
+                    "conversation_id": result.get('conversation_id', ''),
+                    "message_id": result.get('message_id', '')
+                }
+            else:
+                logger.error("❌ API response format error: missing 'answer' field")
+                logger.error(f"   Response body: {result}")
                 return {
                     "success": False,
                     "provider": self.provider_name,
-                    "error": error_msg,
-                    "status_code": response.status_code,
-                    "suggestion": self._get_http_error_suggestion(response.status_code)
+                    "error": "Invalid response format: missing 'answer' field",
+                    "details": result
                 }
+        else:
+            error_msg = f"HTTP {response.status_code}"
+            try:
+                error_detail = response.json()
+                error_msg += f": {error_detail}"
+            except Exception:
+                error_msg += f": {response.text}"
+
+            logger.error(f"❌ API request failed: {error_msg}")
+            logger.info(f"💡 Suggestion: {self._get_http_error_suggestion(response.status_code)}")
 
-        except requests.exceptions.Timeout:
+            return {
+                "success": False,
+                "provider": self.provider_name,
+                "error": error_msg,
+                "status_code": response.status_code,
+                "suggestion": self._get_http_error_suggestion(response.status_code)
+            }
+
+    def _test_error(self, error: Exception) -> Dict[str, Any]:
+        """连接测试异常时的结果"""
+        kind = error_kind(error)
+        if kind == 'timeout':
             logger.error(f"❌ API request timeout (>{self.get_timeout()}s)")
             logger.info("💡 Suggestion: Increase HTTP_TIMEOUT or check Dify server performance")
             return {
@@ -286,24 +323,59 @@ class DifyProvider(ChatProvider):
                 "error": "Request timeout",
                 "suggestion": "Increase HTTP_TIMEOUT or check Dify server performance"
             }
-        except requests.exceptions.ConnectionError as e:
+        if kind == 'connection':
             logger.error("❌ Cannot connect to Dify server")
-            logger.error(f"   Error: {str(e)}")
+            logger.error(f"   Error: {str(error)}")
             logger.info("💡 Suggestion: Check CHAT_API_URL is correct and Dify server is running")
             return {
                 "success": False,
                 "provider": self.provider_name,
                 "error": "Connection failed",
-                "details": str(e),
+                "details": str(error),
                 "suggestion": "Check CHAT_API_URL is correct and Dify server is running"
             }
+        logger.error(f"❌ API test exception: {str(error)}")
+        return {
+            "success": False,
+            "provider": self.provider_name,
+            "error": str(error)
+        }
+
+    def test_connection(self) -> Dict[str, Any]:
+        """
+        测试 Dify API 连接
+
+        Returns:
+            测试结果字典
+        """
+        endpoint, headers, test_data = self._test_request()
+        try:
+            start_time = time.time()
+            response = self.session.post(
+                endpoint,
+                headers=headers,
+                json=test_data,
+                timeout=self.get_timeout()
+            )
+            return self._test_result(response, time.time() - start_time)
         except Exception as e:
-            logger.error(f"❌ API test exception: {str(e)}")
-            return {
-                "success": False,
-                "provider": self.provider_name,
-                "error": str(e)
-            }
+            return self._test_error(e)
+
+    async def test_connection_async(self) -> Dict[str, Any]:
+        """test_connection 的异步版本（httpx）"""
+        endpoint, headers, test_data = self._test_request()
+        try:
+            start_time = time.time()
+            client = get_async_client(endpoint, self.http_config.get('pool_size', 10))
+            response = await client.post(
+                endpoint,
+                headers=headers,
+                json=test_data,
+                timeout=self.get_timeout()
+            )
+            return self._test_result(response, time.time() - start_time)
+        except Exception as e:
+            return self._test_error(e)
 
     def clear_user_conversation(self, user_id: str) -> None:
         """
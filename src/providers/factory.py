@@ -1,9 +1,10 @@
 # src/providers/factory.py
 """
 Provider 工厂类
-根据配置创建对应的 Chat Provider 实例
+根据配置创建对应的 Chat Provider 实例，并管理进程内共享的 Provider
 """
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Tuple
 
 from .base import ChatProvider
 from .openai_provider import OpenAIProvider
@@ -19,6 +20,10 @@ class ProviderFactory:
         'dify': DifyProvider,
     }
 
+    # 进程内共享的 Provider 实例，按配置区分
+    _instances: Dict[Tuple, ChatProvider] = {}
+    _lock = threading.Lock()
+
     @classmethod
     def create(cls, config: Dict[str, Any]) -> ChatProvider:
         """
@@ -47,6 +52,66 @@ class ProviderFactory:
         print(f"📦 Creating {provider_class.__name__} instance...")
         return provider_class(config)
 
+    @classmethod
+    def get(cls, config: Dict[str, Any]) -> ChatProvider:
+        """
+        获取进程内共享的 Provider 实例，相同配置只创建一次
+
+        所有需要调用 LLM 的组件都应通过此方法获取 Provider，
+        以共用同一个连接池和会话状态（如 Dify 的 conversation_id）。
+
+        Args:
+            config: 完整的应用配置字典
+
+        Returns:
+            共享的 ChatProvider 实例
+        """
+        key = cls._instance_key(config)
+        with cls._lock:
+            provider = cls._instances.get(key)
+            if provider is None:
+                provider = cls.create(config)
+                cls._instances[key] = provider
+            return provider
+
+    @classmethod
+    def instances(cls) -> list:
+        """返回当前所有共享的 Provider 实例"""
+        with cls._lock:
+            return list(cls._instances.values())
+
+    @classmethod
+    def warmup_all(cls) -> int:
+        """
+        预热所有共享 Provider 的连接
+
+        Returns:
+            预热成功的 Provider 数量
+        """
+        return sum(1 for provider in cls.instances() if provider.warmup())
+
+    @classmethod
+    def close_all(cls) -> None:
+        """关闭并移除所有共享的 Provider 实例"""
+        with cls._lock:
+            providers = list(cls._instances.values())
+            cls._instances.clear()
+        for provider in providers:
+            provider.close()
+
+    @classmethod
+    def _instance_key(cls, config: Dict[str, Any]) -> Tuple:
+        """根据影响 Provider 行为的配置生成实例键（有会话状态的 Provider 还按机器人区分）"""
+        chat_config = config.get('CHAT_API', {})
+        http_config = config.get('HTTP', {})
+        provider_class = cls.PROVIDER_MAP.get(chat_config.get('type', 'openai').lower())
+        stateful = provider_class is not None and provider_class.stateful
+        return (
+            tuple(sorted((k, str(v)) for k, v in chat_config.items())),
+            tuple(sorted((k, str(v)) for k, v in http_config.items())),
+            config.get('BOT', {}).get('name', 'default') if stateful else None,
+        )
+
     @classmethod
     def get_supported_types(cls) -> list:
         """
@@ -0,0 +1,154 @@
+# src/providers/model_router.py
+"""
+模型路由
+根据 prompt 大小、估算复杂度和当前负载，在多个 OpenAI 兼容模型之间选择
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+from ..utils.logger import logger
+from ..utils.metrics import metrics
+from ..utils.text import estimate_tokens
+
+# 提示需要更强模型的关键词
+_COMPLEX_PATTERN = re.compile(
+    r'\b(analy[sz]e|analysis|explain|debug|compare|refactor|optimi[sz]e|step by step|why|traceback|stack trace)\b'
+    r'|分析|解释|调试|比较|重构|优化|为什么|日志|报错',
+    re.IGNORECASE
+)
+
+
+def parse_router_models(value: str) -> List[Tuple[str, Optional[int]]]:
+    """
+    解析路由模型配置
+
+    格式: "gpt-4o-mini=2000,gpt-4o"，按从小到大排列；
+    等号后为该模型可处理的最大 prompt token 数，最后一个模型通常不设上限。
+    """
+    tiers: List[Tuple[str, Optional[int]]] = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, limit = item.partition('=')
+        try:
+            tiers.append((model.strip(), int(limit) if limit else None))
+        except ValueError:
+            logger.warning(f"Invalid router model entry ignored: {item}")
+    return tiers
+
+
+def estimate_complexity(text: str) -> float:
+    """粗略估算问题复杂度（0~1）：代码、分析类关键词、长度和行数"""
+    score = 0.0
+    if '```' in text:
+        score += 0.4
+    if _COMPLEX_PATTERN.search(text):
+        score += 0.3
+    if len(text) > 500:
+        score += 0.2
+    if text.count('\n') > 10:
+        score += 0.1
+    return min(score, 1.0)
+
+
+class ModelRouter:
+    """
+    模型路由器
+
+    - 正常情况下选择第一个能容纳 prompt 的模型；复杂度超过阈值时跳过最小的模型
+    - 进行中的请求数达到 degrade_inflight，或最近请求的延迟 EWMA 超过 latency_slo 时进入降级模式：
+      各模型的 prompt 上限乘以 degrade_factor 并忽略复杂度，更多请求被路由到更快的小模型
+    """
+
+    def __init__(self, config: Dict[str, Any], name: str = 'default'):
+        self.name = name
+        self.tiers = parse_router_models(config.get('router_models', ''))
+        self.complexity_threshold = config.get('router_complexity_threshold', 0.3)
+        self.degrade_inflight = config.get('router_degrade_inflight', 0)
+        self.latency_slo = config.get('router_latency_slo', 0.0)
+        self.degrade_factor = max(1.0, config.get('router_degrade_factor', 2.0))
+
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._latency_ewma: Dict[str, float] = {}
+        self._overall_ewma: Optional[float] = None
+
+        metrics.register_gauge(self._metric('inflight'), lambda: self._inflight)
+        metrics.register_gauge(self._metric('latency_ewma'), lambda: self._overall_ewma)
+        for model, _ in self.tiers:
+            metrics.register_gauge(self._metric(f"latency_ewma.{model}"),
+                                   lambda model=model: self._latency_ewma.get(model))
+        logger.info(f"ModelRouter initialized for {name} with tiers: "
+                    f"{', '.join(f'{m}(<={l})' if l else m for m, l in self.tiers)}")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], name: str = 'default') -> Optional['ModelRouter']:
+        """CHAT_API 中配置了 router_models 时创建路由器（name 用于区分各机器人的指标）"""
+        if not parse_router_models(config.get('router_models', '')):
+            return None
+        return cls(config, name)
+
+    def select(self, messages: List[Dict[str, str]]) -> str:
+        """
+        为本次请求选择模型
+
+        Args:
+            messages: 即将发送的消息列表（含系统提示和历史）
+
+        Returns:
+            选中的模型名称
+        """
+        prompt_tokens = sum(estimate_tokens(m.get('content', '')) for m in messages)
+        last_user = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        complex_prompt = estimate_complexity(last_user) >= self.complexity_threshold
+
+        degraded = self._is_degraded()
+        factor = self.degrade_factor if degraded else 1.0
+        start = 1 if complex_prompt and not degraded and len(self.tiers) > 1 else 0
+
+        model = self.tiers[-1][0]
+        for name, limit in self.tiers[start:]:
+            if limit is None or prompt_tokens <= limit * factor:
+                model = name
+                break
+
+        metrics.inc(self._metric(f"decisions.{model}"))
+        if degraded:
+            metrics.inc(self._metric('degraded'))
+        logger.debug(f"Routed to {model} (prompt≈{prompt_tokens} tokens, complex={complex_prompt}, "
+                     f"degraded={degraded}, inflight={self._inflight})")
+        return model
+
+    @contextmanager
+    def track(self, model: str) -> Iterator[None]:
+        """统计请求的并发数和延迟（用于负载判断）"""
+        with self._lock:
+            self._inflight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._inflight -= 1
+                self._latency_ewma[model] = self._ewma(self._latency_ewma.get(model), elapsed)
+                self._overall_ewma = self._ewma(self._overall_ewma, elapsed)
+
+    def _metric(self, key: str) -> str:
+        return f"router.{self.name}.{key}"
+
+    @staticmethod
+    def _ewma(previous: Optional[float], value: float) -> float:
+        return value if previous is None else 0.8 * previous + 0.2 * value
+
+    def _is_degraded(self) -> bool:
+        if self.degrade_inflight and self._inflight >= self.degrade_inflight:
+            return True
+        # 使用所有模型的整体延迟：降级后小模型变快会使 EWMA 回落，从而自动退出降级
+        if self.latency_slo and self._overall_ewma is not None and self._overall_ewma > self.latency_slo:
+            return True
+        return False
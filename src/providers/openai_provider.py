@@ -5,12 +5,16 @@ OpenAI 兼容 API Provider
 """
 import time
 import requests
-from typing import Dict, Any, Optional, List
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from typing import Dict, Any, Optional, List, Tuple
 
 from .base import ChatProvider
+from .circuit_breaker import CircuitOpenError
+from .model_router import ModelRouter
+from ..utils.async_http import get_async_client
+from ..utils.http_client import error_kind, get_shared_session
 from ..utils.logger import logger, log_request, log_response, log_error
+from ..utils.metrics import metrics
+from ..utils.usage_ledger import usage_ledger
 
 
 class OpenAIProvider(ChatProvider):
@@ -19,21 +23,19 @@ class OpenAIProvider(ChatProvider):
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         self._init_session()
+        # 指标按机器人区分；配置相同的机器人共用一个 Provider，使用最先创建它的机器人名称
+        self.name = config.get('BOT', {}).get('name', 'default')
+        # 配置了多个模型时按 prompt 大小、复杂度和负载选择模型
+        self.router = ModelRouter.from_config(self.chat_config, self.name)
+        metrics.register_gauge(self._metric('hit_ratio'), self._cache_hit_ratio)
         logger.debug(f"OpenAIProvider initialized with model: {self.chat_config.get('model', 'N/A')}")
 
     def _init_session(self) -> None:
         """初始化 HTTP Session 并配置重试策略"""
-        self.session = requests.Session()
         max_retries = self.http_config.get('max_retries', 3)
-        retry_strategy = Retry(
-            total=max_retries,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
-        logger.debug(f"HTTP session initialized with max_retries={max_retries}")
+        pool_size = self.http_config.get('pool_size', 10)
+        self.session = get_shared_session(self.get_api_url(), max_retries, pool_size)
+        logger.debug(f"HTTP session initialized with max_retries={max_retries}, pool_size={pool_size}")
 
     def _build_messages(self, context: Optional[Any]) -> List[Dict[str, str]]:
         """
@@ -58,6 +60,58 @@ class OpenAIProvider(ChatProvider):
             return [{"role": "system", "content": system_prompt}]
         return []
 
+    def _prepare_request(self, user_id: str, context: Optional[Any]) -> Tuple[Dict[str, str], Dict[str, Any], bool]:
+        """
+        构建请求头与请求体
+
+        Returns:
+            (headers, json_data, 是否经过模型路由)
+        """
+        messages = self._build_messages(context)
+
+        headers = {
+            "Authorization": f"Bearer {self.get_api_key()}",
+            "Content-Type": "application/json"
+        }
+
+        # 用户选择的模型优先于模型路由 / A model chosen with /model overrides routing
+        selected = getattr(context, 'model', None)
+        routed = self.router is not None and not selected
+        model = selected or (self.router.select(messages) if routed else self.chat_config.get('model', ''))
+        json_data = {
+            "model": model,
+            "messages": messages,
+            "temperature": self.chat_config.get('temperature', 0.7),
+            "max_tokens": self.chat_config.get('max_tokens', 4096)
+        }
+        cache_key = self.chat_config.get('prompt_cache_key', '')
+        if cache_key:
+            json_data["prompt_cache_key"] = cache_key.replace('{user_id}', str(user_id))
+        return headers, json_data, routed
+
+    def _parse_response(self, user_id: str, result: Dict[str, Any], model: str, response_time: float) -> str:
+        """解析响应并记录 token 用量"""
+        ai_response = result["choices"][0]["message"]["content"]
+
+        # 记录 token 使用情况
+        if 'usage' in result:
+            usage = result['usage']
+            cached_tokens = self._record_cache_usage(usage)
+            self._set_usage({**usage, 'model': model})
+            logger.info(f"[User:{user_id}] Response received in {response_time:.2f}s "
+                       f"(tokens: {usage.get('total_tokens', 'N/A')}, cached: {cached_tokens})")
+            usage_ledger.record(
+                user_id,
+                model,
+                usage.get('prompt_tokens', 0),
+                usage.get('completion_tokens', 0),
+                usage.get('total_tokens', 0)
+            )
+        else:
+            logger.info(f"[User:{user_id}] Response received in {response_time:.2f}s")
+
+        return ai_response
+
     def send_message(
         self,
         user_id: str,
@@ -77,77 +131,123 @@ class OpenAIProvider(ChatProvider):
         """
         logger.info(f"[User:{user_id}] Sending message to OpenAI API...")
         start_time = time.time()
+        self._set_usage({})
 
         try:
-            messages = self._build_messages(context)
-
-            headers = {
-                "Authorization": f"Bearer {self.get_api_key()}",
-                "Content-Type": "application/json"
-            }
-
-            json_data = {
-                "model": self.chat_config.get('model', ''),
-                "messages": messages,
-                "temperature": self.chat_config.get('temperature', 0.7),
-                "max_tokens": self.chat_config.get('max_tokens', 4096)
-            }
-
+            headers, json_data, routed = self._prepare_request(user_id, context)
             log_request("POST", self.get_api_url(), headers=headers)
 
-            response = self.session.post(
-                self.get_api_url(),
-                headers=headers,
-                json=json_data,
-                timeout=self.get_timeout()
-            )
-            
+            if routed:
+                with self.router.track(json_data['model']):
+                    response = self._post(headers, json_data)
+            else:
+                response = self._post(headers, json_data)
+
             response_time = time.time() - start_time
             log_response(response.status_code, response_time)
 
             response.raise_for_status()
+            return self._parse_response(user_id, response.json(), json_data['model'], response_time)
 
-            result = response.json()
-            ai_response = result["choices"][0]["message"]["content"]
-            
-            # 记录 token 使用情况
-            if 'usage' in result:
-                usage = result['usage']
-                logger.info(f"[User:{user_id}] Response received in {response_time:.2f}s "
-                           f"(tokens: {usage.get('total_tokens', 'N/A')})")
-            else:
-                logger.info(f"[User:{user_id}] Response received in {response_time:.2f}s")
-            
-            return ai_response
-
-        except requests.exceptions.Timeout:
-            log_error("Timeout", f"Request timeout after {self.get_timeout()}s",
-                     suggestion="Increase HTTP_TIMEOUT or check network connection")
+        except CircuitOpenError as e:
+            logger.warning(f"[User:{user_id}] {str(e)}")
             return None
-        except requests.exceptions.ConnectionError as e:
-            log_error("Connection", f"Cannot connect to API server: {self.get_api_url()}",
-                     details=str(e),
-                     suggestion="Check CHAT_API_URL is correct and server is accessible")
+        except (KeyError, IndexError) as e:
+            log_error("Parse", f"Failed to parse API response: {str(e)}",
+                     suggestion="API response format may have changed or is invalid")
+            return None
+        except Exception as e:
+            self._log_error(e, start_time)
             return None
-        except requests.exceptions.HTTPError as e:
+
+    async def send_message_async(
+        self,
+        user_id: str,
+        message: str,
+        context: Optional[Any] = None
+    ) -> Optional[str]:
+        """send_message 的异步版本（httpx），等待上游期间不占用线程"""
+        logger.info(f"[User:{user_id}] Sending message to OpenAI API...")
+        start_time = time.time()
+        self._set_usage({})
+
+        try:
+            headers, json_data, routed = self._prepare_request(user_id, context)
+            log_request("POST", self.get_api_url(), headers=headers)
+
+            if routed:
+                with self.router.track(json_data['model']):
+                    response = await self._post_async(headers, json_data)
+            else:
+                response = await self._post_async(headers, json_data)
+
             response_time = time.time() - start_time
-            status_code = e.response.status_code if e.response else 'Unknown'
-            error_body = ""
-            try:
-                error_body = e.response.json() if e.response else {}
-            except Exception:
-                error_body = e.response.text if e.response else str(e)
-            
-            log_error("HTTP", f"Status {status_code}: {error_body}",
-                     suggestion=self._get_http_error_suggestion(status_code))
+            log_response(response.status_code, response_time)
+
+            response.raise_for_status()
+            return self._parse_response(user_id, response.json(), json_data['model'], response_time)
+
+        except CircuitOpenError as e:
+            logger.warning(f"[User:{user_id}] {str(e)}")
             return None
         except (KeyError, IndexError) as e:
             log_error("Parse", f"Failed to parse API response: {str(e)}",
                      suggestion="API response format may have changed or is invalid")
             return None
         except Exception as e:
-            log_error("Unexpected", str(e))
+            self._log_error(e, start_time)
+            return None
+
+    def _log_error(self, error: Exception, start_time: float) -> None:
+        self._log_request_error(
+            error, start_time, self.get_api_url(), "API server",
+            timeout_suggestion="Increase HTTP_TIMEOUT or check network connection",
+            connection_suggestion="Check CHAT_API_URL is correct and server is accessible"
+        )
+
+    def _post(self, headers: Dict[str, str], json_data: Dict[str, Any]) -> requests.Response:
+        """发送 Chat Completions 请求"""
+        return self._post_upstream(
+            self.get_api_url(),
+            headers=headers,
+            json=json_data,
+            timeout=self.get_timeout()
+        )
+
+    async def _post_async(self, headers: Dict[str, str], json_data: Dict[str, Any]) -> 'httpx.Response':
+        """异步发送 Chat Completions 请求"""
+        return await self._post_upstream_async(
+            self.get_api_url(),
+            headers=headers,
+            json=json_data,
+            timeout=self.get_timeout()
+        )
+
+    def _record_cache_usage(self, usage: Dict[str, Any]) -> int:
+        """
+        统计上游 prompt 前缀缓存命中的 token 数（usage.prompt_tokens_details.cached_tokens）
+
+        Returns:
+            本次请求命中缓存的 token 数，上游未返回时为 0
+        """
+        details = usage.get('prompt_tokens_details') or {}
+        cached_tokens = details.get('cached_tokens') or 0
+        metrics.inc(self._metric('requests'))
+        metrics.inc(self._metric('prompt_tokens'), usage.get('prompt_tokens', 0) or 0)
+        metrics.inc(self._metric('cached_tokens'), cached_tokens)
+        if cached_tokens:
+            metrics.inc(self._metric('hits'))
+        return cached_tokens
+
+    def _cache_hit_ratio(self) -> Optional[float]:
+        """命中缓存的 prompt token 占比"""
+        prompt_tokens = metrics.get(self._metric('prompt_tokens'))
+        if not prompt_tokens:
             return None
+        return round(metrics.get(self._metric('cached_tokens')) / prompt_tokens, 4)
+
+    def _metric(self, key: str) -> str:
+        return f"prompt_cache.{self.name}.{key}"
 
     def _get_http_error_suggestion(self, status_code: int) -> str:
         """根据 HTTP 状态码返回建议"""
@@ -163,13 +263,8 @@ class OpenAIProvider(ChatProvider):
         }
         return suggestions.get(status_code, "Check API configuration")
 
-    def test_connection(self) -> Dict[str, Any]:
-        """
-        测试 OpenAI API 连接
-
-        Returns:
-            测试结果字典
-        """
+    def _test_request(self) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """构建连接测试请求并输出配置信息"""
         logger.info("=" * 50)
         logger.info("🧪 Testing OpenAI-compatible API connection...")
         logger.info("=" * 50)
@@ -202,71 +297,65 @@ class OpenAIProvider(ChatProvider):
         logger.info(f"🤖 Model: {self.chat_config.get('model', 'N/A')}")
         logger.info(f"⏱️  Timeout: {self.get_timeout()}s")
         logger.info(f"🔄 Max Retries: {self.http_config.get('max_retries', 3)}")
+        return headers, request_data
 
-        try:
-            start_time = time.time()
+    def _test_result(self, response: Any, response_time: float) -> Dict[str, Any]:
+        """解析连接测试的响应（requests 或 httpx 的响应）"""
+        if response.status_code == 200:
+            result = response.json()
 
-            response = requests.post(
-                self.get_api_url(),
-                headers=headers,
-                json=request_data,
-                timeout=self.get_timeout()
-            )
+            if 'choices' in result and len(result['choices']) > 0:
+                ai_response = result['choices'][0]['message']['content'].strip()
 
-            response_time = time.time() - start_time
+                logger.info(f"✅ API response successful (time: {response_time:.2f}s)")
+                logger.info(f"🤖 AI reply: {ai_response}")
+
+                if 'usage' in result:
+                    usage = result['usage']
+                    logger.info(f"📊 Token usage: prompt={usage.get('prompt_tokens', 'N/A')}, "
+                               f"completion={usage.get('completion_tokens', 'N/A')}, "
+                               f"total={usage.get('total_tokens', 'N/A')}")
 
-            if response.status_code == 200:
-                result = response.json()
-
-                if 'choices' in result and len(result['choices']) > 0:
-                    ai_response = result['choices'][0]['message']['content'].strip()
-
-                    logger.info(f"✅ API response successful (time: {response_time:.2f}s)")
-                    logger.info(f"🤖 AI reply: {ai_response}")
-
-                    if 'usage' in result:
-                        usage = result['usage']
-                        logger.info(f"📊 Token usage: prompt={usage.get('prompt_tokens', 'N/A')}, "
-                                   f"completion={usage.get('completion_tokens', 'N/A')}, "
-                                   f"total={usage.get('total_tokens', 'N/A')}")
-
-                    return {
-                        "success": True,
-                        "provider": self.provider_name,
-                        "response": ai_response,
-                        "response_time": response_time,
-                        "usage": result.get('usage', {}),
-                        "model": result.get('model', self.chat_config.get('model', ''))
-                    }
-                else:
-                    logger.error("❌ API response format error: missing 'choices' field")
-                    logger.error(f"   Response body: {result}")
-                    return {
-                        "success": False,
-                        "provider": self.provider_name,
-                        "error": "Invalid response format: missing 'choices' field",
-                        "details": result
-                    }
+                return {
+                    "success": True,
+                    "provider": self.provider_name,
+                    "response": ai_response,
+                    "response_time": response_time,
+                    "usage": result.get('usage', {}),
+                    "model": result.get('model', self.chat_config.get('model', ''))
+                }
             else:
-                error_msg = f"HTTP {response.status_code}"
-                try:
-                    error_detail = response.json()
-                    error_msg += f": {error_detail}"
-                except Exception:
-                    error_msg += f": {response.text}"
-
-                logger.error(f"❌ API request failed: {error_msg}")
-                logger.info(f"💡 Suggestion: {self._get_http_error_suggestion(response.status_code)}")
-                
+                logger.error("❌ API response format error: missing 'choices' field")
+                logger.error(f"   Response body: {result}")
                 return {
                     "success": False,
                     "provider": self.provider_name,
-                    "error": error_msg,
-                    "status_code": response.status_code,
-                    "suggestion": self._get_http_error_suggestion(response.status_code)
+                    "error": "Invalid response format: missing 'choices' field",
+                    "details": result
                 }
+        else:
+            error_msg = f"HTTP {response.status_code}"
+            try:
+                error_detail = response.json()
+                error_msg += f": {error_detail}"
+            except Exception:
+                error_msg += f": {response.text}"
+
+            logger.error(f"❌ API request failed: {error_msg}")
+            logger.info(f"💡 Suggestion: {self._get_http_error_suggestion(response.status_code)}")
 
-        except requests.exceptions.Timeout:
+            return {
+                "success": False,
+                "provider": self.provider_name,
+                "error": error_msg,
+                "status_code": response.status_code,
+                "suggestion": self._get_http_error_suggestion(response.status_code)
+            }
+
+    def _test_error(self, error: Exception) -> Dict[str, Any]:
+        """连接测试异常时的结果"""
+        kind = error_kind(error)
+        if kind == 'timeout':
             logger.error(f"❌ API request timeout (>{self.get_timeout()}s)")
             logger.info("💡 Suggestion: Increase HTTP_TIMEOUT or check network latency")
             return {
@@ -275,21 +364,56 @@ class OpenAIProvider(ChatProvider):
                 "error": "Request timeout",
                 "suggestion": "Increase HTTP_TIMEOUT or check network latency"
             }
-        except requests.exceptions.ConnectionError as e:
+        if kind == 'connection':
             logger.error(f"❌ Cannot connect to API server")
-            logger.error(f"   Error: {str(e)}")
+            logger.error(f"   Error: {str(error)}")
             logger.info("💡 Suggestion: Check CHAT_API_URL is correct and network is accessible")
             return {
                 "success": False,
                 "provider": self.provider_name,
                 "error": "Connection failed",
-                "details": str(e),
+                "details": str(error),
                 "suggestion": "Check CHAT_API_URL is correct and network is accessible"
             }
+        logger.error(f"❌ API test exception: {str(error)}")
+        return {
+            "success": False,
+            "provider": self.provider_name,
+            "error": str(error)
+        }
+
+    def test_connection(self) -> Dict[str, Any]:
+        """
+        测试 OpenAI API 连接
+
+        Returns:
+            测试结果字典
+        """
+        headers, request_data = self._test_request()
+        try:
+            start_time = time.time()
+            response = self.session.post(
+                self.get_api_url(),
+                headers=headers,
+                json=request_data,
+                timeout=self.get_timeout()
+            )
+            return self._test_result(response, time.time() - start_time)
         except Exception as e:
-            logger.error(f"❌ API test exception: {str(e)}")
-            return {
-                "success": False,
-                "provider": self.provider_name,
-                "error": str(e)
-            }
+            return self._test_error(e)
+
+    async def test_connection_async(self) -> Dict[str, Any]:
+        """test_connection 的异步版本（httpx）"""
+        headers, request_data = self._test_request()
+        try:
+            start_time = time.time()
+            client = get_async_client(self.get_api_url(), self.http_config.get('pool_size', 10))
+            response = await client.post(
+                self.get_api_url(),
+                headers=headers,
+                json=request_data,
+                timeout=self.get_timeout()
+            )
+            return self._test_result(response, time.time() - start_time)
+        except Exception as e:
+            return self._test_error(e)
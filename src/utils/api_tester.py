@@ -1,22 +1,47 @@
-# src/utils/api_tester.py
 """
 API测试器 / API Tester
 使用 Provider 抽象层进行 API 连接测试
 """
-from typing import Dict, Any
+import asyncio
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+from ..providers.base import ChatProvider
 from ..providers.factory import ProviderFactory
+from .http_client import get_pool_stats
 
 
 class APITester:
     """API测试器 / API Tester"""
 
-    def __init__(self, config: Dict[str, Any]):
-        """初始化API测试器 / Initialize API tester"""
+    def __init__(self, config: Dict[str, Any], provider: Optional[ChatProvider] = None):
+        """
+        初始化API测试器 / Initialize API tester
+
+        Args:
+            config: 完整的应用配置字典
+            provider: 使用的 Provider 实例，为空时使用 ProviderFactory 中共享的实例
+        """
         self.config = config
         self.chat_config = config.get('CHAT_API', {})
         self.http_config = config.get('HTTP', {})
-        # 创建 Provider 实例
-        self.provider = ProviderFactory.create(config)
+        self.cache_ttl = config.get('API_TEST', {}).get('cache_ttl', 0)
+        self.provider = provider or ProviderFactory.get(config)
+
+        # 缓存的探测结果；并发请求合并到同一次探测
+        self._lock = threading.Lock()
+        self._result: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._inflight: Optional[threading.Event] = None
+        self._stats = {
+            'probes': 0,
+            'cache_hits': 0,
+            'coalesced': 0,
+            'last_latency': None,
+            'total_latency': 0.0,
+            'min_latency': None,
+            'max_latency': None,
+        }
 
     def test_chat_api(self) -> Dict[str, Any]:
         """
@@ -26,5 +51,105 @@ class APITester:
         支持 OpenAI 和 Dify 等多种 API 类型。
         """
         print(f"🧪 Testing {self.chat_config.get('type', 'openai').upper()} API connection...")
-        return self.provider.test_connection()
+        return self._probe()
+
+    def get_cached_result(self) -> Dict[str, Any]:
+        """
+        获取缓存的测试结果，缓存过期时才真正请求上游
+
+        在 cache_ttl 秒内重复调用直接返回上次结果，
+        同时到达的多个请求只会触发一次真实探测。
+        """
+        cached, waiter = self._claim()
+        if cached is not None:
+            return cached
+        if waiter is not None:
+            waiter.wait(self.http_config.get('timeout', 30) * 2)
+            return self._coalesced()
+        return self._with_meta(self._probe(), cached=False, age=0.0)
+
+    async def get_cached_result_async(self) -> Dict[str, Any]:
+        """get_cached_result 的异步版本（ASGI 模式使用），探测使用 Provider 的 test_connection_async"""
+        cached, waiter = self._claim()
+        if cached is not None:
+            return cached
+        if waiter is not None:
+            await asyncio.to_thread(waiter.wait, self.http_config.get('timeout', 30) * 2)
+            return self._coalesced()
+
+        start_time = time.monotonic()
+        try:
+            result = await self.provider.test_connection_async()
+        except Exception as e:
+            result = {"success": False, "provider": self.provider.provider_name, "error": str(e)}
+        self._record(result, time.monotonic() - start_time)
+        return self._with_meta(result, cached=False, age=0.0)
+
+    def _claim(self) -> Tuple[Optional[Dict[str, Any]], Optional[threading.Event]]:
+        """
+        Returns:
+            (缓存未过期时的结果, 正在进行的探测)；两者都为 None 时由调用方执行探测
+        """
+        with self._lock:
+            age = time.monotonic() - self._checked_at
+            if self._result is not None and age < self.cache_ttl:
+                self._stats['cache_hits'] += 1
+                return self._with_meta(self._result, cached=True, age=age), None
+            if self._inflight is not None:
+                return None, self._inflight
+            self._inflight = threading.Event()
+            return None, None
+
+    def _coalesced(self) -> Dict[str, Any]:
+        """合并到其他请求的探测时返回的结果"""
+        with self._lock:
+            self._stats['coalesced'] += 1
+            result = self._result or {
+                "success": False,
+                "provider": self.provider.provider_name,
+                "error": "API test still in progress"
+            }
+            return self._with_meta(result, cached=True, age=time.monotonic() - self._checked_at)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回探测延迟和连接复用统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        total_latency = stats.pop('total_latency')
+        stats['avg_latency'] = total_latency / stats['probes'] if stats['probes'] else None
+        stats['cache_ttl'] = self.cache_ttl
+        session = getattr(self.provider, 'session', None)
+        if session is not None:
+            stats['connection_pool'] = get_pool_stats(session)
+        return stats
+
+    def _probe(self) -> Dict[str, Any]:
+        """执行一次真实探测并更新缓存"""
+        start_time = time.monotonic()
+        try:
+            result = self.provider.test_connection()
+        except Exception as e:
+            result = {"success": False, "provider": self.provider.provider_name, "error": str(e)}
+        self._record(result, time.monotonic() - start_time)
+        return result
+
+    def _record(self, result: Dict[str, Any], latency: float) -> None:
+        """更新缓存与延迟统计，并唤醒等待同一次探测的请求"""
+        with self._lock:
+            self._result = result
+            self._checked_at = time.monotonic()
+            stats = self._stats
+            stats['probes'] += 1
+            stats['last_latency'] = latency
+            stats['total_latency'] += latency
+            stats['min_latency'] = latency if stats['min_latency'] is None else min(stats['min_latency'], latency)
+            stats['max_latency'] = latency if stats['max_latency'] is None else max(stats['max_latency'], latency)
+            waiter, self._inflight = self._inflight, None
+        if waiter is not None:
+            waiter.set()
 
+    def _with_meta(self, result: Dict[str, Any], cached: bool, age: float) -> Dict[str, Any]:
+        response = dict(result)
+        response['cached'] = cached
+        response['cache_age'] = round(age, 3)
+        return response
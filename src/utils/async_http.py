@@ -0,0 +1,71 @@
+# src/utils/async_http.py
+"""
+异步 HTTP 客户端（ASGI 模式使用）
+按上游地址共享 httpx.AsyncClient，同一事件循环内的所有请求复用其连接池
+"""
+import asyncio
+import threading
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+try:
+    import httpx
+except ImportError:  # 只有 ASGI 模式需要 httpx，WSGI 部署无需安装
+    httpx = None
+
+# (上游, 连接池大小) -> (所属事件循环, 客户端)
+_clients: Dict[Tuple[str, int], Tuple[asyncio.AbstractEventLoop, 'httpx.AsyncClient']] = {}
+_lock = threading.Lock()
+
+
+def require_httpx() -> None:
+    """
+    Raises:
+        RuntimeError: 未安装 httpx 时
+    """
+    if httpx is None:
+        raise RuntimeError("ASGI mode requires httpx: pip install httpx uvicorn")
+
+
+def get_async_client(url: str, pool_size: int = 10) -> 'httpx.AsyncClient':
+    """
+    获取当前事件循环中指定上游共享的 AsyncClient
+
+    超时由每次请求单独传入；pool_size 同时限制连接数和 keep-alive 连接数，
+    连接用尽时请求在池中等待（计入该请求的超时）。
+
+    Args:
+        url: 上游请求地址（只使用其 scheme 与 netloc 部分）
+        pool_size: 最大连接数
+
+    Raises:
+        RuntimeError: 未安装 httpx 或不在事件循环中调用时
+    """
+    require_httpx()
+    loop = asyncio.get_running_loop()
+    parts = urlsplit(url)
+    key = (f"{parts.scheme}://{parts.netloc}", pool_size)
+    with _lock:
+        entry = _clients.get(key)
+        # 客户端与创建它的事件循环绑定（如 uvicorn 每个 worker 一个循环）
+        if entry is None or entry[0] is not loop:
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            entry = (loop, httpx.AsyncClient(limits=limits, timeout=None))
+            _clients[key] = entry
+        return entry[1]
+
+
+async def close_async_clients() -> int:
+    """
+    关闭当前事件循环中的所有 AsyncClient（ASGI lifespan 结束时调用）
+
+    Returns:
+        关闭的客户端数量
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        owned = [key for key, (client_loop, _) in _clients.items() if client_loop is loop]
+        clients = [_clients.pop(key)[1] for key in owned]
+    for client in clients:
+        await client.aclose()
+    return len(clients)
@@ -0,0 +1,67 @@
+# src/utils/deadline.py
+"""
+请求截止时间
+webhook 请求进入时创建，沿调用链（ChatManager、MessageHandler、Provider、HTTPClient）传递，
+每一跳的超时都不超过剩余时间
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+_current: contextvars.ContextVar[Optional['Deadline']] = contextvars.ContextVar('deadline', default=None)
+
+
+class Deadline:
+    """以 time.monotonic() 为基准的截止时间点"""
+
+    def __init__(self, budget: float):
+        """
+        Args:
+            budget: 从现在起可用的时间（秒）
+        """
+        self.expires_at = time.monotonic() + budget
+
+    @classmethod
+    def at(cls, expires_at: float) -> 'Deadline':
+        deadline = cls(0)
+        deadline.expires_at = expires_at
+        return deadline
+
+    def remaining(self) -> float:
+        """剩余时间（秒），已过期时为 0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def reserve(self, seconds: float) -> 'Deadline':
+        """返回提前 seconds 秒的截止时间（为后续步骤预留时间）"""
+        return Deadline.at(self.expires_at - seconds)
+
+    def timeout(self, cap: float) -> float:
+        """单跳请求的超时：不超过 cap，也不超过剩余时间"""
+        return min(cap, self.remaining())
+
+
+def current_deadline() -> Optional[Deadline]:
+    """当前请求的截止时间，不在请求上下文中时为 None"""
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    在代码块内设置当前截止时间（嵌套时取较早者）
+
+    后台线程需通过 contextvars.copy_context().run 启动才能继承当前截止时间。
+    """
+    outer = _current.get()
+    if outer is not None and deadline is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current.set(deadline if deadline is not None else outer)
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
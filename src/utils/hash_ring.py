@@ -0,0 +1,82 @@
+# src/utils/hash_ring.py
+"""
+一致性哈希环
+增删节点时只有约 1/N 的键会改变归属
+"""
+import bisect
+import hashlib
+from typing import Callable, Iterator, List, Sequence, Tuple
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    带虚拟节点的一致性哈希环
+
+    每个节点在环上放置 virtual_nodes 个点，键归属于顺时针方向的第一个点所属的节点；
+    查找为一次二分查找。
+    """
+
+    def __init__(self, nodes: Sequence[str] = (), virtual_nodes: int = 100):
+        self.virtual_nodes = max(1, virtual_nodes)
+        self._points: List[Tuple[int, str]] = []
+        self._hashes: List[int] = []
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        """添加节点（已存在时忽略）"""
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        self._points.extend((_hash(f"{node}#{i}"), node) for i in range(self.virtual_nodes))
+        self._rebuild()
+
+    def remove(self, node: str) -> None:
+        """移除节点"""
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self._points = [point for point in self._points if point[1] != node]
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._points.sort()
+        self._hashes = [h for h, _ in self._points]
+
+    def get(self, key: str) -> str:
+        """
+        返回键所属的节点
+
+        Raises:
+            LookupError: 环为空时
+        """
+        for node in self.iter_nodes(key):
+            return node
+        raise LookupError("Hash ring is empty")
+
+    def iter_nodes(self, key: str, accept: Callable[[str], bool] = lambda node: True) -> Iterator[str]:
+        """
+        按顺时针顺序依次返回键的候选节点（每个节点只出现一次），用于故障转移
+
+        Args:
+            key: 键
+            accept: 过滤函数，返回 False 的节点被跳过
+        """
+        if not self._points:
+            return
+        start = bisect.bisect(self._hashes, _hash(key))
+        seen = set()
+        for offset in range(len(self._points)):
+            node = self._points[(start + offset) % len(self._points)][1]
+            if node in seen:
+                continue
+            seen.add(node)
+            if accept(node):
+                yield node
+            if len(seen) == len(self.nodes):
+                return
@@ -1,33 +1,196 @@
 import json
-from typing import Dict, Any, Optional
+import threading
+import weakref
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from .async_http import get_async_client, httpx
+from .retry import RetryPolicy
+
+# 进程内所有带连接池的 Session，fork 之后需要逐个重建连接池
+_sessions: "weakref.WeakSet[requests.Session]" = weakref.WeakSet()
+
+# 按上游地址共享的 Session，同一上游的多个组件复用同一个连接池
+_shared_sessions: Dict[Tuple[str, int, int], requests.Session] = {}
+_shared_lock = threading.Lock()
+
+
+def create_session(max_retries: int = 3, pool_size: int = 10) -> requests.Session:
+    """
+    创建带重试策略和连接池的 HTTP Session
+
+    Args:
+        max_retries: 最大重试次数
+        pool_size: 每个主机保持的 keep-alive 连接数（线程/协程 worker 下应不小于并发数）
+
+    Returns:
+        已登记、可在 fork 后重建连接池的 Session
+    """
+    session = requests.Session()
+    # 连接池层只重试幂等请求（GET/HEAD 等）；POST 的重试由 RetryPolicy 负责，
+    # 这里不重试连接错误，避免两层重试叠加
+    retry_strategy = Retry(
+        total=max_retries,
+        connect=0,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504]
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry_strategy,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    _sessions.add(session)
+    return session
+
+
+def get_shared_session(url: str, max_retries: int = 3, pool_size: int = 10) -> requests.Session:
+    """
+    获取指定上游共享的 HTTP Session
+
+    以 scheme://host:port 加重试/连接池参数为键，同一进程内访问同一上游的组件
+    共用一个 Session 及其 keep-alive 连接池。
+
+    Args:
+        url: 上游请求地址（只使用其 scheme 与 netloc 部分）
+        max_retries: 最大重试次数
+        pool_size: 每个主机保持的 keep-alive 连接数
+
+    Returns:
+        共享的 Session
+    """
+    parts = urlsplit(url)
+    key = (f"{parts.scheme}://{parts.netloc}", max_retries, pool_size)
+    with _shared_lock:
+        session = _shared_sessions.get(key)
+        if session is None:
+            session = create_session(max_retries, pool_size)
+            _shared_sessions[key] = session
+        return session
+
+
+def error_kind(error: Exception) -> Optional[str]:
+    """
+    归类 requests / httpx 的请求异常
+
+    Returns:
+        'timeout'（超时）、'connection'（连接失败）、'http'（raise_for_status 抛出的状态码错误），
+        其他异常返回 None
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return 'connection'
+    if isinstance(error, requests.exceptions.HTTPError):
+        return 'http'
+    if httpx is not None:
+        if isinstance(error, httpx.TimeoutException):
+            return 'timeout'
+        if isinstance(error, httpx.TransportError):
+            return 'connection'
+        if isinstance(error, httpx.HTTPStatusError):
+            return 'http'
+    return None
+
+
+def reset_session_pools() -> int:
+    """
+    丢弃所有已登记 Session 中的连接（在 gunicorn worker fork 之后调用）
+
+    preload 模式下 master 进程启动时建立的 keep-alive 连接会被复制到每个 worker，
+    多个进程共用同一个 socket 会导致响应串线。清空连接池后，
+    Session 对象本身保持不变，后续请求会在当前进程内按需重新建立连接。
+
+    Returns:
+        被重置的 Session 数量
+    """
+    sessions = list(_sessions)
+    for session in sessions:
+        session.close()
+    return len(sessions)
+
+
+def warm_connection(session: requests.Session, url: str, timeout: float) -> int:
+    """
+    向上游发送一次 HEAD 请求，在 Session 的连接池中留下一个 keep-alive 连接
+
+    直接使用适配器为该 URL 选择的连接池（与 session.post 相同的代理与证书设置），
+    但不经过适配器的重试策略：预热失败不应因 429/5xx 重试和退避而拖慢启动。
+
+    Returns:
+        响应状态码
+
+    Raises:
+        urllib3.exceptions.HTTPError: 连接失败或超时时
+    """
+    adapter = session.get_adapter(url)
+    request = session.prepare_request(requests.Request('HEAD', url))
+    settings = session.merge_environment_settings(url, {}, None, None, None)
+    if hasattr(adapter, 'get_connection_with_tls_context'):
+        pool = adapter.get_connection_with_tls_context(request, settings['verify'], settings['proxies'])
+    else:
+        pool = adapter.get_connection(url, settings['proxies'])
+        adapter.cert_verify(pool, url, settings['verify'], None)
+    response = pool.urlopen('HEAD', adapter.request_url(request, settings['proxies']), headers=request.headers,
+                            retries=False, redirect=False, timeout=timeout)
+    return response.status
+
+
+def get_pool_stats(session: requests.Session) -> Dict[str, int]:
+    """
+    统计 Session 连接池的连接复用情况
+
+    Returns:
+        connections: 已建立的连接数
+        requests: 已发送的请求数
+        reused: 复用 keep-alive 连接发送的请求数
+    """
+    connections = 0
+    sent = 0
+    for adapter in set(session.adapters.values()):
+        pools = getattr(adapter, 'poolmanager', None)
+        if pools is None:
+            continue
+        for key in list(pools.pools.keys()):
+            pool = pools.pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            sent += pool.num_requests
+    return {
+        'connections': connections,
+        'requests': sent,
+        'reused': max(0, sent - connections)
+    }
+
+
 class HTTPClient:
-    def __init__(self, timeout: int = 30, max_retries: int = 3):
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=max_retries,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+    def __init__(self, timeout: int = 30, max_retries: int = 3, pool_size: int = 10,
+                 retry_policy: Optional[RetryPolicy] = None):
+        self.session = create_session(max_retries, pool_size)
         self.timeout = timeout
+        self.pool_size = pool_size
+        self.retry_policy = retry_policy or RetryPolicy('http', max_retries=max_retries)
 
     def post(self, url: str, data: Optional[Dict[str, Any]] = None,
              json_data: Optional[Dict[str, Any]] = None,
-             headers: Optional[Dict[str, str]] = None) -> requests.Response:
-        """发送POST请求"""
+             headers: Optional[Dict[str, str]] = None,
+             timeout: Optional[float] = None,
+             retry_policy: Optional[RetryPolicy] = None) -> requests.Response:
+        """发送POST请求，timeout 与 retry_policy 为空时使用客户端的默认值"""
         try:
-            response = self.session.post(
+            response = (retry_policy or self.retry_policy).post(
+                self.session,
                 url,
+                timeout=timeout or self.timeout,
                 data=data,
                 json=json_data,
-                headers=headers,
-                timeout=self.timeout
+                headers=headers
             )
             response.raise_for_status()
             return response
@@ -35,15 +198,51 @@ class HTTPClient:
             print(f"HTTP request failed: {str(e)}")
             raise
 
-    def send_chat_message(self, webhook_url: str, text: str, user_ids: list) -> bool:
-        """发送消息到Synology Chat"""
+    def send_chat_message(self, webhook_url: str, text: str, user_ids: list,
+                          timeout: Optional[float] = None,
+                          retry_policy: Optional[RetryPolicy] = None) -> bool:
+        """发送消息到Synology Chat，timeout 与 retry_policy 同 post"""
         try:
             payload = {
                 "text": text,
                 "user_ids": user_ids
             }
-            data = {'payload': json.dumps(payload)}
-            response = self.post(webhook_url, data=data)
+            # 不转义非 ASCII 字符：分块按 UTF-8 字节计算，\uXXXX 转义会让每个中文字符占 6 字节
+            data = {'payload': json.dumps(payload, ensure_ascii=False)}
+            response = self.post(webhook_url, data=data, timeout=timeout, retry_policy=retry_policy)
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Failed to send chat message: {str(e)}")
+            return False
+
+    async def post_async(self, url: str, data: Optional[Dict[str, Any]] = None,
+                         json_data: Optional[Dict[str, Any]] = None,
+                         headers: Optional[Dict[str, str]] = None,
+                         timeout: Optional[float] = None,
+                         retry_policy: Optional[RetryPolicy] = None) -> 'httpx.Response':
+        """post 的异步版本（ASGI 模式使用），连接池为当前事件循环中按上游共享的 AsyncClient"""
+        try:
+            response = await (retry_policy or self.retry_policy).post_async(
+                get_async_client(url, self.pool_size),
+                url,
+                timeout=timeout or self.timeout,
+                data=data,
+                json=json_data,
+                headers=headers
+            )
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            print(f"HTTP request failed: {str(e)}")
+            raise
+
+    async def send_chat_message_async(self, webhook_url: str, text: str, user_ids: list,
+                                      timeout: Optional[float] = None,
+                                      retry_policy: Optional[RetryPolicy] = None) -> bool:
+        """send_chat_message 的异步版本"""
+        try:
+            data = {'payload': json.dumps({"text": text, "user_ids": user_ids}, ensure_ascii=False)}
+            response = await self.post_async(webhook_url, data=data, timeout=timeout, retry_policy=retry_policy)
             return response.status_code == 200
         except Exception as e:
             print(f"Failed to send chat message: {str(e)}")
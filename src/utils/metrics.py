@@ -0,0 +1,53 @@
+# src/utils/metrics.py
+"""
+进程内指标模块
+提供计数器和仪表，通过 /metrics 端点以 JSON 形式暴露
+"""
+import threading
+from typing import Dict, Any, Callable, Union
+
+
+class Metrics:
+    """线程安全的计数器与仪表集合，指标名使用点号分隔（如 supersede.cancelled）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Union[int, float]] = {}
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+
+    def inc(self, name: str, value: Union[int, float] = 1) -> None:
+        """计数器累加"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name: str) -> Union[int, float]:
+        """读取计数器当前值"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def register_gauge(self, name: str, func: Callable[[], Any]) -> None:
+        """
+        注册仪表，读取指标时调用 func 获取当前值
+
+        Args:
+            name: 指标名
+            func: 返回当前值的无参函数（应为 O(1) 的实时计数读取）
+        """
+        with self._lock:
+            self._gauges[name] = func
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回所有指标的当前值"""
+        with self._lock:
+            result: Dict[str, Any] = dict(self._counters)
+            gauges = list(self._gauges.items())
+        for name, func in gauges:
+            try:
+                result[name] = func()
+            except Exception as e:
+                result[name] = f"error: {str(e)}"
+        return dict(sorted(result.items()))
+
+
+# 全局指标实例
+metrics = Metrics()
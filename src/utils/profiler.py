@@ -0,0 +1,262 @@
+# src/utils/profiler.py
+"""
+请求采样分析
+按比例或按耗时阈值对 /webhook 请求做低开销的栈采样，将调用栈写入轮转目录，并汇总热点函数
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from .logger import logger
+from .metrics import metrics
+
+Stack = Tuple[str, ...]
+
+_SUFFIX = '.folded'
+
+
+@lru_cache(maxsize=4096)
+def _short_path(path: str) -> str:
+    """缩短源文件路径：第三方库与标准库去掉安装前缀，项目文件使用相对路径"""
+    for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+        if marker in path:
+            return path.rsplit(marker, 1)[1]
+    stdlib = os.path.dirname(os.__file__) + os.sep
+    if path.startswith(stdlib):
+        return path[len(stdlib):]
+    try:
+        relative = os.path.relpath(path)
+    except ValueError:
+        return path
+    return path if relative.startswith('..') else relative
+
+
+class _Profile:
+    """单个请求的采样结果"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.stacks: Counter = Counter()
+
+
+class RequestProfiler:
+    """
+    请求栈采样器
+
+    - 后台线程每隔 interval 秒读取正在被分析的请求线程的调用栈（sys._current_frames），
+      只对登记的线程取样，不在请求线程内挂钩子，开销与采样频率成正比
+    - 按 sample_rate 抽中的请求，以及耗时超过 slow_threshold 的请求，调用栈以 folded 格式
+      （"外层;...;内层 次数"，可直接用于火焰图）写入 dir，最多保留 max_files 个文件
+    - 设置 slow_threshold 时所有请求都会被采样，结束时未超过阈值的直接丢弃
+    gevent worker 中请求运行在同一线程的协程里，无法按请求采样，此时不启用。
+    """
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.slow_threshold = 0.0
+        self.interval = 0.01
+        self.directory = ''
+        self.max_files = 200
+        self._active: Dict[int, _Profile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        """
+        应用配置
+
+        Args:
+            config: PROFILER 配置（sample_rate, slow_threshold, interval, dir, max_files）
+        """
+        self.sample_rate = min(1.0, max(0.0, config.get('sample_rate', 0.0)))
+        self.slow_threshold = max(0.0, config.get('slow_threshold', 0.0))
+        self.interval = max(0.001, config.get('interval', 0.01))
+        self.directory = config.get('dir', 'profiles')
+        self.max_files = max(1, config.get('max_files', 200))
+        if not self.enabled:
+            return
+        if 'gevent.monkey' in sys.modules and sys.modules['gevent.monkey'].is_module_patched('threading'):
+            logger.warning("⚠️  Request profiler does not support gevent workers, disabled")
+            self.sample_rate = self.slow_threshold = 0.0
+            return
+        logger.info(f"Request profiler enabled: {self.directory} (sample_rate={self.sample_rate}, "
+                    f"slow_threshold={self.slow_threshold}s, interval={self.interval * 1000:.0f}ms)")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sample_rate or self.slow_threshold)
+
+    @contextmanager
+    def profile(self, label: str) -> Iterator[None]:
+        """
+        分析代码块（通常是一次 webhook 请求的处理）
+
+        Args:
+            label: 写入文件名的标签（如机器人名称）
+        """
+        sampled = self.enabled and random.random() < self.sample_rate
+        if not sampled and not self.slow_threshold:
+            yield
+            return
+
+        thread_id = threading.get_ident()
+        current = _Profile(label)
+        self._ensure_thread()
+        with self._lock:
+            self._active[thread_id] = current
+        self._wake.set()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self._active.pop(thread_id, None)
+            if sampled or duration >= self.slow_threshold:
+                metrics.inc('profiler.sampled' if sampled else 'profiler.slow')
+                self._dump(current, duration)
+
+    def _ensure_thread(self) -> None:
+        """按进程启动采样线程（fork 后重新启动）"""
+        with self._lock:
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            samples = [(current, self._stack(frames[thread_id]))
+                       for thread_id, current in active.items() if thread_id in frames]
+            del frames
+            # 计数在锁内更新，_dump 在锁内取快照，避免遍历时字典被修改
+            with self._lock:
+                for current, stack in samples:
+                    current.stacks[stack] += 1
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _stack(frame) -> Stack:
+        """调用栈（外层在前），每帧为 "函数 (文件:首行)" """
+        names: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.reverse()
+        return tuple(names)
+
+    def _dump(self, current: _Profile, duration: float) -> None:
+        """写入 folded 文件并删除超出数量上限的旧文件"""
+        with self._lock:
+            stacks = list(current.stacks.items())
+        if not stacks:
+            return
+        name = (f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident() % 100000}"
+                f"-{re.sub(r'[^A-Za-z0-9_.-]', '_', current.label)}-{int(duration * 1000)}ms{_SUFFIX}")
+        lines = ''.join(f"{';'.join(stack)} {count}\n" for stack, count in stacks)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as f:
+                f.write(lines)
+            metrics.inc('profiler.dumped')
+            self._rotate()
+        except OSError as e:
+            logger.error(f"❌ Failed to write profile: {str(e)}")
+
+    def _files(self) -> List[str]:
+        """目录中的分析文件，按修改时间从旧到新（多个 worker 共用同一目录）"""
+        try:
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                     if name.endswith(_SUFFIX)]
+        except OSError:
+            return []
+        timed = []
+        for path in paths:
+            try:
+                timed.append((os.path.getmtime(path), path))
+            except OSError:
+                continue  # 已被其他 worker 删除
+        return [path for _, path in sorted(timed)]
+
+    def _rotate(self) -> None:
+        files = self._files()
+        for path in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def report(self, top: int = 20, by: str = 'function', sort: str = 'self', limit: int = 0) -> Dict[str, Any]:
+        """
+        汇总目录中的分析文件
+
+        Args:
+            top: 返回的条目数
+            by: 'function' 按函数汇总，'file' 按源文件汇总
+            sort: 'self' 按自身采样数排序（热点），'total' 按包含子调用的采样数排序
+            limit: 只汇总最近的 limit 个文件，0 表示全部
+
+        Returns:
+            {'profiles', 'samples', 'interval', 'top': [{'name', 'self', 'self_pct', 'total', 'total_pct'}]}
+            self 为位于栈顶的采样数，total 为出现在栈中的采样数（同一栈中只计一次）
+        """
+        files = self._files()
+        if limit > 0:
+            files = files[-limit:]
+        own: Counter = Counter()
+        total: Counter = Counter()
+        samples = 0
+        for path in files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+            except OSError:
+                continue
+            for line in lines:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if not stack or not count.isdigit():
+                    continue
+                count = int(count)
+                names = stack.split(';')
+                if by == 'file':
+                    names = [name.rsplit('(', 1)[-1].rsplit(':', 1)[0] for name in names]
+                samples += count
+                own[names[-1]] += count
+                for name in set(names):
+                    total[name] += count
+
+        def pct(value: int) -> float:
+            return round(value * 100 / samples, 2) if samples else 0.0
+
+        primary, secondary = (total, own) if sort == 'total' else (own, total)
+        names = sorted(total, key=lambda name: (-primary[name], -secondary[name]))[:top]
+
+        return {
+            'profiles': len(files),
+            'samples': samples,
+            'interval': self.interval,
+            'top': [{'name': name, 'self': own[name], 'self_pct': pct(own[name]),
+                     'total': total[name], 'total_pct': pct(total[name])}
+                    for name in names],
+        }
+
+
+# 全局请求分析实例
+request_profiler = RequestProfiler()
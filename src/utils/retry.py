@@ -0,0 +1,247 @@
+# src/utils/retry.py
+"""
+POST 请求重试策略
+只重试可以安全重发的失败，遵循 Retry-After，并且所有重试都在整体截止时间内完成
+"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+from .async_http import httpx
+from .deadline import current_deadline
+from .logger import logger
+from .metrics import metrics
+
+# 上游明确表示请求未被处理的状态码（500/504 时请求可能已被处理，POST 不重试）
+RETRYABLE_STATUS = frozenset({429, 502, 503})
+
+
+def is_connect_error(error: Exception) -> bool:
+    """
+    判断是否为建立连接阶段的失败（请求尚未发出，重发不会导致重复处理）
+
+    读超时、连接被中断等请求可能已被上游处理的错误返回 False。支持 requests 与 httpx 的异常。
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if httpx is not None and isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    if (not isinstance(error, requests.exceptions.ConnectionError)
+            or isinstance(error, requests.exceptions.ReadTimeout)):
+        return False
+    reason = error.args[0] if error.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def parse_retry_after(response: Any) -> Optional[float]:
+    """
+    读取响应要求的等待时间（秒）
+
+    支持 OpenAI 兼容服务的 retry-after-ms，以及标准 Retry-After 的秒数和 HTTP 日期两种格式。
+    response 可以是 requests 或 httpx 的响应。
+    """
+    value = response.headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    POST 重试策略
+
+    - 只重试连接失败和 429/502/503，读超时等请求可能已被处理的失败不重试
+    - 等待时间优先使用 Retry-After（超过 backoff_max 时不再重试），否则为带完全抖动的指数退避: uniform(0, min(backoff_max, backoff_base * 2^n))
+    - 每次尝试的超时不超过剩余时间，下一次重试无法在截止时间前开始时直接返回最后的结果
+    """
+
+    def __init__(self, name: str, max_retries: int = 3, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, deadline: float = 0.0):
+        self.name = name
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+
+    @classmethod
+    def from_config(cls, name: str, http_config: Dict[str, Any]) -> 'RetryPolicy':
+        """
+        根据 HTTP 配置创建重试策略
+
+        Args:
+            name: 策略名称（用于日志和指标，如 llm、synology）
+            http_config: HTTP 配置（max_retries, retry_backoff, retry_backoff_max, retry_deadline）
+        """
+        return cls(
+            name,
+            max_retries=http_config.get('max_retries', 3),
+            backoff_base=http_config.get('retry_backoff', 0.5),
+            backoff_max=http_config.get('retry_backoff_max', 8.0),
+            deadline=http_config.get('retry_deadline', 0.0)
+        )
+
+    def backoff(self, retry: int) -> float:
+        """第 retry 次重试（从 1 开始）前的退避时间"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (retry - 1))))
+
+    def post(self, session: requests.Session, url: str, timeout: float,
+             deadline: Optional[float] = None, **kwargs) -> requests.Response:
+        """
+        发送 POST 请求，必要时重试
+
+        Args:
+            session: 使用的 Session
+            url: 请求地址
+            timeout: 单次尝试的超时（秒）
+            deadline: 调用方的截止时间（time.monotonic() 时间点），为空时使用当前请求的截止时间；
+                      与策略自身的 deadline 取较早者
+            **kwargs: 传给 session.post 的其他参数
+
+        Returns:
+            最后一次尝试的响应（可能是 429/502/503）
+
+        Raises:
+            requests.exceptions.Timeout: 截止时间已到时
+            requests.exceptions.RequestException: 最后一次尝试失败时
+        """
+        deadline = self._resolve_deadline(deadline)
+        host = urlsplit(url).netloc
+
+        retry = 0
+        while True:
+            attempt_timeout = self._attempt_timeout(timeout, deadline, host, retry, requests.exceptions.Timeout)
+            error: Optional[requests.exceptions.RequestException] = None
+            try:
+                response = session.post(url, timeout=attempt_timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if retry >= self.max_retries or not is_connect_error(e):
+                    self._log_result(host, retry, f"failed: {type(e).__name__}")
+                    raise
+                error = e
+                response = None
+
+            delay = self._next_delay(host, retry, deadline, error, response)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            if error is None:
+                response.close()
+            retry += 1
+            time.sleep(delay)
+
+    async def post_async(self, client: 'httpx.AsyncClient', url: str, timeout: float,
+                         deadline: Optional[float] = None, **kwargs) -> 'httpx.Response':
+        """
+        post 的异步版本（使用 httpx.AsyncClient），重试判定与等待规则相同
+
+        Raises:
+            httpx.TimeoutException: 截止时间已到时
+            httpx.HTTPError: 最后一次尝试失败时
+        """
+        deadline = self._resolve_deadline(deadline)
+        host = urlsplit(url).netloc
+
+        retry = 0
+        while True:
+            attempt_timeout = self._attempt_timeout(timeout, deadline, host, retry, httpx.TimeoutException)
+            error: Optional[Exception] = None
+            try:
+                response = await client.post(url, timeout=attempt_timeout, **kwargs)
+            except httpx.HTTPError as e:
+                if retry >= self.max_retries or not is_connect_error(e):
+                    self._log_result(host, retry, f"failed: {type(e).__name__}")
+                    raise
+                error = e
+                response = None
+
+            delay = self._next_delay(host, retry, deadline, error, response)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            if error is None:
+                await response.aclose()
+            retry += 1
+            await asyncio.sleep(delay)
+
+    def _resolve_deadline(self, deadline: Optional[float]) -> Optional[float]:
+        """调用方、当前请求与策略自身的截止时间中最早的一个"""
+        if deadline is None:
+            request_deadline = current_deadline()
+            deadline = request_deadline.expires_at if request_deadline else None
+        if self.deadline:
+            own = time.monotonic() + self.deadline
+            deadline = min(deadline, own) if deadline else own
+        return deadline
+
+    def _attempt_timeout(self, timeout: float, deadline: Optional[float], host: str, retry: int,
+                         timeout_error: type) -> float:
+        """本次尝试的超时，截止时间已到时抛出 timeout_error"""
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            metrics.inc(f"retry.{self.name}.deadline_exceeded")
+            raise timeout_error(f"Deadline exceeded after {retry} retr{'y' if retry == 1 else 'ies'} to {host}")
+        return min(timeout, remaining)
+
+    def _next_delay(self, host: str, retry: int, deadline: Optional[float],
+                    error: Optional[Exception], response: Any) -> Optional[float]:
+        """
+        判断是否重试
+
+        Returns:
+            重试前的等待时间；不再重试（结果不可重试、次数用尽或已来不及）时返回 None
+        """
+        if error is None:
+            if response.status_code not in RETRYABLE_STATUS or retry >= self.max_retries:
+                self._log_result(host, retry, f"status {response.status_code}")
+                return None
+            retry_after = parse_retry_after(response)
+            reason = f"status {response.status_code}"
+            # 服务器要求的等待超过 backoff_max：不再等待，直接返回最后的结果
+            if retry_after is not None and retry_after > self.backoff_max:
+                logger.warning(f"⚠️  Not retrying POST to {host} after {reason}: Retry-After {retry_after:.1f}s "
+                               f"exceeds backoff_max {self.backoff_max:.1f}s")
+                return None
+            delay = retry_after if retry_after is not None else self.backoff(retry + 1)
+        else:
+            reason, delay = type(error).__name__, self.backoff(retry + 1)
+
+        # 等待后已来不及再试一次：返回最后的结果
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            metrics.inc(f"retry.{self.name}.deadline_exceeded")
+            self._log_result(host, retry, f"{reason}, no time left to wait {delay:.1f}s")
+            return None
+
+        metrics.inc(f"retry.{self.name}.retries")
+        logger.warning(f"🔄 Retrying POST to {host} after {reason} in {delay:.2f}s "
+                       f"(retry {retry + 1}/{self.max_retries})")
+        return delay
+
+    def _log_result(self, host: str, retries: int, outcome: str) -> None:
+        if retries:
+            metrics.inc(f"retry.{self.name}.retried_requests")
+            logger.info(f"POST to {host} finished after {retries} retr{'y' if retries == 1 else 'ies'} ({outcome})")
@@ -0,0 +1,144 @@
+# src/utils/text.py
+"""
+文本工具模块
+"""
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数（不依赖分词器）
+
+    ASCII 字符约 4 个字符一个 token，中日韩等非 ASCII 字符约 1 个字符一个 token。
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+_FENCE_PREFIXES = ('```', '~~~')
+# 句子边界：中文标点之后，或英文标点加空白之后（分隔符保留在前一句末尾）
+_SENTENCE_BOUNDARY = re.compile(r'((?<=[。！？；])|(?<=[.!?;])\s+)')
+
+
+def _byte_len(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+def _hard_split(text: str, max_bytes: int) -> Iterator[str]:
+    """按字节上限切分（不会切断多字节字符）"""
+    data = text.encode('utf-8')
+    while data:
+        piece = data[:max_bytes].decode('utf-8', 'ignore')
+        if not piece:
+            piece = data[:4].decode('utf-8', 'ignore') or data[:1].decode('utf-8', 'replace')
+        yield piece
+        data = data[len(piece.encode('utf-8')):]
+
+
+def _pack(pieces: Iterable[str], max_bytes: int, separator: str) -> Iterator[str]:
+    """将片段贪心地拼接为不超过 max_bytes 的块"""
+    current = ''
+    for piece in pieces:
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if _byte_len(candidate) <= max_bytes:
+            current = candidate
+            continue
+        if current:
+            yield current
+        current = piece
+    if current:
+        yield current
+
+
+def _split_blocks(text: str) -> Iterator[Tuple[str, str]]:
+    """将 Markdown 文本拆分为 ('code', 代码块) 与 ('text', 段落)"""
+    paragraph: List[str] = []
+    fence: List[str] = []
+    for line in text.split('\n'):
+        if fence:
+            fence.append(line)
+            if line.strip().startswith(fence[0].strip()[:3]) and len(fence) > 1:
+                yield 'code', '\n'.join(fence)
+                fence = []
+        elif line.strip().startswith(_FENCE_PREFIXES):
+            if paragraph:
+                yield 'text', '\n'.join(paragraph)
+                paragraph = []
+            fence = [line]
+        elif not line.strip():
+            if paragraph:
+                yield 'text', '\n'.join(paragraph)
+                paragraph = []
+        else:
+            paragraph.append(line)
+    if fence:
+        yield 'code', '\n'.join(fence)
+    if paragraph:
+        yield 'text', '\n'.join(paragraph)
+
+
+def _split_code(block: str, max_bytes: int) -> Iterator[str]:
+    """超长代码块按行拆分，每段重新补齐起止围栏"""
+    lines = block.split('\n')
+    opening = lines[0]
+    closing = opening.strip()[:3]
+    body = lines[1:-1] if len(lines) > 1 and lines[-1].strip().startswith(closing) else lines[1:]
+    budget = max_bytes - _byte_len(opening) - _byte_len(closing) - 2
+    if budget <= 0:
+        yield from _hard_split(block, max_bytes)
+        return
+    pieces: List[str] = []
+    for line in body:
+        pieces.extend(_hard_split(line, budget) if _byte_len(line) > budget else [line])
+    for chunk in _pack(pieces, budget, '\n'):
+        yield f"{opening}\n{chunk}\n{closing}"
+
+
+def _split_paragraph(paragraph: str, max_bytes: int) -> Iterator[str]:
+    """超长段落按句子拆分，单句仍超长时按字节切分"""
+    parts = _SENTENCE_BOUNDARY.split(paragraph)
+    sentences = [parts[i] + (parts[i + 1] if i + 1 < len(parts) else '')
+                 for i in range(0, len(parts), 2)]
+    pieces: List[str] = []
+    for sentence in sentences:
+        if not sentence:
+            continue
+        pieces.extend(_hard_split(sentence, max_bytes) if _byte_len(sentence) > max_bytes else [sentence])
+    for chunk in _pack(pieces, max_bytes, ''):
+        yield chunk.rstrip()
+
+
+def iter_message_chunks(text: str, max_bytes: int) -> Iterator[str]:
+    """
+    按 Markdown 结构将长消息拆分为不超过 max_bytes（UTF-8 字节）的块
+
+    优先在代码块、段落边界处拆分；超长代码块按行拆分并补齐围栏，
+    超长段落按句子拆分。惰性生成，第一块可以在其余部分拆分完成前发送。
+
+    Args:
+        text: 消息文本
+        max_bytes: 每块的最大字节数，<= 0 表示不拆分
+    """
+    if max_bytes <= 0 or _byte_len(text) <= max_bytes:
+        if text:
+            yield text
+        return
+
+    def pieces() -> Iterator[str]:
+        for kind, block in _split_blocks(text):
+            if _byte_len(block) <= max_bytes:
+                yield block
+            elif kind == 'code':
+                yield from _split_code(block, max_bytes)
+            else:
+                yield from _split_paragraph(block, max_bytes)
+
+    yield from _pack(pieces(), max_bytes, '\n\n')
+
+
+def split_message(text: str, max_bytes: int) -> List[str]:
+    """按 Markdown 结构拆分长消息，见 iter_message_chunks"""
+    return list(iter_message_chunks(text, max_bytes))
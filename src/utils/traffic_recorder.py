@@ -0,0 +1,110 @@
+# src/utils/traffic_recorder.py
+"""
+流量录制
+将 /webhook 请求及上游耗时写入紧凑的 JSONL 文件，供 replay.py 回放压测
+"""
+import contextvars
+import json
+import os
+import threading
+from typing import Dict, Any, Optional
+
+from .logger import logger
+
+
+class TrafficRecorder:
+    """
+    流量录制器
+
+    每个请求一行 JSON:
+        t      请求到达时间（Unix 时间戳）
+        bot    机器人名称
+        user   用户 ID
+        token  webhook token（脱敏时为 null）
+        text   消息文本（脱敏时为 null）
+        len    消息长度（字符数）
+        up     调用 LLM 的耗时（秒），未调用时为 0
+        dur    webhook 处理总耗时（秒）
+        status HTTP 状态码
+
+    每行通过一次 O_APPEND 写入，多个 worker 进程可以安全地写同一个文件。
+    """
+
+    def __init__(self):
+        self.path = ''
+        self.redact = True
+        self._fd: Optional[int] = None
+        self._fd_pid: Optional[int] = None
+        # 当前请求调用 LLM 的累计耗时（线程与 ASGI 协程任务各自独立）
+        self._upstream: contextvars.ContextVar[float] = contextvars.ContextVar('upstream', default=0.0)
+        self._lock = threading.Lock()
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        """
+        应用配置
+
+        Args:
+            config: CAPTURE 配置（path, redact）
+        """
+        self.path = config.get('path', '')
+        self.redact = config.get('redact', True)
+        if self.path:
+            logger.info(f"Traffic capture enabled: {self.path} (redact={self.redact})")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def note_upstream(self, seconds: float) -> None:
+        """累计当前请求调用 LLM 的耗时"""
+        if self.enabled:
+            self._upstream.set(self._upstream.get() + seconds)
+
+    def record(self, form: Dict[str, Any], bot: str, status: int, duration: float,
+               received_at: float) -> None:
+        """
+        写入一条请求记录
+
+        Args:
+            form: webhook 表单数据
+            bot: 机器人名称
+            status: 返回的 HTTP 状态码
+            duration: 处理耗时（秒）
+            received_at: 请求到达时间
+        """
+        upstream = self._upstream.get()
+        self._upstream.set(0.0)
+        if not self.enabled:
+            return
+        text = form.get('text') or ''
+        entry = {
+            't': round(received_at, 3),
+            'bot': bot,
+            'user': form.get('user_id'),
+            'token': None if self.redact else form.get('token'),
+            'text': None if self.redact else text,
+            'len': len(text),
+            'up': round(upstream, 3),
+            'dur': round(duration, 3),
+            'status': status,
+        }
+        line = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        try:
+            os.write(self._open(), line)
+        except OSError as e:
+            logger.error(f"❌ Failed to write traffic capture: {str(e)}")
+
+    def _open(self) -> int:
+        """按进程打开录制文件（fork 后重新打开）"""
+        with self._lock:
+            if self._fd is None or self._fd_pid != os.getpid():
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                self._fd_pid = os.getpid()
+            return self._fd
+
+
+# 全局流量录制实例
+traffic_recorder = TrafficRecorder()
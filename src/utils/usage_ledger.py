@@ -0,0 +1,304 @@
+# src/utils/usage_ledger.py
+"""
+Token 用量账本
+记录每次 LLM 请求的 token 用量，按 日期/用户/模型 聚合，并定期批量写入 SQLite 或 CSV
+"""
+import csv
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from .logger import logger
+
+# 聚合键：(日期, 用户, 模型)
+UsageKey = Tuple[str, str, str]
+_FIELDS = ('requests', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'cost')
+
+
+def parse_model_prices(value: str) -> Dict[str, Tuple[float, float]]:
+    """
+    解析模型单价配置
+
+    格式: "gpt-4o=2.5:10,gpt-4o-mini=0.15:0.6"（每百万 prompt/completion token 的价格）
+    """
+    prices: Dict[str, Tuple[float, float]] = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        model, _, price = item.partition('=')
+        prompt_price, _, completion_price = price.partition(':')
+        try:
+            prices[model.strip()] = (float(prompt_price), float(completion_price or prompt_price))
+        except ValueError:
+            logger.warning(f"Invalid model price entry ignored: {item}")
+    return prices
+
+
+class UsageLedger:
+    """
+    Token 用量账本
+
+    record() 只向当前线程私有的队列追加一条记录，不加锁、不做 I/O；
+    后台线程按 flush_interval 汇总所有线程的队列，更新内存中的聚合结果并批量持久化。
+    """
+
+    def __init__(self):
+        self.path = ''
+        self.flush_interval = 60
+        self.model_prices: Dict[str, Tuple[float, float]] = {}
+
+        self._local = threading.local()
+        self._buffers: List[Tuple[weakref.ref, deque]] = []
+        self._buffers_lock = threading.Lock()
+        # 聚合结果（进程启动以来）与尚未持久化的增量
+        self._totals: Dict[UsageKey, Dict[str, float]] = {}
+        self._pending: Dict[UsageKey, Dict[str, float]] = {}
+        self._aggregate_lock = threading.Lock()
+        self._flusher_pid: Optional[int] = None
+        self._stop = threading.Event()
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        """
+        应用配置
+
+        Args:
+            config: USAGE 配置（ledger_path, flush_interval, model_prices）
+        """
+        self.path = config.get('ledger_path', '')
+        self.flush_interval = max(1, config.get('flush_interval', 60))
+        self.model_prices = parse_model_prices(config.get('model_prices', ''))
+        if self.path and not self.is_csv:
+            self._init_db()
+        logger.info(f"Usage ledger configured (path={self.path or 'memory only'}, "
+                    f"flush_interval={self.flush_interval}s)")
+
+    @property
+    def is_csv(self) -> bool:
+        return self.path.lower().endswith('.csv')
+
+    def record(self, user_id: str, model: str, prompt_tokens: int = 0,
+               completion_tokens: int = 0, total_tokens: int = 0,
+               cost: Optional[float] = None) -> None:
+        """
+        记录一次请求的用量（请求路径上调用，无锁无 I/O）
+
+        Args:
+            user_id: 用户唯一标识
+            model: 模型名称
+            cost: 上游返回的费用（如 Dify），为空时按 model_prices 计算
+        """
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._register_buffer()
+        buffer.append((time.time(), str(user_id), model or 'unknown',
+                       int(prompt_tokens or 0), int(completion_tokens or 0),
+                       int(total_tokens or 0), cost))
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def flush(self) -> int:
+        """
+        汇总所有线程的队列并持久化增量
+
+        Returns:
+            本次持久化的聚合行数
+        """
+        self._drain()
+        with self._aggregate_lock:
+            batch, self._pending = self._pending, {}
+        if not batch or not self.path:
+            return 0
+        try:
+            if self.is_csv:
+                self._write_csv(batch)
+            else:
+                self._write_db(batch)
+        except Exception as e:
+            logger.error(f"❌ Failed to persist usage ledger: {str(e)}")
+            # 写入失败时放回，下次重试
+            with self._aggregate_lock:
+                for key, values in batch.items():
+                    self._add(self._pending, key, values)
+            return 0
+        logger.debug(f"Usage ledger flushed {len(batch)} row(s) to {self.path}")
+        return len(batch)
+
+    def summary(self, day: Optional[str] = None, user_id: Optional[str] = None,
+                top: int = 10) -> Dict[str, Any]:
+        """
+        按 日期/模型/用户 汇总用量
+
+        配置了 SQLite 时读取持久化的全部历史，否则返回进程启动以来的内存聚合。
+        """
+        if self.path and not self.is_csv:
+            self.flush()
+            rows = self._read_db(day, user_id)
+            source = 'sqlite'
+        else:
+            self._drain()
+            with self._aggregate_lock:
+                rows = [(k[0], k[1], k[2], v) for k, v in self._totals.items()
+                        if (day is None or k[0] == day) and (user_id is None or k[1] == user_id)]
+            source = 'memory'
+
+        total: Dict[str, float] = dict.fromkeys(_FIELDS, 0)
+        by_day: Dict[str, Dict[str, float]] = {}
+        by_model: Dict[str, Dict[str, float]] = {}
+        by_user: Dict[str, Dict[str, float]] = {}
+        for row_day, row_user, row_model, values in rows:
+            for bucket in (total,
+                           by_day.setdefault(row_day, dict.fromkeys(_FIELDS, 0)),
+                           by_model.setdefault(row_model, dict.fromkeys(_FIELDS, 0)),
+                           by_user.setdefault(row_user, dict.fromkeys(_FIELDS, 0))):
+                for field in _FIELDS:
+                    bucket[field] += values[field]
+
+        top_users = sorted(by_user.items(), key=lambda item: item[1]['total_tokens'], reverse=True)[:top]
+        return {
+            'source': source,
+            'total': total,
+            'by_day': dict(sorted(by_day.items())),
+            'by_model': by_model,
+            'top_users': [{'user_id': user, **values} for user, values in top_users],
+        }
+
+    def stop(self) -> None:
+        """停止后台线程并持久化剩余数据"""
+        self._stop.set()
+        self.flush()
+
+    def _register_buffer(self) -> deque:
+        buffer: deque = deque()
+        self._local.buffer = buffer
+        with self._buffers_lock:
+            self._buffers.append((weakref.ref(threading.current_thread()), buffer))
+        return buffer
+
+    def _drain(self) -> None:
+        """取出所有线程队列中的记录并聚合（只在后台线程或查询时调用）"""
+        drained: List[tuple] = []
+        with self._buffers_lock:
+            alive = []
+            for thread_ref, buffer in self._buffers:
+                while True:
+                    try:
+                        drained.append(buffer.popleft())
+                    except IndexError:
+                        break
+                thread = thread_ref()
+                if thread is not None and thread.is_alive():
+                    alive.append((thread_ref, buffer))
+                elif buffer:
+                    alive.append((thread_ref, buffer))
+            self._buffers = alive
+        if not drained:
+            return
+
+        with self._aggregate_lock:
+            for ts, user_id, model, prompt, completion, total, cost in drained:
+                day = time.strftime('%Y-%m-%d', time.localtime(ts))
+                if cost is None:
+                    cost = self._estimate_cost(model, prompt, completion)
+                values = {'requests': 1, 'prompt_tokens': prompt, 'completion_tokens': completion,
+                          'total_tokens': total or prompt + completion, 'cost': cost}
+                key = (day, user_id, model)
+                self._add(self._totals, key, values)
+                if self.path:
+                    self._add(self._pending, key, values)
+
+    @staticmethod
+    def _add(target: Dict[UsageKey, Dict[str, float]], key: UsageKey, values: Dict[str, float]) -> None:
+        bucket = target.setdefault(key, dict.fromkeys(_FIELDS, 0))
+        for field in _FIELDS:
+            bucket[field] += values[field]
+
+    def _estimate_cost(self, model: str, prompt: int, completion: int) -> float:
+        price = self.model_prices.get(model)
+        if not price:
+            return 0.0
+        return (prompt * price[0] + completion * price[1]) / 1_000_000
+
+    def _start_flusher(self) -> None:
+        """启动后台持久化线程（fork 后在子进程中重新启动）"""
+        with self._buffers_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run, name='usage-ledger', daemon=True).start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ Usage ledger flush failed: {str(e)}")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _init_db(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage (
+                    day TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    total_tokens INTEGER NOT NULL DEFAULT 0,
+                    cost REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, user_id, model)
+                )
+            """)
+
+    def _write_db(self, batch: Dict[UsageKey, Dict[str, float]]) -> None:
+        with self._connect() as conn:
+            conn.executemany("""
+                INSERT INTO usage (day, user_id, model, requests, prompt_tokens,
+                                   completion_tokens, total_tokens, cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (day, user_id, model) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    cost = cost + excluded.cost
+            """, [(*key, *(values[field] for field in _FIELDS)) for key, values in batch.items()])
+
+    def _read_db(self, day: Optional[str], user_id: Optional[str]) -> List[tuple]:
+        query = f"SELECT day, user_id, model, {', '.join(_FIELDS)} FROM usage WHERE 1=1"
+        params: List[str] = []
+        if day:
+            query += " AND day = ?"
+            params.append(day)
+        if user_id:
+            query += " AND user_id = ?"
+            params.append(str(user_id))
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [(row[0], row[1], row[2], dict(zip(_FIELDS, row[3:]))) for row in rows]
+
+    def _write_csv(self, batch: Dict[UsageKey, Dict[str, float]]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        new_file = not os.path.exists(self.path)
+        flushed_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(('flushed_at', 'day', 'user_id', 'model') + _FIELDS)
+            for key, values in batch.items():
+                writer.writerow((flushed_at, *key, *(values[field] for field in _FIELDS)))
+
+
+# 全局用量账本实例
+usage_ledger = UsageLedger()
@@ -4,6 +4,12 @@ set -e
 echo "🚀 Starting Synology Chat Bot..."
 echo "Environment: ${ENVIRONMENT:-production}"
 
+# 分发器模式：只转发 webhook，不需要 LLM / Synology 配置
+if [ -n "$DISPATCH_BACKENDS" ]; then
+    echo "✅ Starting dispatcher for backends: ${DISPATCH_BACKENDS}"
+    exec gunicorn --config gunicorn.conf.py dispatcher:app
+fi
+
 # 快速检查关键环境变量
 echo "Checking critical environment variables..."
 if [ -z "$CHAT_API_KEY" ] || [ -z "$SYNOLOGY_INCOMING_WEBHOOK_URL" ] || [ -z "$SYNOLOGY_OUTGOING_WEBHOOK_TOKEN" ]; then
@@ -14,20 +20,12 @@ if [ -z "$CHAT_API_KEY" ] || [ -z "$SYNOLOGY_INCOMING_WEBHOOK_URL" ] || [ -z "$S
     exit 1
 fi
 
-# 测试应用导入
-echo "Testing application..."
-python -c "from app import app; print('✅ Application ready')" || {
-    echo "❌ Failed to import application"
-    exit 1
-}
+# asgi worker 运行 asgi:app，其余 worker 运行 Flask 应用
+APP_MODULE="app:app"
+if [ "${GUNICORN_WORKER_CLASS:-sync}" = "asgi" ]; then
+    APP_MODULE="asgi:app"
+fi
 
-# 启动gunicorn
-echo "✅ Starting gunicorn with ${GUNICORN_WORKERS:-1} worker..."
-exec gunicorn \
-    --bind "0.0.0.0:8008" \
-    --workers "${GUNICORN_WORKERS:-1}" \
-    --timeout "${GUNICORN_TIMEOUT:-120}" \
-    --access-logfile - \
-    --error-logfile - \
-    --log-level info \
-    app:app
\ No newline at end of file
+# 启动gunicorn（preload 模式下应用导入和 API 检测只在 master 中执行一次，失败时直接退出）
+echo "✅ Starting gunicorn with ${GUNICORN_WORKERS:-1} ${GUNICORN_WORKER_CLASS:-sync} worker(s)..."
+exec gunicorn --config gunicorn.conf.py "$APP_MODULE"
\ No newline at end of file
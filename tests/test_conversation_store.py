@@ -0,0 +1,77 @@
+# tests/test_conversation_store.py
+"""会话持久化：清理、重建与崩溃恢复"""
+import time
+
+from src.bot.conversation_store import ConversationStore
+from src.models.conversation import Conversation
+
+CONFIG = {'max_history': 10, 'timeout': 1800, 'store_flush_interval': 0.1, 'store_snapshot_interval': 3600}
+
+
+def crash(store: ConversationStore) -> None:
+    """模拟进程崩溃：不写快照，只释放日志段的文件锁"""
+    store._stop.set()
+    store._segment.close()
+
+
+def test_recreated_conversation_survives_crash(tmp_path):
+    store = ConversationStore(str(tmp_path), CONFIG)
+    old = Conversation('u1', timeout=CONFIG['timeout'])
+    store.track(old)
+    old.add_message('user', 'old question')
+    old.add_message('assistant', 'old answer')
+    store.attach(lambda: {'u1': old})
+    store.compact()
+
+    # 会话过期被清理，快照在下次 compact 前仍留在磁盘上
+    store.drop('u1')
+    store.attach(dict)
+    new = Conversation('u1', timeout=CONFIG['timeout'])
+    store.track(new)
+    new.add_message('user', 'new question')
+    store.flush()
+    crash(store)
+
+    recovered = ConversationStore(str(tmp_path), CONFIG)
+    try:
+        conversation = recovered.load('u1')
+        assert conversation is not None
+        assert conversation.messages == [{'role': 'user', 'content': 'new question'}]
+    finally:
+        recovered.stop()
+
+
+def test_expired_snapshot_keeps_seq_increasing(tmp_path):
+    store = ConversationStore(str(tmp_path), CONFIG)
+    try:
+        store._write_snapshot('u1', {'user_id': 'u1', 'seq': 7, 'last_activity': time.time() - 3600,
+                                     'messages': [{'role': 'user', 'content': 'stale'}]})
+        conversation = store.load('u1')
+        assert conversation.messages == []
+        assert conversation.seq == 7
+        conversation.add_message('user', 'hello')
+        assert conversation.seq == 8
+    finally:
+        store.stop()
+
+
+def test_selected_model_survives_spill_and_crash(tmp_path):
+    store = ConversationStore(str(tmp_path), CONFIG)
+    spilled = Conversation('u1', timeout=CONFIG['timeout'])
+    store.track(spilled)
+    spilled.add_message('user', 'hi')
+    spilled.set_model('gpt-4o')
+    store.spill(spilled)
+
+    journaled = Conversation('u2', timeout=CONFIG['timeout'])
+    store.track(journaled)
+    journaled.set_model('gpt-4o-mini')
+    store.flush()
+    crash(store)
+
+    recovered = ConversationStore(str(tmp_path), CONFIG)
+    try:
+        assert recovered.load('u1').model == 'gpt-4o'
+        assert recovered.load('u2').model == 'gpt-4o-mini'
+    finally:
+        recovered.stop()
@@ -0,0 +1,86 @@
+# tests/test_dead_letter.py
+"""死信队列：写入、失败、重投与确认"""
+import glob
+import os
+import time
+
+from src.bot.dead_letter import DeadLetterSpool
+from src.bot.delivery import ReplyDelivery
+
+# 退避足够长，测试中后台线程不会自行重投
+CONFIG = {'retry_backoff': 60.0}
+REPLY = 'first part\n\nsecond part\n\nthird part'
+
+
+class FakeHTTPClient:
+    """记录发送的块，fail 中的下标（从 0 开始计数的调用次数）返回失败"""
+
+    def __init__(self):
+        self.sent = []
+        self.calls = 0
+        self.fail = set()
+
+    def send_chat_message(self, url, text, user_ids):
+        call, self.calls = self.calls, self.calls + 1
+        if call in self.fail:
+            return False
+        self.sent.append(text)
+        return True
+
+
+def pending_files(directory):
+    return [path for path in glob.glob(os.path.join(directory, 'spool-*.jsonl')) if os.path.getsize(path)]
+
+
+def test_put_fail_redeliver_ack(tmp_path):
+    spool = DeadLetterSpool(str(tmp_path), CONFIG, 'test-ack')
+    results = [None, '']
+    spool.attach(lambda user_id, text: results.pop(0))
+    try:
+        assert spool.put(7, 'hello')
+        assert spool.redeliver() == 0
+        assert spool.has_pending(7)
+        assert spool.redeliver() == 1
+        assert not spool.has_pending(7)
+        assert pending_files(str(tmp_path)) == []
+    finally:
+        spool.stop()
+
+    recovered = DeadLetterSpool(str(tmp_path), CONFIG, 'test-ack')
+    try:
+        recovered.ensure_started()
+        assert not recovered.has_pending(7)
+    finally:
+        recovered.stop()
+
+
+def test_partial_redelivery_keeps_only_the_unsent_tail(tmp_path):
+    http = FakeHTTPClient()
+    spool = DeadLetterSpool(str(tmp_path), CONFIG, 'test-partial')
+    delivery = ReplyDelivery(http, 'http://synology', {'max_message_bytes': 15, 'chunk_retries': 0}, spool=spool)
+    try:
+        # 直接投递全部失败，整条回复写入队列
+        http.fail = {0}
+        assert not delivery.deliver(7, REPLY, spool=True)
+        assert spool.has_pending(7)
+
+        # 重投时第二块失败：只保留未送达的部分
+        http.fail = {2}
+        assert spool.redeliver() == 0
+        assert http.sent == ['first part']
+        assert spool.has_pending(7)
+        spool.stop()
+
+        # 重启后只恢复未送达的部分，送达后不重复发送第一块
+        recovered = DeadLetterSpool(str(tmp_path), CONFIG, 'test-partial')
+        delivery = ReplyDelivery(http, 'http://synology', {'max_message_bytes': 15, 'chunk_retries': 0},
+                                 spool=recovered)
+        recovered.ensure_started()  # 后台线程立即重投遗留的回复
+        deadline = time.monotonic() + 5
+        while recovered.has_pending(7) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert http.sent == ['first part', 'second part', 'third part']
+        assert not recovered.has_pending(7)
+        recovered.stop()
+    finally:
+        spool.stop()
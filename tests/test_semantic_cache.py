@@ -0,0 +1,26 @@
+# tests/test_semantic_cache.py
+"""语义缓存：关键词不同的相似问题不命中"""
+from src.bot.semantic_cache import SemanticCache
+
+
+def test_one_keyword_apart_is_a_miss():
+    cache = SemanticCache({'threshold': 0.8, 'capacity': 10}, 'test-keywords')
+    cache.add('What is the VPN address?', 'vpn.example.com')
+    assert cache.lookup('What is the wifi address?') is None
+    assert cache.add('What is the wifi address?', 'wifi.example.com')
+    assert cache.lookup('what is the wifi address') == 'wifi.example.com'
+
+
+def test_paraphrase_is_a_hit():
+    cache = SemanticCache({'threshold': 0.8, 'capacity': 10}, 'test-paraphrase')
+    cache.add('How do I reset my password?', 'Use the reset link.')
+    assert cache.lookup('how can i reset my password') == 'Use the reset link.'
+
+
+def test_chinese_one_word_apart_is_a_miss():
+    cache = SemanticCache({'threshold': 0.8, 'capacity': 10}, 'test-cjk')
+    cache.add('帮我写一封给客户的道歉邮件', '道歉邮件模板')
+    cache.add('明天上午十点开会', '好的，上午十点')
+    assert cache.lookup('帮我写一封给客户的感谢邮件') is None
+    assert cache.lookup('明天下午三点开会') is None
+    assert cache.lookup('帮我写一封给客户的道歉邮件？') == '道歉邮件模板'